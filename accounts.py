@@ -0,0 +1,289 @@
+from datetime import datetime, timezone, timedelta
+import os
+import threading
+import tracing
+from ratelimit import MAX_ATTEMPTS, rate_limiter
+
+
+DEFAULT_ROLE_NAME = 'OrganizationAccountAccessRole'
+
+# Assumed role credentials are reused until this long before they expire.
+# botocore refreshes credentials from 15 minutes before they expire, and must
+# from 10, so anything shorter would hand its refresh the same credentials.
+REFRESH_MARGIN = timedelta(minutes=15)
+
+# A client for one account and region is shared by the in use and reserved
+# collections of its service, so needs this many connections.
+CLIENT_WORKERS = 2
+
+
+class Account():
+    '''
+    An account to collect from.  If role_arn is None, the caller's own
+    credentials are used.
+    '''
+
+    def __init__(self, account_id, role_arn=None):
+        self.account_id = account_id
+        self.role_arn = role_arn
+
+    def __repr__(self):
+        return 'Account({!r}, {!r})'.format(self.account_id, self.role_arn)
+
+
+def role_arn(account_id, role_name=DEFAULT_ROLE_NAME):
+    return 'arn:aws:iam::{}:role/{}'.format(account_id, role_name)
+
+
+def load_accounts(path, role_name=DEFAULT_ROLE_NAME):
+    '''
+    Reads an account list.  Each line is an account id, optionally followed by
+    a comma and the ARN of the role to assume in it.  Blank lines and lines
+    starting with # are skipped.
+    '''
+    accounts = []
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            fields = [field.strip() for field in line.split(',')]
+            if len(fields) > 1 and fields[1]:
+                accounts.append(Account(fields[0], fields[1]))
+            else:
+                accounts.append(Account(fields[0], role_arn(fields[0], role_name)))
+    return accounts
+
+
+def organization_accounts(role_name=DEFAULT_ROLE_NAME, pool=None):
+    '''
+    Lists the active accounts of the caller's AWS Organization.
+    '''
+    if pool is None:
+        pool = session_pool()
+    client = pool.client('organizations')
+    accounts = []
+    for page in client.get_paginator('list_accounts').paginate():
+        for account in page['Accounts']:
+            if account['Status'] == 'ACTIVE':
+                accounts.append(Account(account['Id'], role_arn(account['Id'], role_name)))
+    return accounts
+
+
+class RoleCredentialProvider():
+    '''
+    A botocore credential provider for an account's role, which reads and
+    refreshes the credentials through the SessionPool, so they are assumed
+    once however many sessions use them.  It is put first in a session's
+    credential resolver.
+    '''
+    METHOD = 'sts-assume-role'
+    CANONICAL_NAME = None
+
+    def __init__(self, pool, role_arn):
+        self.pool = pool
+        self.role_arn = role_arn
+
+    def refresh(self):
+        return self.pool.assume(self.role_arn)
+
+    def load(self):
+        from botocore.credentials import RefreshableCredentials
+        return RefreshableCredentials.create_from_metadata(
+            metadata=self.refresh(), refresh_using=self.refresh, method=self.METHOD)
+
+
+def default_profile():
+    '''
+    Returns the name of the profile boto3 uses when none is given, from the
+    environment, in the order botocore reads it.
+    '''
+    return os.environ.get('AWS_DEFAULT_PROFILE') or os.environ.get('AWS_PROFILE') or 'default'
+
+
+def profile_region(profile):
+    '''
+    Returns the region boto3 uses for profile when none is given, from
+    AWS_DEFAULT_REGION or the profile in the AWS config file, or None.  The
+    file is read as botocore reads it, without loading boto3.
+    '''
+    region = os.environ.get('AWS_DEFAULT_REGION')
+    if region:
+        return region
+    import configparser
+    config = configparser.RawConfigParser()
+    try:
+        config.read(os.path.expanduser(os.environ.get('AWS_CONFIG_FILE', '~/.aws/config')))
+    except configparser.Error:
+        return None
+    sections = ['profile ' + profile] + (['default'] if profile == 'default' else [])
+    return next((config.get(section, 'region') for section in sections if config.has_option(section, 'region')), None)
+
+
+class SessionPool():
+    '''
+    Hands out boto3 clients, keeping one session per account and one client,
+    with its connection pool, per (account, region, service).  Assumed role
+    credentials are cached until shortly before they expire, and refreshed
+    in place after that, so clients can be reused for the life of the process.
+    boto3 is only imported when the first session is made, so runs answered
+    from the cache never load it.
+
+    Clients are attached to limiter, if it is given, and their connection
+    pools sized for the threads that share them: CLIENT_WORKERS for regional
+    clients, and max_workers for the ones every worker uses, such as STS.
+    '''
+
+    def __init__(self, margin=REFRESH_MARGIN, session_name='instance-count', max_workers=10, limiter=None):
+        self.margin = margin
+        self.session_name = session_name
+        self.max_workers = max_workers
+        self.limiter = limiter
+        self.lock = threading.Lock()
+        self.locks = {}
+        self.credentials = {}
+        self.sessions = {}
+        self.clients = {}
+        self._base = None
+        self._default_scope = None
+
+    def configure(self, max_workers):
+        '''
+        Sets the number of workers that share clients made from now on.
+        '''
+        self.max_workers = max_workers
+
+    def client_config(self, service, region=None):
+        from botocore.config import Config
+        return Config(
+            max_pool_connections=CLIENT_WORKERS if region is not None else max(self.max_workers, CLIENT_WORKERS),
+            retries={'mode': 'standard', 'max_attempts': MAX_ATTEMPTS})
+
+    def _lock(self, key):
+        with self.lock:
+            return self.locks.setdefault(key, threading.Lock())
+
+    def base_session(self):
+        with self._lock('base'):
+            if self._base is None:
+                import boto3.session
+                self._base = boto3.session.Session()
+            return self._base
+
+    def scope(self, region=None, account=None):
+        '''
+        Returns the (account, region) labels of a target, which key its
+        results and cache entries.  The caller's own account is labelled by
+        its profile name, and no region by the region the profile or
+        environment sets, as the clients resolve them, so changing
+        AWS_PROFILE or AWS_DEFAULT_REGION changes the labels.  Neither makes
+        calls or loads boto3.
+        '''
+        if account is not None and region is not None:
+            return (account.account_id, region)
+        with self._lock('base'):
+            if self._default_scope is None:
+                profile = default_profile()
+                self._default_scope = (profile, profile_region(profile) or 'default')
+        return (account.account_id if account is not None else self._default_scope[0],
+                region if region is not None else self._default_scope[1])
+
+    def assume(self, role_arn):
+        '''
+        Returns credential metadata for role_arn, calling STS only when there
+        is no cached copy or the cached copy is about to expire.
+        '''
+        with self._lock(('credentials', role_arn)):
+            cached = self.credentials.get(role_arn)
+            now = datetime.now(timezone.utc)
+            if cached is not None and cached['expiration'] - self.margin > now:
+                return cached['metadata']
+
+            with tracing.span('assume_role', 'credentials', role=role_arn):
+                response = self.client('sts').assume_role(RoleArn=role_arn, RoleSessionName=self.session_name)
+            creds = response['Credentials']
+            metadata = {
+                'access_key': creds['AccessKeyId'],
+                'secret_key': creds['SecretAccessKey'],
+                'token': creds['SessionToken'],
+                'expiry_time': creds['Expiration'].isoformat()
+            }
+            self.credentials[role_arn] = {'expiration': creds['Expiration'], 'metadata': metadata}
+            return metadata
+
+    def session(self, account=None):
+        '''
+        Returns the boto3 session for an account.  None is the caller's own
+        account.
+        '''
+        if account is None or account.role_arn is None:
+            return self.base_session()
+
+        key = account.account_id
+        with self._lock(('session', key)):
+            if key not in self.sessions:
+                import boto3.session
+                import botocore.session
+                core = botocore.session.Session()
+                core.get_component('credential_provider').insert_before('env', RoleCredentialProvider(self, account.role_arn))
+                self.sessions[key] = boto3.session.Session(botocore_session=core)
+            return self.sessions[key]
+
+    def client(self, service, region=None, account=None):
+        session = self.session(account)
+        account_id = account.account_id if account is not None else None
+        key = (account_id, region, service)
+        # Sessions are not thread safe, so clients are created one at a time
+        # per session.  The clients themselves are.
+        with self._lock(('clients', account_id)):
+            if key not in self.clients:
+                with tracing.span('create_client', 'credentials', service=service, region=region, account=account_id):
+                    client = session.client(service, region_name=region, config=self.client_config(service, region))
+                    if self.limiter is not None:
+                        # Labelled as the target is, so fastparse shares the buckets
+                        self.limiter.attach(client, self.scope(region, account)[0])
+                    self.clients[key] = client
+            return self.clients[key]
+
+    def lazy_client(self, service, region=None, account=None):
+        return LazyClient(self, service, region, account)
+
+
+class LazyClient():
+    '''
+    Stands in for a pooled client, and only creates it on first use.  Cache
+    hits therefore never create sessions or assume roles.  scope names the
+    account and region the client is for.
+    '''
+
+    def __init__(self, pool, service, region=None, account=None):
+        self.pool = pool
+        self.service = service
+        self.region = region
+        self.account = account
+        self.scope = pool.scope(region, account)
+        self._client = None
+
+    def resolve(self):
+        if self._client is None:
+            self._client = self.pool.client(self.service, self.region, self.account)
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def session_pool():
+    '''
+    Returns the process wide SessionPool, whose clients share the process
+    wide rate limiter.
+    '''
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SessionPool(limiter=rate_limiter())
+        return _pool
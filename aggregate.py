@@ -0,0 +1,125 @@
+from array import array
+import operator
+import sys
+import threading
+
+
+class TypeCodes():
+    '''
+    Interns instance type names as small integer codes, shared by every Counts
+    in the process, so counts can be held in arrays indexed by code.
+    '''
+    __slots__ = ('codes', 'names', 'lock')
+
+    def __init__(self):
+        self.codes = {}
+        self.names = []
+        self.lock = threading.Lock()
+
+    def code(self, name):
+        code = self.codes.get(name)
+        if code is None:
+            with self.lock:
+                code = self.codes.get(name)
+                if code is None:
+                    code = len(self.names)
+                    self.names.append(sys.intern(name))
+                    self.codes[name] = code
+        return code
+
+    def name(self, code):
+        return self.names[code]
+
+
+TYPE_CODES = TypeCodes()
+
+
+def _padded(counts, size):
+    '''
+    Extends an array of counts with zeros, in place, to at least size.
+    '''
+    if len(counts) < size:
+        counts.frombytes(bytes(counts.itemsize * (size - len(counts))))
+    return counts
+
+
+class Counts():
+    '''
+    Counts by instance type, held in an array indexed by type code.  It reads
+    like a dict of type name to count, iterating in type name order so the
+    order does not depend on which thread saw a type first.
+    '''
+    __slots__ = ('counts', 'total')
+
+    def __init__(self):
+        self.counts = array('q')
+        self.total = 0
+
+    def add(self, name, value=1):
+        code = TYPE_CODES.code(name)
+        if code >= len(self.counts):
+            _padded(self.counts, code + 1)
+        self.counts[code] += value
+        self.total += value
+
+    def get(self, name, default=0):
+        code = TYPE_CODES.codes.get(name)
+        if code is None or code >= len(self.counts) or self.counts[code] == 0:
+            return default
+        return self.counts[code]
+
+    def merge(self, other):
+        '''
+        Adds the counts of another Counts to this one.  The cost depends on
+        the number of instance types, not the number of instances.
+        '''
+        size = max(len(self.counts), len(other.counts))
+        _padded(self.counts, size)
+        self.counts = array('q', map(operator.add, self.counts, _padded(array('q', other.counts), size)))
+        self.total += other.total
+        return self
+
+    def copy(self):
+        result = Counts()
+        result.counts = array('q', self.counts)
+        result.total = self.total
+        return result
+
+    def keys(self):
+        names = TYPE_CODES.names
+        return sorted(names[code] for code, count in enumerate(self.counts) if count)
+
+    def items(self):
+        return [(name, self.get(name)) for name in self.keys()]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, name):
+        return self.get(name) != 0
+
+    def __len__(self):
+        return sum(1 for count in self.counts if count)
+
+
+class Shards():
+    '''
+    Counts per (account, region) cell.  Merging results for different cells
+    just adds references to the other Shards' Counts; a cell is only copied
+    when both sides have it.
+    '''
+    __slots__ = ('cells',)
+
+    def __init__(self):
+        self.cells = {}
+
+    def add(self, key, counts):
+        self.cells[key] = counts
+
+    def merge(self, other):
+        for key, counts in other.cells.items():
+            if key in self.cells:
+                self.cells[key] = self.cells[key].copy().merge(counts)
+            else:
+                self.cells[key] = counts
+        return self
@@ -0,0 +1,246 @@
+'''
+Collection for asyncio programs.  The collections of instance_count are
+filled here from aiobotocore clients, so an event loop is never blocked on
+AWS, and many pages can be in flight at once, across every account, region
+and call, up to a bound set by max_in_flight.  The results are the same
+collections collect() makes, so they merge, match and format the same way.
+
+    async with aio.open_clients('ec2', ['us-east-1', 'eu-west-1']) as clients:
+        for scope, client in clients.items():
+            instances, r_instances = await aio.collect_ec2_info(client)
+
+Requests go through the process wide rate limiter, as threaded runs do.
+Cached records are read and written on a worker thread.  Unlike the
+threaded path, concurrent misses for the same key are not collapsed into
+one call.  The streaming parser of --fast-parse is not used, since
+aiobotocore reads responses itself.
+'''
+from collections import Counter
+from contextlib import AsyncExitStack, asynccontextmanager
+import asyncio
+try:
+    from aiobotocore.config import AioConfig
+    from aiobotocore.credentials import AioRefreshableCredentials
+    from aiobotocore.session import get_session
+except ImportError as e:
+    raise ImportError("aio needs aiobotocore, which is not installed.  Install it with 'pip install aiobotocore'") from e
+from accounts import CLIENT_WORKERS, RoleCredentialProvider, session_pool
+from ratelimit import MAX_ATTEMPTS, rate_limiter
+import tracing
+from instance_count import (DEFAULT_HORIZONS, Instances, ReservedInstances, RdsInstances, ReservedRdsInstances, TABLES,
+                            merge_collections)
+
+
+# Pages fetched at once, over every collection sharing a bound
+DEFAULT_IN_FLIGHT = 256
+
+
+class ScopedClient():
+    '''
+    An aiobotocore client that knows the account and region it is for, as
+    a LazyClient does, so collections key the cache and their shards by them.
+    '''
+
+    def __init__(self, client, account):
+        self.client = client
+        self.scope = (account, client.meta.region_name)
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+class AioRoleCredentialProvider(RoleCredentialProvider):
+    '''
+    A RoleCredentialProvider for aiobotocore, whose resolver awaits load().
+    '''
+
+    async def refresh(self):
+        return await asyncio.to_thread(self.pool.assume, self.role_arn)
+
+    async def load(self):
+        return AioRefreshableCredentials.create_from_metadata(
+            metadata=await self.refresh(), refresh_using=self.refresh, method=self.METHOD)
+
+
+async def account_session(account=None):
+    '''
+    Returns an aiobotocore session for an account.  None, or an account
+    without a role, is the caller's own credentials.  Roles are assumed by
+    the process wide SessionPool on a worker thread, so its cached
+    credentials are shared with threaded runs.
+    '''
+    session = get_session()
+    if account is not None and account.role_arn is not None:
+        session.get_component('credential_provider').insert_before('env', AioRoleCredentialProvider(session_pool(), account.role_arn))
+    return session
+
+
+@asynccontextmanager
+async def open_clients(service, targets, max_pool_connections=CLIENT_WORKERS):
+    '''
+    Opens an aiobotocore client of service for every target, attached to the
+    rate limiter, and yields them in a dict keyed by (account label, region),
+    labelled as SessionPool.scope() labels them.  Targets are regions, or
+    (account, region) pairs, where an account is an Account or None.  The
+    clients are closed on exit.
+    '''
+    config = AioConfig(max_pool_connections=max_pool_connections,
+                       retries={'mode': 'standard', 'max_attempts': MAX_ATTEMPTS})
+    sessions = {}
+    clients = {}
+    async with AsyncExitStack() as stack:
+        for target in targets:
+            account, region = target if isinstance(target, tuple) else (None, target)
+            account_id = account.account_id if account is not None else None
+            if account_id not in sessions:
+                sessions[account_id] = await account_session(account)
+            with tracing.span('create_client', 'credentials', service=service, region=region, account=account_id):
+                client = await stack.enter_async_context(
+                    sessions[account_id].create_client(service, region_name=region, config=config))
+            label = session_pool().scope(client.meta.region_name, account)[0]
+            rate_limiter().attach_async(client, label)
+            clients[(label, client.meta.region_name)] = ScopedClient(client, label)
+        yield clients
+
+
+async def _fetch(collection, operation, fetch, in_flight):
+    '''
+    Awaits one page, while holding a place in in_flight, and counts it.
+    Returns None after the last page.
+    '''
+    async with in_flight:
+        with tracing.span('page', 'aws', operation=operation) as span:
+            page = await fetch()
+            if page is None:
+                span.drop()
+                return None
+            metadata = page.get('ResponseMetadata', {})
+            span.set('retries', metadata.get('RetryAttempts', 0))
+            span.set('bytes', int(metadata.get('HTTPHeaders', {}).get('content-length', 0)))
+    collection.pages += 1
+    return page
+
+
+async def _paginate(collection, operation, in_flight, **kwargs):
+    '''
+    Yields the pages of a call, as InstancesBase.paginate() does.
+    '''
+    client = collection.client
+    if client.can_paginate(operation):
+        pages = client.get_paginator(operation).paginate(PaginationConfig=collection.paginator_config(), **kwargs).__aiter__()
+
+        async def fetch():
+            try:
+                return await pages.__anext__()
+            except StopAsyncIteration:
+                return None
+
+        while True:
+            page = await _fetch(collection, operation, fetch, in_flight)
+            if page is None:
+                return
+            yield page
+
+    while kwargs is not None:
+        page = await _fetch(collection, operation, lambda: getattr(client, operation)(**kwargs), in_flight)
+        yield page
+        kwargs = collection.next_params(kwargs, page)
+
+
+async def _pages(collection, in_flight):
+    spec = getattr(collection, 'spec', None)
+    if spec is None or spec.names is None:
+        async for page in _paginate(collection, collection.operation, in_flight, **collection.page_params()):
+            yield page
+        return
+    list_pages = [page async for page in _paginate(collection, spec.names[0], in_flight)]
+    for params in collection.batch_params(list_pages):
+        async for page in _paginate(collection, collection.operation, in_flight, **params):
+            yield page
+
+
+async def _records(collection, in_flight):
+    counts = Counter()
+    async for page in _pages(collection, in_flight):
+        for item in collection.page_items(page):
+            counts[collection.record(item)] += 1
+    return counts
+
+
+async def collect(collection, in_flight=None):
+    '''
+    Fills a collection from its aiobotocore client, or the cache, as
+    collect() does, and returns it.  in_flight is an asyncio.Semaphore
+    bounding the pages fetched at once.
+    '''
+    if in_flight is None:
+        in_flight = asyncio.Semaphore(DEFAULT_IN_FLIGHT)
+    cache = collection.cache
+    scope = collection.scope()
+    with tracing.span(collection.operation, 'collect', account=scope[0], region=scope[1]) as span:
+        counts = None
+        if cache is not None:
+            counts = await asyncio.to_thread(cache.get, collection.cache_id())
+        if counts is not None:
+            cache.hits += 1
+        else:
+            counts = await _records(collection, in_flight)
+            if cache is not None:
+                cache.misses += 1
+                await asyncio.to_thread(cache.put, collection.cache_id(), counts)
+        collection.items += sum(counts.values())
+        collection.add_records(counts)
+        span.set('items', collection.items)
+        span.set('pages', collection.pages)
+    collection.add_shards()
+    return collection
+
+
+async def collect_ec2_info(client, page_size=None, cache=None, horizons=DEFAULT_HORIZONS, max_in_flight=DEFAULT_IN_FLIGHT):
+    in_flight = asyncio.Semaphore(max_in_flight)
+    return tuple(await asyncio.gather(
+        collect(Instances(client, page_size, cache), in_flight),
+        collect(ReservedInstances(client, page_size, cache, horizons), in_flight)))
+
+
+async def collect_rds_info(client, page_size=None, cache=None, horizons=DEFAULT_HORIZONS, max_in_flight=DEFAULT_IN_FLIGHT):
+    in_flight = asyncio.Semaphore(max_in_flight)
+    return tuple(await asyncio.gather(
+        collect(RdsInstances(client, page_size, cache), in_flight),
+        collect(ReservedRdsInstances(client, page_size, cache, horizons), in_flight)))
+
+
+async def collect_service(service, clients, page_size=None, cache=None, horizons=DEFAULT_HORIZONS, group_by=(),
+                          max_in_flight=DEFAULT_IN_FLIGHT, in_flight=None):
+    '''
+    Collects the table of a service from every client of open_clients(), and
+    returns (title, (in use, per-target in use), (reserved, per-target
+    reserved)), as CollectionScheduler.results() yields them.
+    '''
+    title, name, service, in_use, reserved = next(table for table in TABLES if table[2] == service)
+    if in_flight is None:
+        in_flight = asyncio.Semaphore(max_in_flight)
+    keys = list(clients)
+    collections = await asyncio.gather(
+        *(collect(in_use(clients[key], page_size, cache, group_by=group_by), in_flight) for key in keys),
+        *(collect(reserved(clients[key], page_size, cache, horizons=horizons), in_flight) for key in keys))
+    in_use_results = dict(zip(keys, collections[:len(keys)]))
+    reserved_results = dict(zip(keys, collections[len(keys):]))
+    return (title,
+            (merge_collections(list(in_use_results.values())), in_use_results),
+            (merge_collections(list(reserved_results.values())), reserved_results))
+
+
+async def collect_tables(services, targets, page_size=None, cache=None, horizons=DEFAULT_HORIZONS, group_by=(),
+                         max_in_flight=DEFAULT_IN_FLIGHT):
+    '''
+    Collects the tables of several services from every target at once,
+    sharing one bound on the pages in flight, and returns them in the order
+    of services.  Targets are as open_clients() takes them.
+    '''
+    in_flight = asyncio.Semaphore(max_in_flight)
+    async with AsyncExitStack() as stack:
+        clients = [await stack.enter_async_context(open_clients(service, targets)) for service in services]
+        return list(await asyncio.gather(*(
+            collect_service(service, service_clients, page_size, cache, horizons, group_by, in_flight=in_flight)
+            for service, service_clients in zip(services, clients))))
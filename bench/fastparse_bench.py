@@ -0,0 +1,132 @@
+'''
+Compares the streaming parser in fastparse with botocore's parser on a
+synthetic describe_instances response.  Run from the repository root:
+
+    python -m bench.fastparse_bench --instances 50000
+'''
+import argparse
+import time
+import tracemalloc
+import fastparse
+
+
+NAMESPACE = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+TYPES = ['m5.large', 'm5.xlarge', 'm5.2xlarge', 'c5.large', 'c5.4xlarge', 'r5.large', 't3.micro', 't3.medium']
+
+INSTANCE = '''<item>
+<instanceId>i-{n:017x}</instanceId><imageId>ami-0123456789abcdef0</imageId>
+<instanceState><code>16</code><name>running</name></instanceState>
+<privateDnsName>ip-10-0-{a}-{b}.ec2.internal</privateDnsName><dnsName/>
+<keyName>deploy</keyName><amiLaunchIndex>0</amiLaunchIndex>
+<instanceType>{type}</instanceType>{lifecycle}
+<launchTime>2024-01-01T00:00:00.000Z</launchTime>
+<placement><availabilityZone>us-east-1a</availabilityZone><groupName/><tenancy>default</tenancy></placement>
+<monitoring><state>disabled</state></monitoring>
+<subnetId>subnet-0123456789abcdef0</subnetId><vpcId>vpc-0123456789abcdef0</vpcId>
+<privateIpAddress>10.0.{a}.{b}</privateIpAddress>
+<groupSet><item><groupId>sg-0123456789abcdef0</groupId><groupName>default</groupName></item></groupSet>
+<architecture>x86_64</architecture><rootDeviceType>ebs</rootDeviceType><rootDeviceName>/dev/xvda</rootDeviceName>
+<blockDeviceMapping><item><deviceName>/dev/xvda</deviceName><ebs><volumeId>vol-{n:017x}</volumeId><status>attached</status>
+<attachTime>2024-01-01T00:00:00.000Z</attachTime><deleteOnTermination>true</deleteOnTermination></ebs></item></blockDeviceMapping>
+<virtualizationType>hvm</virtualizationType>
+<tagSet><item><key>Name</key><value>web-{n}</value></item><item><key>Team</key><value>platform</value></item></tagSet>
+<hypervisor>xen</hypervisor>
+<networkInterfaceSet><item><networkInterfaceId>eni-{n:017x}</networkInterfaceId><subnetId>subnet-0123456789abcdef0</subnetId>
+<vpcId>vpc-0123456789abcdef0</vpcId><ownerId>111111111111</ownerId><status>in-use</status>
+<privateIpAddress>10.0.{a}.{b}</privateIpAddress><sourceDestCheck>true</sourceDestCheck>
+<groupSet><item><groupId>sg-0123456789abcdef0</groupId><groupName>default</groupName></item></groupSet>
+<attachment><attachmentId>eni-attach-{n:017x}</attachmentId><deviceIndex>0</deviceIndex><status>attached</status>
+<attachTime>2024-01-01T00:00:00.000Z</attachTime><deleteOnTermination>true</deleteOnTermination></attachment>
+<privateIpAddressesSet><item><privateIpAddress>10.0.{a}.{b}</privateIpAddress><primary>true</primary></item></privateIpAddressesSet>
+</item></networkInterfaceSet>
+<ebsOptimized>false</ebsOptimized>
+</item>'''
+
+
+def synthetic_response(instances, per_reservation=4):
+    '''
+    Returns a describe_instances response body with the given number of
+    instances, one in twenty of them spot.
+    '''
+    parts = ['<?xml version="1.0" encoding="UTF-8"?>\n<DescribeInstancesResponse xmlns="{}">'.format(NAMESPACE),
+             '<requestId>00000000-0000-0000-0000-000000000000</requestId><reservationSet>']
+    for n in range(instances):
+        if n % per_reservation == 0:
+            if n:
+                parts.append('</instancesSet></item>')
+            parts.append('<item><reservationId>r-{:017x}</reservationId><ownerId>111111111111</ownerId><instancesSet>'.format(n))
+        lifecycle = '<instanceLifecycle>spot</instanceLifecycle>' if n % 20 == 0 else ''
+        parts.append(INSTANCE.format(n=n, a=(n >> 8) & 255, b=n & 255, type=TYPES[n % len(TYPES)], lifecycle=lifecycle))
+    if instances:
+        parts.append('</instancesSet></item>')
+    parts.append('</reservationSet></DescribeInstancesResponse>')
+    return ''.join(parts).encode('utf-8')
+
+
+def chunks(body, size=fastparse.CHUNK_SIZE):
+    for i in range(0, len(body), size):
+        yield body[i:i + size]
+
+
+def fast_path(body):
+    counts = {}
+    for item in fastparse.parse_records(chunks(body), ('instanceType', 'instanceLifecycle')):
+        if isinstance(item, tuple) or item.get('instanceLifecycle') is not None:
+            continue
+        counts[item['instanceType']] = counts.get(item['instanceType'], 0) + 1
+    return counts
+
+
+def botocore_path(body):
+    import botocore.session
+    from botocore.parsers import create_parser
+    shape = botocore.session.get_session().get_service_model('ec2').operation_model('DescribeInstances').output_shape
+    parsed = create_parser('ec2').parse({'body': body, 'headers': {}, 'status_code': 200}, shape)
+    counts = {}
+    for reservation in parsed['Reservations']:
+        for instance in reservation['Instances']:
+            if 'InstanceLifecycle' not in instance:
+                counts[instance['InstanceType']] = counts.get(instance['InstanceType'], 0) + 1
+    return counts
+
+
+def measure(fn, body):
+    '''
+    Times fn, then runs it again under tracemalloc for its peak memory, since
+    tracing slows it down too much to time it at the same time.
+    '''
+    start = time.perf_counter()
+    result = fn(body)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    fn(body)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the fastparse EC2 path against botocore')
+    parser.add_argument("--instances", type=int, default=50000, help='Number of instances in the synthetic response')
+    args = parser.parse_args()
+
+    body = synthetic_response(args.instances)
+    print('{} instances, {:.1f} MB response'.format(args.instances, len(body) / 1e6))
+    print('{:<12}{:>12}{:>16}'.format('Path', 'Seconds', 'Peak MB'))
+
+    results = []
+    for name, fn in (('fastparse', fast_path), ('botocore', botocore_path)):
+        try:
+            counts, elapsed, peak = measure(fn, body)
+        except ImportError as e:
+            print('{:<12}skipped: {}'.format(name, e))
+            continue
+        results.append(counts)
+        print('{:<12}{:>12.3f}{:>16.1f}'.format(name, elapsed, peak / 1e6))
+
+    if len(results) == 2 and results[0] != results[1]:
+        raise SystemExit('fastparse and botocore counts differ: {} != {}'.format(results[0], results[1]))
+
+
+if __name__ == '__main__':
+    main()
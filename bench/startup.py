@@ -0,0 +1,100 @@
+'''
+Checks the startup cost of instance_count with python -X importtime.  Each
+case imports instance_count, and the formatter for one protocol, in a fresh
+interpreter, and fails if the imports take longer than the budget or load a
+module the case should not need, such as boto3 before any collection, or
+colorama for HTML.  Run from the repository root:
+
+    python -m bench.startup
+    python -m bench.startup --budget-ms 150 --repeat 5
+
+Exits with status 1 if any case is over budget or loads a forbidden module.
+'''
+import argparse
+import os
+import subprocess
+import sys
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BUDGET_MS = 200
+
+# protocol: modules that must not be imported to render it
+CASES = {
+    'html': ('boto3', 'botocore', 'colorama', 'pyarrow', 'numpy'),
+    'html-compact': ('boto3', 'botocore', 'colorama', 'pyarrow', 'numpy', 'local_html'),
+    'termio': ('boto3', 'botocore', 'pyarrow', 'numpy'),
+    'jsonl': ('boto3', 'botocore', 'colorama', 'pyarrow', 'numpy'),
+    'metrics': ('boto3', 'botocore', 'colorama', 'pyarrow', 'numpy')
+}
+
+SCRIPT = 'import instance_count, formatter; formatter.formatter_class({!r})'
+
+
+def import_times(protocol):
+    '''
+    Runs one case in a fresh interpreter, and returns the cumulative import
+    time in microseconds of every top level module it imported, by name.
+    Raises RuntimeError with the last line of the error if the imports fail.
+    '''
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', SCRIPT.format(protocol)],
+                            cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if name.startswith('  '):
+            # Imported by another module, and counted in its cumulative time
+            times.setdefault(name.strip(), 0)
+            continue
+        times[name.strip()] = times.get(name.strip(), 0) + int(cumulative)
+    return times
+
+
+def run_case(protocol, repeat):
+    '''
+    Returns the best total import time in milliseconds over repeat runs, and
+    the modules loaded by the last one.
+    '''
+    best = None
+    for _ in range(repeat):
+        times = import_times(protocol)
+        total = sum(times.values()) / 1000
+        best = total if best is None else min(best, total)
+    return (best, times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the import time of instance_count against a budget')
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help='Most milliseconds the imports of a case may take. Defaults to {}'.format(DEFAULT_BUDGET_MS))
+    parser.add_argument("--repeat", type=int, default=3, help='Runs of each case. The best time is kept')
+    parser.add_argument("--protocols", type=lambda value: value.split(','), default=list(CASES), help='Comma separated protocols to check. Defaults to all of {}'.format(','.join(CASES)))
+    args = parser.parse_args()
+
+    failed = False
+    for protocol in args.protocols:
+        try:
+            millis, times = run_case(protocol, args.repeat)
+        except RuntimeError as e:
+            print('FAILED {}: {}'.format(protocol, e), file=sys.stderr)
+            failed = True
+            continue
+        loaded = [module for module in CASES.get(protocol, ()) if module in times]
+        print('  {:<20}{:>10.1f}ms'.format(protocol, millis))
+        if millis > args.budget_ms:
+            print('OVER BUDGET {}: {:.1f}ms > {:.1f}ms'.format(protocol, millis, args.budget_ms), file=sys.stderr)
+            failed = True
+        if loaded:
+            print('UNNEEDED IMPORTS {}: {}'.format(protocol, ', '.join(loaded)), file=sys.stderr)
+            failed = True
+
+    if failed:
+        sys.exit(1)
+    print('Every case imports in under {:.0f}ms'.format(args.budget_ms))
+
+
+if __name__ == '__main__':
+    main()
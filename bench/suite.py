@@ -0,0 +1,276 @@
+'''
+Times each stage of a run against synthetic fleets: collection (pagination
+and record counting in the collect methods), parsing of describe_instances pages
+by fastparse, merging per-region collections, batched expiry aggregation, and
+rendering with TermioFormatter and HtmlFormatter.  AWS is replaced by
+SyntheticClient, a stand-in that answers describe_* calls from pre-built
+pages, so only this tool's own work is timed.  Run from the repository root:
+
+    python -m bench.suite --fleets 100x10,10000x100,100000x1000
+    python -m bench.suite --save bench/baseline.json
+    python -m bench.suite --check bench/baseline.json --threshold 0.5
+
+A fleet is given as INSTANCESxRESERVATIONS.  --check exits with status 1 if
+any stage is more than threshold slower than its baseline.
+'''
+import argparse
+from datetime import datetime, timedelta, timezone
+import json
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import fastparse
+import instance_count
+from bench.fastparse_bench import synthetic_response, chunks
+from formatter.formatter import FormatConfig
+from formatter.html import HtmlFormatter
+from formatter.sinks import MemorySink
+from formatter.termio import TermioFormatter
+
+
+DEFAULT_FLEETS = '100x10,10000x100,100000x1000'
+STAGES = ['collect_instances', 'collect_reserved', 'parse', 'merge', 'expiries', 'render_termio', 'render_html']
+FAMILIES = ['m5', 'm6i', 'm7g', 'c5', 'c6i', 'c7g', 'r5', 'r6i', 'r7g', 't3', 't4g', 'i3', 'x2idn', 'g5', 'p4d']
+SIZES = ['nano', 'micro', 'small', 'medium', 'large', 'xlarge', '2xlarge', '4xlarge', '8xlarge', '12xlarge', '16xlarge', '24xlarge', 'metal']
+PAGE_SIZE = 1000
+PARSE_PAGE = synthetic_response(PAGE_SIZE)
+
+
+def instance_types(count):
+    return ['{}.{}'.format(family, size) for size in SIZES for family in FAMILIES][:count]
+
+
+class SyntheticPaginator():
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, PaginationConfig=None, **kwargs):
+        return iter(self.pages)
+
+
+class SyntheticClient():
+    '''
+    Answers describe_instances and describe_reserved_instances for one region
+    of a synthetic fleet, from pages built up front.  Instances are shared
+    between pages, so a million instance fleet does not need a million dicts.
+    '''
+
+    def __init__(self, region, instances, reservations, types, seed=0):
+        rng = random.Random(seed)
+        self.meta = SimpleNamespace(region_name=region)
+        pool = [
+            {
+                'InstanceId': 'i-{:017x}'.format(n),
+                'InstanceType': rng.choice(types),
+                'State': {'Code': 16, 'Name': 'running'},
+                'Placement': {'AvailabilityZone': region + 'a', 'Tenancy': 'default'},
+                'LaunchTime': datetime(2024, 1, 1, tzinfo=timezone.utc)
+            }
+            for n in range(min(instances, PAGE_SIZE))
+        ]
+        for n in range(0, len(pool), 20):
+            pool[n]['InstanceLifecycle'] = 'spot'
+        self.instance_pages = []
+        for start in range(0, instances, PAGE_SIZE):
+            count = min(PAGE_SIZE, instances - start)
+            self.instance_pages.append({'Reservations': [{'Instances': pool[:count]}]})
+
+        now = datetime.now(timezone.utc)
+        self.reserved = [
+            {
+                'InstanceType': rng.choice(types),
+                'InstanceCount': rng.randint(1, 8),
+                'Scope': 'Region',
+                'ProductDescription': 'Linux/UNIX',
+                'InstanceTenancy': 'default',
+                'End': now + timedelta(days=rng.randint(0, 1095), hours=rng.randint(0, 23))
+            }
+            for n in range(reservations)
+        ]
+
+    def can_paginate(self, operation):
+        return operation == 'describe_instances'
+
+    def get_paginator(self, operation):
+        return SyntheticPaginator(self.instance_pages)
+
+    def describe_reserved_instances(self, **kwargs):
+        return {'ReservedInstances': self.reserved}
+
+
+class Fleet():
+    '''
+    A synthetic fleet of instances and reservations, split across regions.
+    '''
+
+    def __init__(self, instances, reservations, regions=16):
+        self.instances = instances
+        self.reservations = reservations
+        self.types = instance_types(max(8, min(len(FAMILIES) * len(SIZES), instances // 200)))
+        regions = max(1, min(regions, instances // PAGE_SIZE or 1))
+        self.clients = [
+            SyntheticClient('r{}'.format(n), _share(instances, regions, n), _share(reservations, regions, n), self.types, seed=n)
+            for n in range(regions)
+        ]
+
+    @property
+    def name(self):
+        return '{}x{}'.format(self.instances, self.reservations)
+
+
+def _share(total, parts, n):
+    return total // parts + (1 if n < total % parts else 0)
+
+
+def stage_collect_instances(fleet):
+    return [instance_count.Instances(client).collect() for client in fleet.clients]
+
+
+def stage_collect_reserved(fleet):
+    return [instance_count.ReservedInstances(client).collect() for client in fleet.clients]
+
+
+def stage_parse(fleet):
+    pages = -(-fleet.instances // PAGE_SIZE)
+    for page in range(pages):
+        for item in fastparse.parse_records(chunks(PARSE_PAGE), ('instanceType', 'instanceLifecycle')):
+            pass
+
+
+def stage_merge(fleet, in_use, reserved):
+    return (instance_count.merge_collections(in_use), instance_count.merge_collections(reserved))
+
+
+def stage_expiries(fleet):
+    expiries = instance_count.ExpiryPeriods()
+    for client in fleet.clients:
+        keys = [item['InstanceType'] for item in client.reserved]
+        counts = [item['InstanceCount'] for item in client.reserved]
+        ends = [item['End'] for item in client.reserved]
+        expiries.add_many(keys, counts, ends)
+    return expiries
+
+
+def render(cls, instances, r_instances, by_region):
+    formatter = cls(FormatConfig(MemorySink()))
+    formatter.format_table('EC2 Instances', instances, r_instances)
+    formatter.format_breakdown('EC2 Instances by Region', 'Region', by_region)
+    formatter.format()
+    formatter.cfg.close()
+
+
+def run_fleet(fleet, repeat, stages=STAGES):
+    '''
+    Runs each of stages repeat times, and returns the best time of each.
+    Stages that others depend on are always run, but only timed if asked for.
+    '''
+    timings = {}
+
+    def timed(name, fn, *args):
+        if name not in stages:
+            return fn(*args) if name in ('collect_instances', 'collect_reserved', 'merge') else None
+        best = None
+        for n in range(repeat):
+            start = time.perf_counter()
+            result = fn(*args)
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+        return result
+
+    in_use = timed('collect_instances', stage_collect_instances, fleet)
+    reserved = timed('collect_reserved', stage_collect_reserved, fleet)
+    timed('parse', stage_parse, fleet)
+    instances, r_instances = timed('merge', stage_merge, fleet, in_use, reserved)
+    timed('expiries', stage_expiries, fleet)
+
+    by_region = {
+        i.scope()[1]: (i, r) for i, r in zip(in_use, reserved)
+    }
+    timed('render_termio', render, TermioFormatter, instances, r_instances, by_region)
+    timed('render_html', render, HtmlFormatter, instances, r_instances, by_region)
+    return timings
+
+
+def parse_fleets(value):
+    fleets = []
+    for spec in value.split(','):
+        instances, _, reservations = spec.partition('x')
+        try:
+            fleets.append((int(instances), int(reservations or 0)))
+        except ValueError:
+            raise argparse.ArgumentTypeError('bad fleet {!r}. Use INSTANCESxRESERVATIONS'.format(spec))
+    return fleets
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f).get('fleets', {})
+
+
+def save_baseline(path, results):
+    baseline = load_baseline(path)
+    baseline.update(results)
+    with open(path, 'w') as f:
+        json.dump({'version': 1, 'fleets': baseline}, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def regressions(baseline, results, threshold, min_seconds):
+    '''
+    Returns (fleet, stage, baseline, seconds) for every stage more than
+    threshold slower than its baseline.  Stages slower by less than min_seconds
+    are ignored, as timer noise.
+    '''
+    slower = []
+    for fleet, timings in results.items():
+        for stage, seconds in timings.items():
+            before = baseline.get(fleet, {}).get(stage)
+            if before is None:
+                continue
+            if seconds > before * (1 + threshold) and seconds - before > min_seconds:
+                slower.append((fleet, stage, before, seconds))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark collection, aggregation and rendering on synthetic fleets')
+    parser.add_argument("--fleets", type=parse_fleets, default=parse_fleets(DEFAULT_FLEETS), help='Comma separated INSTANCESxRESERVATIONS fleets. Defaults to {}'.format(DEFAULT_FLEETS))
+    parser.add_argument("--regions", type=int, default=16, help='Number of regions to split each fleet across')
+    parser.add_argument("--repeat", type=int, default=3, help='Runs of each stage. The best time is kept')
+    parser.add_argument("--save", help='Write the results to this baseline file')
+    parser.add_argument("--check", help='Compare the results with this baseline file')
+    parser.add_argument("--stages", type=lambda value: value.split(','), default=STAGES, help='Comma separated stages to time. Defaults to all of {}'.format(','.join(STAGES)))
+    parser.add_argument("--threshold", type=float, default=0.5, help='Fraction slower than the baseline that fails --check')
+    parser.add_argument("--min-seconds", type=float, default=0.005, help='Ignore slowdowns smaller than this many seconds')
+    args = parser.parse_args()
+
+    results = {}
+    for instances, reservations in args.fleets:
+        fleet = Fleet(instances, reservations, args.regions)
+        timings = run_fleet(fleet, args.repeat, args.stages)
+        results[fleet.name] = timings
+        print('{} instances, {} reservations, {} types, {} regions'.format(instances, reservations, len(fleet.types), len(fleet.clients)))
+        for stage, seconds in timings.items():
+            print('  {:<20}{:>10.4f}s'.format(stage, seconds))
+
+    if args.check:
+        baseline = load_baseline(args.check)
+        slower = regressions(baseline, results, args.threshold, args.min_seconds)
+        for fleet, stage, before, seconds in slower:
+            print('REGRESSION {} {}: {:.4f}s -> {:.4f}s ({:+.0%})'.format(fleet, stage, before, seconds, seconds / before - 1), file=sys.stderr)
+        if slower:
+            sys.exit(1)
+        print('No stage is more than {:.0%} slower than {}'.format(args.threshold, args.check))
+
+    if args.save:
+        save_baseline(args.save, results)
+
+
+if __name__ == '__main__':
+    main()
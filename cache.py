@@ -0,0 +1,216 @@
+from collections import Counter
+import hashlib
+import json
+import os
+import pickle
+import struct
+import tempfile
+import time
+import zlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+DEFAULT_PATH = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'instance-count')
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+# Entries written longer ago than this are removed, with their locks, whatever
+# --max-age is.  Reads do not extend it, since an entry is only read while it
+# is younger than --max-age.
+DEFAULT_TTL = 24 * 60 * 60
+
+MAGIC = b'ICC1'
+HEADER = struct.Struct('<4sd')
+SUFFIX = '.entry'
+LOCK_SUFFIX = '.lock'
+
+
+def cache_key(*parts):
+    '''
+    Returns a file name safe key for a (account, region, api, filters) tuple.
+    '''
+    text = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ResponseCache():
+    '''
+    A persistent cache of collected records, with one file per key.
+    Each entry holds a Counter of records, so its size depends on the number of
+    distinct records and not on the size of the fleet.  Entries are written
+    atomically, and a per-key lock makes concurrent misses for the same key
+    wait for the first one to fill it rather than all calling AWS.
+    '''
+
+    def __init__(self, path=DEFAULT_PATH, max_age=300, refresh=False, max_bytes=DEFAULT_MAX_BYTES, ttl=DEFAULT_TTL):
+        self.path = path
+        self.max_age = max_age
+        self.refresh = refresh
+        self.max_bytes = max_bytes
+        self.ttl = max(ttl, max_age)
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(path, mode=0o700, exist_ok=True)
+
+    def _file(self, key):
+        return os.path.join(self.path, key + SUFFIX)
+
+    def get(self, key):
+        '''
+        Returns the Counter stored under key, or None if there is no entry or
+        it is older than max_age.  An entry that cannot be read, such as one
+        cut short by a full disk, is removed and treated as missing.
+        '''
+        if self.refresh:
+            return None
+        path = self._file(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        if len(data) < HEADER.size:
+            _remove(path)
+            return None
+        magic, created = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            _remove(path)
+            return None
+        if time.time() - created > self.max_age:
+            return None
+        try:
+            return pickle.loads(zlib.decompress(data[HEADER.size:]))
+        except (zlib.error, pickle.UnpicklingError, EOFError):
+            _remove(path)
+            return None
+
+    def put(self, key, records):
+        data = HEADER.pack(MAGIC, time.time()) + zlib.compress(pickle.dumps(records, pickle.HIGHEST_PROTOCOL))
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(tmp, self._file(key))
+        except BaseException:
+            os.unlink(tmp)
+            raise
+        self.evict()
+
+    def fetch(self, key, records):
+        '''
+        Returns the Counter stored under key.  On a miss, the records iterable
+        is counted, stored and returned.
+        '''
+        counts = self.get(key)
+        if counts is not None:
+            self.hits += 1
+            return counts
+
+        with self._locked(key):
+            # Another process may have filled the entry while we waited.
+            counts = self.get(key) if not self.refresh else None
+            if counts is None:
+                self.misses += 1
+                counts = Counter(records)
+                self.put(key, counts)
+            else:
+                self.hits += 1
+        return counts
+
+    def _locked(self, key):
+        return _FileLock(os.path.join(self.path, key + LOCK_SUFFIX))
+
+    def evict(self):
+        '''
+        Removes entries older than the ttl, then the oldest entries until the
+        cache is no larger than max_bytes.  The lock of each removed entry is
+        removed with it, as are locks older than the ttl that never got an
+        entry.
+        '''
+        entries = []
+        locks = []
+        now = time.time()
+        for entry in os.scandir(self.path):
+            if entry.name.endswith(LOCK_SUFFIX):
+                locks.append(entry)
+                continue
+            if not entry.name.endswith(SUFFIX):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl:
+                self._remove_entry(entry.path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        for mtime, entry_size, path in sorted(entries):
+            if size <= self.max_bytes:
+                break
+            self._remove_entry(path)
+            size -= entry_size
+
+        for lock in locks:
+            try:
+                stale = now - lock.stat().st_mtime > self.ttl
+            except FileNotFoundError:
+                continue
+            if stale and not os.path.exists(lock.path[:-len(LOCK_SUFFIX)] + SUFFIX):
+                _remove_lock(lock.path)
+
+    def _remove_entry(self, path):
+        _remove(path)
+        _remove_lock(path[:-len(SUFFIX)] + LOCK_SUFFIX)
+
+
+def _remove(path):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def _remove_lock(path):
+    '''
+    Removes a lock file, unless a fetch is holding it.
+    '''
+    if fcntl is None:
+        _remove(path)
+        return
+    try:
+        f = open(path, 'rb')
+    except FileNotFoundError:
+        return
+    with f:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        _remove(path)
+
+
+class _FileLock():
+    '''
+    An exclusive advisory lock on a file.  Without fcntl it does nothing.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        if fcntl is not None:
+            self.file = open(self.path, 'a')
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self.file is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+            self.file.close()
+            self.file = None
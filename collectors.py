@@ -0,0 +1,163 @@
+'''
+Declarative collectors for the services whose items only need a type, a
+count and, for reservations, an end date read out of them.  Each service is
+a pair of CollectorSpecs, one for what is in use and one for what is
+reserved.  A spec is compiled once into extractor functions, and run by the
+SpecInstances and SpecReservations collections in instance_count, so every
+service shares the same paging, concurrency and caching.
+'''
+from datetime import timedelta
+
+
+def getter(path):
+    '''
+    Returns a function that reads a dotted path, such as
+    'ClusterConfig.InstanceType', from an item, or None where any part of it
+    is missing.  A callable is returned as it is.
+    '''
+    if path is None or callable(path):
+        return path
+    keys = path.split('.')
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda item: item.get(key)
+
+    def get(item):
+        for key in keys:
+            item = item.get(key)
+            if item is None:
+                return None
+        return item
+    return get
+
+
+class CollectorSpec():
+    '''
+    Describes one describe_* call and how to read its items.
+
+    operation   the client method, such as describe_reserved_cache_nodes
+    items       the key of the list of items in each response page
+    type        path of the instance or node type
+    count       path of the number of instances or nodes, a function of the
+                item, or None for one per item
+    end         path of the end date of a reservation, or None to add
+                duration seconds to start
+    where       {path: accepted values} that items must have, such as
+                {'State': ('active',)}
+    params      arguments of every call
+    page_limits (min, max) page size of the paginator
+    token       (argument, response key) of the next page token, for calls
+                without a paginator
+    names       (list operation, response key, name path, argument, batch)
+                for calls that describe named resources, batch names at a
+                time
+    dimensions  {dimension: path} of the --group-by dimensions, such as az
+    tags        path of the [{'Key': ..., 'Value': ...}] tag list
+    '''
+
+    def __init__(self, operation, items, type, count=None, end=None, start=None, duration=None, where=None,
+                 params=None, page_limits=None, token=None, names=None, dimensions=None, tags=None):
+        self.operation = operation
+        self.items = items
+        self.type = type
+        self.count = count
+        self.end = end
+        self.start = start
+        self.duration = duration
+        self.where = where or {}
+        self.params = params or {}
+        self.page_limits = page_limits
+        self.token = token
+        self.names = names
+        self.dimensions = dimensions or {}
+        self.tags = tags
+
+    @property
+    def reserved(self):
+        return self.end is not None or self.start is not None
+
+
+class Extractors():
+    '''
+    A CollectorSpec compiled into functions of an item.
+    '''
+
+    def __init__(self, spec):
+        self.type = getter(spec.type)
+        count = getter(spec.count)
+        self.count = count if count is not None else (lambda item: 1)
+        if spec.end is not None:
+            self.end = getter(spec.end)
+        elif spec.start is not None:
+            start = getter(spec.start)
+            duration = getter(spec.duration)
+            self.end = lambda item: start(item) + timedelta(seconds=duration(item))
+        else:
+            self.end = None
+        self.where = [(getter(path), frozenset(values)) for path, values in spec.where.items()]
+        self.dimensions = {dimension: getter(path) for dimension, path in spec.dimensions.items()}
+        self.tags = getter(spec.tags)
+
+    def keep(self, item):
+        for get, values in self.where:
+            if get(item) not in values:
+                return False
+        return True
+
+    def fields(self, item, dimensions):
+        '''
+        Returns the values of the named dimensions of an item, by dimension,
+        with the type always available.
+        '''
+        fields = {'type': self.type(item)}
+        for dimension in dimensions:
+            get = self.dimensions.get(dimension)
+            if get is not None:
+                fields[dimension] = get(item)
+        return fields
+
+
+def _memorydb_nodes(cluster):
+    return sum(shard.get('NumberOfNodes', 0) for shard in cluster.get('Shards', ()))
+
+
+ACTIVE = {'State': ('active',)}
+
+# service: (title, stats name, in use spec, reserved spec)
+SPECS = {
+    'rds': ('RDS Instances', 'RDS', CollectorSpec(
+        'describe_db_instances', 'DBInstances', 'DBInstanceClass', page_limits=(20, 100),
+        dimensions={'az': 'AvailabilityZone', 'engine': 'Engine'}, tags='TagList'
+    ), CollectorSpec(
+        'describe_reserved_db_instances', 'ReservedDBInstances', 'DBInstanceClass', count='DBInstanceCount',
+        start='StartTime', duration='Duration', where=ACTIVE, page_limits=(20, 100)
+    )),
+    'elasticache': ('ElastiCache Nodes', 'ElastiCache', CollectorSpec(
+        'describe_cache_clusters', 'CacheClusters', 'CacheNodeType', count='NumCacheNodes', page_limits=(20, 100),
+        dimensions={'az': 'PreferredAvailabilityZone', 'engine': 'Engine'}
+    ), CollectorSpec(
+        'describe_reserved_cache_nodes', 'ReservedCacheNodes', 'CacheNodeType', count='CacheNodeCount',
+        start='StartTime', duration='Duration', where=ACTIVE, page_limits=(20, 100)
+    )),
+    'redshift': ('Redshift Nodes', 'Redshift', CollectorSpec(
+        'describe_clusters', 'Clusters', 'NodeType', count='NumberOfNodes', page_limits=(20, 100),
+        dimensions={'az': 'AvailabilityZone'}, tags='Tags'
+    ), CollectorSpec(
+        'describe_reserved_nodes', 'ReservedNodes', 'NodeType', count='NodeCount',
+        start='StartTime', duration='Duration', where=ACTIVE, page_limits=(100, 100)
+    )),
+    'opensearch': ('OpenSearch Instances', 'OpenSearch', CollectorSpec(
+        'describe_domains', 'DomainStatusList', 'ClusterConfig.InstanceType', count='ClusterConfig.InstanceCount',
+        names=('list_domain_names', 'DomainNames', 'DomainName', 'DomainNames', 5)
+    ), CollectorSpec(
+        'describe_reserved_instances', 'ReservedInstances', 'InstanceType', count='InstanceCount',
+        start='StartTime', duration='Duration', where=ACTIVE, token=('NextToken', 'NextToken')
+    )),
+    'memorydb': ('MemoryDB Nodes', 'MemoryDB', CollectorSpec(
+        'describe_clusters', 'Clusters', 'NodeType', count=_memorydb_nodes, params={'ShowShardDetails': True},
+        token=('NextToken', 'NextToken')
+    ), CollectorSpec(
+        'describe_reserved_nodes', 'ReservedNodes', 'NodeType', count='NodeCount',
+        start='StartTime', duration='Duration', where=ACTIVE, token=('NextToken', 'NextToken')
+    ))
+}
@@ -0,0 +1,196 @@
+'''
+An opt-in fast path for the EC2 describe_* calls.  Rather than letting
+botocore parse the whole response into nested dicts, the signed Query API
+request is sent directly and the XML body is parsed as it streams in.  Only
+the fields the collectors count are kept, and each page is dropped once it has
+been read.
+'''
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from xml.etree.ElementTree import XMLPullParser
+import tracing
+from ratelimit import MAX_ATTEMPTS, THROTTLE_CODES, rate_limiter
+
+
+CHUNK_SIZE = 64 * 1024
+
+
+class FastParseError(Exception):
+    def __init__(self, status, code, message):
+        super().__init__('{} {}: {}'.format(status, code, message))
+        self.status = status
+        self.code = code
+        self.message = message
+
+
+def query_params(action, version, filters=None, page_size=None, token=None):
+    '''
+    Builds the Query API parameters for an EC2 describe_* call.  filters uses
+    the same [{'Name': ..., 'Values': [...]}] form as boto3.
+    '''
+    params = {'Action': action, 'Version': version}
+    for i, f in enumerate(filters or [], 1):
+        params['Filter.{}.Name'.format(i)] = f['Name']
+        for j, value in enumerate(f['Values'], 1):
+            params['Filter.{}.Value.{}'.format(i, j)] = value
+    if page_size is not None:
+        params['MaxResults'] = str(page_size)
+    if token is not None:
+        params['NextToken'] = token
+    return params
+
+
+def parse_records(chunks, fields):
+    '''
+    Parses an XML response from an iterable of byte chunks.  Every <item> with
+    the first of fields as a direct child is a record.  Yields a dict of the
+    fields of each record, then a final ('nextToken', value) pair, which is
+    None on the last page.
+    Items are cleared as soon as they end, so memory use does not grow with the
+    size of the response.
+    '''
+    parser = XMLPullParser(events=('start-ns', 'end'))
+    tags = None
+    token = None
+    error = {}
+
+    for chunk in chunks:
+        parser.feed(chunk)
+        for event, elem in parser.read_events():
+            if event == 'start-ns':
+                # The default namespace comes first, before any element
+                if tags is None and elem[0] == '':
+                    tags = _tags(elem[1], fields)
+                continue
+            if tags is None:
+                tags = _tags('', fields)
+            tag = elem.tag
+            if tag == tags['item']:
+                values = [elem.findtext(field_tag) for field_tag in tags['fields']]
+                if values[0] is not None:
+                    yield dict(zip(fields, values))
+                elem.clear()
+            elif tag == tags['nextToken']:
+                token = elem.text
+            elif tag == tags['Code'] or tag == tags['Message']:
+                error[tag.rsplit('}', 1)[-1]] = elem.text
+    parser.close()
+
+    if error:
+        raise FastParseError(None, error.get('Code'), error.get('Message'))
+    yield ('nextToken', token)
+
+
+def _tags(namespace, fields):
+    prefix = '{{{}}}'.format(namespace) if namespace else ''
+    tags = {name: prefix + name for name in ('item', 'nextToken', 'Code', 'Message')}
+    # Fields may be paths such as placement/availabilityZone
+    tags['fields'] = ['/'.join(prefix + part for part in field.split('/')) for field in fields]
+    return tags
+
+
+def parse_timestamp(value):
+    '''
+    Parses an EC2 timestamp such as 2024-01-31T12:00:00.000Z.
+    '''
+    value = value.rstrip('Z')
+    fmt = '%Y-%m-%dT%H:%M:%S.%f' if '.' in value else '%Y-%m-%dT%H:%M:%S'
+    return datetime.strptime(value, fmt).replace(tzinfo=timezone.utc)
+
+
+def _send(client, params):
+    '''
+    Signs and sends a Query API request with the client's credentials,
+    endpoint and connection pool.  Returns the streaming response.
+    '''
+    from botocore.auth import SigV4Auth
+    from botocore.awsrequest import AWSRequest
+    request = AWSRequest(
+        method='POST',
+        url=client.meta.endpoint_url,
+        data=urlencode(params),
+        headers={'Content-Type': 'application/x-www-form-urlencoded; charset=utf-8'},
+        # Otherwise the session reads the whole body before returning
+        stream_output=True)
+    # botocore does not expose these publicly.  The signer holds the same
+    # (possibly refreshable) credentials, and the endpoint the connection pool.
+    credentials = client._request_signer._credentials.get_frozen_credentials()
+    SigV4Auth(credentials, client.meta.service_model.signing_name, client.meta.region_name).add_auth(request)
+    return client._endpoint.http_session.send(request.prepare())
+
+
+def _error(response):
+    body = response.content
+    try:
+        list(parse_records([body], ('Code',)))
+    except FastParseError as e:
+        return FastParseError(response.status_code, e.code, e.message)
+    return FastParseError(response.status_code, None, body[:200])
+
+
+def _send_limited(client, bucket, params):
+    '''
+    Sends a request when the rate limiter allows, and again after each
+    throttle, up to MAX_ATTEMPTS times.  Raises FastParseError for any other
+    error.
+    '''
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        bucket.acquire()
+        response = _send(client, params)
+        if response.status_code == 200:
+            bucket.succeeded()
+            return response
+        error = _error(response)
+        if error.code not in THROTTLE_CODES or attempt == MAX_ATTEMPTS:
+            raise error
+        bucket.throttled()
+
+
+def query(client, action, fields, filters=None, page_size=None, on_page=None):
+    '''
+    Runs an EC2 describe_* call, following nextToken, and yields the requested
+    fields of every record, as parse_records does.  on_page is called once per
+    page.
+    '''
+    version = client.meta.service_model.api_version
+    # A LazyClient names its account, which its bucket is shared with
+    account = getattr(client, 'scope', (None,))[0]
+    bucket = rate_limiter().bucket(account, client.meta.region_name, 'ec2', action)
+    token = None
+    while True:
+        # The span includes the time the caller spends on each record, since
+        # records are handed over as the page is read.
+        with tracing.span('page', 'aws', operation=action) as span:
+            response = _send_limited(client, bucket, query_params(action, version, filters, page_size, token))
+            if on_page is not None:
+                on_page()
+            token = None
+            for record in parse_records(_counted(_stream(response), span), fields):
+                if isinstance(record, tuple):
+                    token = record[1]
+                else:
+                    span.add('items')
+                    yield record
+        if not token:
+            return
+
+
+def _stream(response):
+    '''
+    Yields the body of a streamed response in chunks, and hands its
+    connection back to the pool once the body has been read.  A connection
+    left part way through a body is closed instead.
+    '''
+    raw = response.raw
+    try:
+        yield from raw.stream(CHUNK_SIZE)
+    except BaseException:
+        raw.close()
+        raise
+    raw.release_conn()
+
+
+def _counted(chunks, span):
+    for chunk in chunks:
+        span.add('bytes', len(chunk))
+        yield chunk
@@ -0,0 +1,25 @@
+'''
+The formatters, by protocol.  A formatter's module is only imported when its
+protocol is used, so colorama, pyarrow and the rest are only loaded for the
+outputs that need them.
+'''
+from importlib import import_module
+
+
+# protocol: (module, class)
+FORMATTERS = {
+    'html': ('formatter.html', 'HtmlFormatter'),
+    'html-compact': ('formatter.html_compact', 'CompactHtmlFormatter'),
+    'termio': ('formatter.termio', 'TermioFormatter'),
+    'jsonl': ('formatter.jsonl', 'JsonLinesFormatter'),
+    'csv': ('formatter.csv', 'CsvFormatter'),
+    'arrow': ('formatter.arrow', 'ArrowFormatter'),
+    'metrics': ('formatter.prometheus', 'PrometheusFormatter')
+}
+
+PROTOCOLS = list(FORMATTERS)
+
+
+def formatter_class(protocol):
+    module, name = FORMATTERS[protocol]
+    return getattr(import_module(module), name)
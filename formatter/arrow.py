@@ -0,0 +1,85 @@
+import pyarrow as pa
+from formatter.formatter import Formatter, report_rows, row_columns
+
+
+class _BinaryOutput():
+    '''
+    The file-like object pyarrow writes to, passing bytes on to cfg.
+    '''
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.closed = False
+
+    def write(self, data):
+        self.cfg.write_bytes(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+
+class ArrowFormatter(Formatter):
+    '''
+    Writes an Arrow IPC file, with one row per (account, region, type) cell,
+    that other tools can memory-map.  Rows are written in record batches of
+    batch_size as they are produced.  The expiry columns follow the horizons
+    of the first table, or horizons if there are no tables, which still
+    makes a valid file with no rows.
+    '''
+
+    def __init__(self, cfg, batch_size=64 * 1024, horizons=()):
+        super().__init__(cfg)
+        self.batch_size = batch_size
+        self.horizons = tuple(horizons)
+        self.writer = None
+        self.schema = None
+        self.batch = []
+
+    def _open(self, horizons):
+        fields = [
+            pa.field('table', pa.string()),
+            pa.field('account', pa.string()),
+            pa.field('region', pa.string()),
+            pa.field('type', pa.string())
+        ]
+        fields.extend([
+            pa.field('reserved', pa.int64()),
+            pa.field('in_use', pa.int64()),
+            # Fractional where a size-flexible reservation is partly used
+            pa.field('delta', pa.float64())
+        ])
+        fields.extend(pa.field(name, pa.int64()) for name in row_columns(horizons)[7:])
+        self.schema = pa.schema(fields)
+        self.writer = pa.ipc.new_file(pa.PythonFile(_BinaryOutput(self.cfg), mode='w'), self.schema)
+
+    def _write_batch(self):
+        if self.batch:
+            columns = list(zip(*self.batch))
+            self.writer.write_batch(pa.record_batch([pa.array(column, type=field.type) for column, field in zip(columns, self.schema)], schema=self.schema))
+            self.batch = []
+
+    def format_table(self, title, instances, r_instances):
+        if self.writer is None:
+            self._open(r_instances.expiries.horizons)
+        for row in report_rows(title, instances, r_instances):
+            self.batch.append(row)
+            if len(self.batch) >= self.batch_size:
+                self._write_batch()
+
+    def format_breakdown(self, title, key_title, breakdown):
+        # Every row already has its account and region
+        pass
+
+    def format_rollup(self, title, key_title, rows):
+        # Rollups have different columns to the table rows
+        pass
+
+    def format(self):
+        if self.writer is None:
+            self._open(self.horizons)
+        self._write_batch()
+        self.writer.close()
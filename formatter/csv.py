@@ -0,0 +1,31 @@
+import csv
+from formatter.formatter import Formatter, report_rows, row_columns
+
+
+class CsvFormatter(Formatter):
+    '''
+    Writes a header and one CSV row per (account, region, type) cell, as each
+    table is formatted.
+    '''
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.writer = csv.writer(cfg, lineterminator='\n')
+        self.columns = None
+
+    def format_table(self, title, instances, r_instances):
+        if self.columns is None:
+            self.columns = row_columns(r_instances.expiries.horizons)
+            self.writer.writerow(self.columns)
+        self.writer.writerows(report_rows(title, instances, r_instances))
+
+    def format_breakdown(self, title, key_title, breakdown):
+        # Every row already has its account and region
+        pass
+
+    def format_rollup(self, title, key_title, rows):
+        # Rollups have different columns to the table rows
+        pass
+
+    def format(self):
+        pass
@@ -1,13 +1,23 @@
 import sys
+from matching import cell_rows
 
 
 class FormatConfig():
-    def __init__(self, file=None):
+    '''
+    Where formatted output goes.  Writes are collected and passed to file in
+    batches of about buffer_size characters, so call flush() or close() when
+    done.  file can be any object with a write method, such as a sink.
+    '''
+
+    def __init__(self, file=None, buffer_size=64 * 1024):
         if file is None:
             self.file = sys.stdout
         else:
             self.file = file
         self.indent = 0
+        self.buffer = []
+        self.buffered = 0
+        self.buffer_size = buffer_size
 
     def inc(self):
         self.indent += 1
@@ -22,9 +32,53 @@ class FormatConfig():
         return '{}'.format('\t' * self.indent)
 
     def write(self, str):
-        self.file.write(str)
+        self.buffer.append(str)
+        self.buffered += len(str)
+        if self.buffered >= self.buffer_size:
+            self.flush()
+        return self
+
+    def write_chunks(self, chunks):
+        '''
+        Writes an iterable of strings.
+        '''
+        for chunk in chunks:
+            self.write(chunk)
+        return self
+
+    def write_bytes(self, data):
+        '''
+        Writes binary data, after anything already written.  file must have
+        a write_bytes method, as sinks do.
+        '''
+        self.flush()
+        self.file.write_bytes(data)
+        return self
+
+    def flush(self):
+        if self.buffer:
+            self.file.write(''.join(self.buffer))
+            self.buffer = []
+            self.buffered = 0
         return self
 
+    def close(self):
+        '''
+        Flushes, and closes file if it has a close method and is not stdout.
+        '''
+        self.flush()
+        if self.file is not sys.stdout and hasattr(self.file, 'close'):
+            self.file.close()
+
+    def abort(self):
+        '''
+        Drops anything not yet written, and aborts file if it is a sink.
+        '''
+        self.buffer = []
+        self.buffered = 0
+        if hasattr(self.file, 'abort'):
+            self.file.abort()
+
     def startline(self, str=None, tab='\t'):
         self.write(tab * self.indent)
         if str is not None:
@@ -44,3 +98,33 @@ class Formatter():
     def __init__(self, cfg):
         self.cfg = cfg
 
+
+def row_columns(horizons):
+    '''
+    Returns the column names of the rows yielded by report_rows.
+    '''
+    columns = ['table', 'account', 'region', 'type', 'reserved', 'in_use', 'delta']
+    columns.extend('expiring_{}d'.format(days) for days in horizons)
+    columns.append('expiring_later')
+    return columns
+
+
+def report_rows(title, instances, r_instances):
+    '''
+    Yields a row for every (account, region, type) cell of a table, with
+    the reserved, in use and matched delta counts and what expires in each
+    horizon, in row_columns order.  Rows are produced one cell at a time.
+    '''
+    r_cells = r_instances.shards.cells
+    iu_cells = instances.shards.cells
+    horizons = r_instances.expiries.horizons
+    for cell in list(r_cells) + [cell for cell in iu_cells if cell not in r_cells]:
+        expiries = r_instances.expiry_shards.get(cell)
+        for key, reserved, in_use, delta in cell_rows(instances, r_instances, cell):
+            row = [title, cell[0], cell[1], key, reserved, in_use, delta]
+            counts = None
+            if expiries is not None and key in expiries.expiries:
+                counts = expiries.expiries[key].counts
+            row.extend(counts if counts is not None else [0] * (len(horizons) + 1))
+            yield row
+
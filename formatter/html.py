@@ -1,5 +1,16 @@
+from html import escape
+from matching import breakdown_gaps, match_gaps, match_rows, match_totals, rounded
 from formatter.formatter import Formatter, FormatConfig
 from local_html.elements import *
+from local_html.html_base import StreamingElement
+
+
+def text(value):
+    '''
+    Escapes a value for the page.  Keys such as tag values are set by anyone
+    who can tag a resource, so must never be read as markup.
+    '''
+    return escape(value) if isinstance(value, str) else value
 
 
 STYLES = [
@@ -19,7 +30,13 @@ STYLES = [
 
 
 class HtmlFormatter(Formatter):
-    def __init__(self, cfg):
+    '''
+    Formats tables as a Materialize styled page.  With streaming, each row is
+    written as soon as it is formatted, instead of the whole page being built
+    first, so memory use does not grow with the number of rows.
+    '''
+
+    def __init__(self, cfg, streaming=False):
         super().__init__(cfg)
 
         self.down_arrow = '<i class="material-icons blue-text" style="font-size:22px;">arrow_downward</i>'
@@ -28,6 +45,8 @@ class HtmlFormatter(Formatter):
         self.hline = '<i class="material-icons">face</i>'
 
         self.container = div(clazz='container')
+        if streaming:
+            self.container = StreamingElement(cfg, self.container)
 
         self.html = html().has([
             head().has([
@@ -45,6 +64,19 @@ class HtmlFormatter(Formatter):
             ])
         ])
 
+        self.stream = None
+        self.row_templates = {}
+        if streaming:
+            # Write the page up to the container now, and the rest in format()
+            self.stream = self.html.render(cfg.indent)
+            cfg.write_chunks(self._until_container())
+
+    def _until_container(self):
+        for chunk in self.stream:
+            if chunk is StreamingElement.STREAM:
+                return
+            yield chunk
+
     def _format_expiry_period(self, expiries, period):
         classes = 'col s2 l1 right-align '
         if expiries.totals.get(period) == 0:
@@ -54,10 +86,8 @@ class HtmlFormatter(Formatter):
         banner_days = ''
         multi = ' days'
 
-        if period == 'month':
-            banner_days = '30'
-        elif period == 'week':
-            banner_days = '7'
+        if period > 1:
+            banner_days = str(period)
         else:
             pre_days = ''
             banner_days = 'today'
@@ -84,7 +114,7 @@ class HtmlFormatter(Formatter):
                 total += val
                 self.container.has([
                     div(clazz="row").has([
-                        div(clazz='col s2 l1 left-align key-col ', single_line=True).has(key),
+                        div(clazz='col s2 l1 left-align key-col ', single_line=True).has(text(key)),
                         div(clazz=classes, single_line=True).has(val)
                     ])
                 ])
@@ -96,76 +126,133 @@ class HtmlFormatter(Formatter):
         ])
 
     def format_expiries(self, expiries):
-        if len(expiries.expiries.keys()) == 0:
+        if expiries.upcoming() == 0:
             self.container.has([
-                div().has(span().has('No instances expire in the next 30 days'))
+                div().has(span().has('No instances expire in the next {} days'.format(expiries.horizons[-1])))
             ])
             return
 
-        self._format_expiry_period(expiries, 'month')
-        self._format_expiry_period(expiries, 'week')
-        self._format_expiry_period(expiries, 'day')
+        # Longest horizon first
+        for period in reversed(expiries.horizons):
+            self._format_expiry_period(expiries, period)
 
-    def format_row(self, col1, col2, col3, col4, col_classes=''):
+    def _row(self, col1, col2, col3, col4, col_classes, sign):
+        '''
+        Builds a row.  sign is the sign of col4 if it is a number, which sets
+        the colour and arrow, or None.
+        '''
         classes = 'col s2 l1 right-align ' + col_classes
         i_class = 'material-icons'
         i_style = 'font-size:15px;'
         icon = 'arrow_upward'
         col4_classes = classes
         col5 = None
-        if isinstance(col4, int):
-            if col4 > 0:
+        if sign is not None:
+            if sign > 0:
                 col4_classes += ' red-text'
                 i_class += ' red-text'
                 icon = 'arrow_upward'
-            elif col4 < 0:
+            elif sign < 0:
                 col4_classes += ' blue-text'
                 i_class += ' blue-text'
                 icon = 'arrow_downward'
             col5 = div(clazz='col s1 m2 r1 left-align', single_line=True, style='padding-left:0 !Important;').has(i(icon, clazz=i_class, style=i_style))
 
-        self.container.has([
-            div(clazz='row').has([
-                div(clazz='col s2 l1 left-align key-col ' + col_classes, single_line=True).has(col1),
-                div(clazz=classes, single_line=True).has(col2),
-                div(clazz=classes, single_line=True).has(col3),
-                div(clazz=col4_classes, single_line=True, style='padding-right:0 !Important;').has(col4),
-                col5
-            ])
+        return div(clazz='row').has([
+            div(clazz='col s2 l1 left-align key-col ' + col_classes, single_line=True).has(col1),
+            div(clazz=classes, single_line=True).has(col2),
+            div(clazz=classes, single_line=True).has(col3),
+            div(clazz=col4_classes, single_line=True, style='padding-right:0 !Important;').has(col4),
+            col5
         ])
 
-    def format_deltas(self, r_instances, instances):
-        r_total = 0
-        iu_total = 0
+    def format_row(self, col1, col2, col3, col4, col_classes=''):
+        sign = None
+        if isinstance(col4, (int, float)):
+            sign = (col4 > 0) - (col4 < 0)
+        self._write_row(text(col1), text(col2), text(col3), text(col4), col_classes, sign)
 
-        # For each instance type...
-        for key, in_use in instances.types.items():
-            reserved = r_instances.get(key)
-            iu_total += in_use
-            r_total += reserved
-            self.format_row(key, reserved, in_use, reserved-in_use)
+    def _write_row(self, col1, col2, col3, col4, col_classes, sign):
+        '''
+        Writes a row of markup.  Values must already be escaped.
+        '''
+        if self.stream is None:
+            self.container.has([self._row(col1, col2, col3, col4, col_classes, sign)])
+            return
 
-        # Get any reserved instances types that don't have
-        for key, reserved in r_instances.types.items():
-            if key not in instances.types:
-                r_total += reserved
-                self.format_row(key, reserved, 0, reserved)
+        # When streaming, each kind of row is rendered once, with placeholders
+        # for the values, and reused.
+        key = (col_classes, sign)
+        template = self.row_templates.get(key)
+        if template is None:
+            row = self._row('{0}', '{1}', '{2}', '{3}', col_classes, sign)
+            template = ''.join(row.render(self.container.indent + 1))
+            self.row_templates[key] = template
+        self.cfg.write(template.format(col1, col2, col3, col4))
+
+    def format_deltas(self, r_instances, instances):
+        # For each instance type, reserved or in use...
+        for key, reserved, in_use, delta in match_rows(instances, r_instances):
+            self.format_row(key, reserved, in_use, delta)
 
         # # Add the total lines
-        self.format_row('Total', r_total, iu_total, r_total - iu_total, 'total-col')
+        self.format_row('Total', *match_totals(instances, r_instances), 'total-col')
+        self.format_gaps(*match_gaps(instances, r_instances))
+
+    def format_gaps(self, unused, uncovered):
+        '''
+        Adds the unused reservations and uncovered instances under a total,
+        which the total's delta nets against each other.
+        '''
+        self.format_row('Unused', '', '', unused)
+        self.format_row('Uncovered', '', '', -uncovered)
 
     def format_title(self, table_title):
         self.container.has([
             div(clazz='row').has([
                 div(clazz='col s8 l4 teal lighten-2 center-align', single_line=True).has([
-                    table_title
+                    text(table_title)
                 ])
             ])
         ])
 
-    def format_header(self):
+    def format_header(self, key_title='Type', reserved_title='Reserved'):
         arrows = '{}{}'.format(self.up_arrow, self.down_arrow)
-        self.format_row('Type', 'Reserved', 'In Use', arrows, 'header-col')
+        self._write_row(text(key_title), text(reserved_title), 'In Use', arrows, 'header-col', None)
+
+    def format_breakdown(self, title, key_title, breakdown):
+        '''
+        Formats one row of reserved and in use totals per key, such as a region.
+        breakdown is a dict of key to (instances, r_instances).
+        '''
+        self.format_title(title)
+        self.format_header(key_title)
+        r_total = 0
+        iu_total = 0
+        delta_total = 0
+        for key, (instances, r_instances) in breakdown.items():
+            reserved, in_use, delta = match_totals(instances, r_instances)
+            r_total += reserved
+            iu_total += in_use
+            delta_total += delta
+            self.format_row(key, reserved, in_use, delta)
+        self.format_row('Total', r_total, iu_total, delta_total, 'total-col')
+        self.format_gaps(*breakdown_gaps(breakdown))
+
+    def format_rollup(self, title, key_title, rows):
+        '''
+        Formats one row of covered and in use instances per group, such as a
+        team tag.  rows is a list of (group, covered, in use, delta).
+        '''
+        self.format_title(title)
+        self.format_header(key_title, 'Covered')
+        c_total = 0
+        iu_total = 0
+        for key, covered, in_use, delta in rows:
+            c_total += covered
+            iu_total += in_use
+            self.format_row(key, covered, in_use, delta)
+        self.format_row('Total', rounded(c_total), iu_total, rounded(c_total - iu_total), 'total-col')
 
     def format_table(self, table_title, instances, r_instances):
         self.format_title(table_title)
@@ -174,5 +261,8 @@ class HtmlFormatter(Formatter):
         self.format_expiries(r_instances.expiries)
 
     def format(self):
-        self.html.format(self.cfg)
+        if self.stream is not None:
+            self.cfg.write_chunks(self.stream)
+        else:
+            self.html.format(self.cfg)
 
@@ -0,0 +1,132 @@
+import json
+from matching import breakdown_gaps, match_gaps, match_rows, match_totals, rounded
+from formatter.formatter import Formatter, report_rows
+
+
+# Short classes shared by every cell: n is a number, p over and m under
+# reserved, t a total
+STYLE = (
+    'body{font:14px/1.4 Roboto,Arial,sans-serif;margin:1rem 2rem;color:#212121}'
+    'h2{font-size:1.1rem;margin:1.5rem 0 .5rem;padding:.3rem .6rem;background:#4db6ac;color:#fff;display:inline-block}'
+    'table{border-collapse:collapse;min-width:30rem}'
+    'th,td{padding:.2rem .8rem;text-align:left;white-space:nowrap}'
+    'th{border-bottom:3px solid #000;cursor:pointer;user-select:none}'
+    'th.s:after{content:" \\25B2"}th.s.r:after{content:" \\25BC"}'
+    'tbody tr:nth-child(even){background:#f5f5f5}'
+    '.n{text-align:right}.p{color:#e53935}.m{color:#1e88e5}'
+    '.t td{border-top:3px solid #000;font-weight:600}'
+    '.b{margin:.3rem 0}.b input{margin-right:1rem}.b button{margin-right:.3rem}'
+)
+
+# Renders data.tables into #r.  Only one page of each table is in the DOM at
+# a time, so the page stays fast however many rows there are.
+SCRIPT = '''(function(){
+var data=JSON.parse(document.getElementById('d').textContent),main=document.getElementById('r'),PAGE=100;
+function el(tag,text,cls){var e=document.createElement(tag);if(text!=null)e.textContent=text;if(cls)e.className=cls;return e}
+function cls(v,c){return typeof v!=='number'?'':c!==2?'n':v>0?'n p':v<0?'n m':'n'}
+function tr(row,delta){var r=el('tr');for(var i=0;i<row.length;i++)r.appendChild(el('td',row[i],cls(row[i],i===delta?2:1)));return r}
+data.tables.forEach(function(t){
+var sec=el('section'),rows=t.rows,shown=rows,page=0,col=-1,dir=1,delta=t.columns.indexOf('Delta');
+sec.appendChild(el('h2',t.title));
+var table=el('table'),head=el('tr'),body=el('tbody'),bar=el('div',null,'b'),info=el('span');
+t.columns.forEach(function(name,i){var th=el('th',name);if(rows.length&&typeof rows[0][i]==='number')th.className='n';
+th.onclick=function(){dir=col===i?-dir:1;col=i;sort();page=0;draw();
+Array.prototype.forEach.call(head.children,function(h){h.classList.remove('s','r')});th.classList.add('s');if(dir<0)th.classList.add('r')};head.appendChild(th)});
+function sort(){if(col<0)return;shown=shown.slice().sort(function(a,b){var x=a[col],y=b[col];return (x<y?-1:x>y?1:0)*dir})}
+function draw(){var frag=document.createDocumentFragment(),end=Math.min(shown.length,(page+1)*PAGE);
+for(var i=page*PAGE;i<end;i++)frag.appendChild(tr(shown[i],delta));body.textContent='';body.appendChild(frag);
+info.textContent=shown.length?(page*PAGE+1)+'-'+end+' of '+shown.length:'No rows'}
+if(rows.length>PAGE){var search=el('input'),prev=el('button','<'),next=el('button','>');search.placeholder='Filter';
+search.oninput=function(){var q=search.value.toLowerCase();shown=q?rows.filter(function(r){return r.join(' ').toLowerCase().indexOf(q)>=0}):rows;sort();page=0;draw()};
+prev.onclick=function(){if(page>0){page--;draw()}};next.onclick=function(){if((page+1)*PAGE<shown.length){page++;draw()}};
+bar.appendChild(search);bar.appendChild(prev);bar.appendChild(next);bar.appendChild(info);sec.appendChild(bar)}
+table.appendChild(el('thead')).appendChild(head);table.appendChild(body);
+if(t.totals){var foot=table.appendChild(el('tfoot'));t.totals.forEach(function(row,i){var r=foot.appendChild(tr(row,delta));if(!i)r.className='t'})}
+sec.appendChild(table);main.appendChild(sec);draw()});
+})();'''
+
+
+def _json(value):
+    # < is escaped so nothing in the data can end the script element
+    return json.dumps(value, separators=(',', ':')).replace('<', '\\u003c')
+
+
+def expiry_columns(horizons):
+    columns = ['Type']
+    previous = 0
+    for days in horizons:
+        columns.append('{}-{}d'.format(previous, days))
+        previous = days
+    return columns
+
+
+def gap_rows(unused, uncovered):
+    # Under a total, whose delta nets them against each other
+    return [['Unused', None, None, unused], ['Uncovered', None, None, -uncovered]]
+
+
+class CompactHtmlFormatter(Formatter):
+    '''
+    Formats tables as a page that embeds them once as JSON and renders them
+    in the browser, instead of as markup per cell.  Large tables are sorted,
+    filtered and paged on the client, so the page is small and quick to
+    load even with a row per account, region and type.  Tables are written
+    as they are formatted, so memory use does not grow with the number of
+    rows.
+    '''
+
+    def __init__(self, cfg):
+        super().__init__(cfg)
+        self.tables = 0
+        cfg.write('<!DOCTYPE html><html><head><meta charset="utf-8">'
+                  '<meta name="viewport" content="width=device-width,initial-scale=1">'
+                  '<title>Instance Count</title><style>{}</style></head>'
+                  '<body><main id="r"></main><script type="application/json" id="d">{{"tables":['.format(STYLE))
+
+    def _table(self, title, columns, rows, totals=None):
+        '''
+        Writes one table.  rows is an iterable of lists, written one at a
+        time, and totals a list of rows for its foot.
+        '''
+        self.cfg.write(',' if self.tables else '')
+        self.tables += 1
+        self.cfg.write('{{"title":{},"columns":{},"rows":['.format(_json(title), _json(columns)))
+        separator = ''
+        for row in rows:
+            self.cfg.write(separator)
+            self.cfg.write(_json(row))
+            separator = ','
+        self.cfg.write('],"totals":{}}}'.format(_json(totals)))
+
+    def format_table(self, title, instances, r_instances):
+        self._table(title, ['Type', 'Reserved', 'In Use', 'Delta'],
+                    (list(row) for row in match_rows(instances, r_instances)),
+                    [['Total', *match_totals(instances, r_instances)]] + gap_rows(*match_gaps(instances, r_instances)))
+
+        expiries = r_instances.expiries
+        if expiries.upcoming() > 0:
+            self._table('{} expiring'.format(title), expiry_columns(expiries.horizons),
+                        ([key] + expiry.counts[:-1] for key, expiry in sorted(expiries.expiries.items())
+                         if expiry.upcoming() > 0),
+                        [['Total'] + [expiries.totals.get(days) for days in expiries.horizons]])
+
+        cells = set(instances.shards.cells) | set(r_instances.shards.cells)
+        if len(cells) > 1:
+            horizons = expiries.horizons
+            self._table('{} by account, region and type'.format(title),
+                        ['Account', 'Region', 'Type', 'Reserved', 'In Use', 'Delta'] + expiry_columns(horizons)[1:] + ['Later'],
+                        (row[1:] for row in report_rows(title, instances, r_instances)))
+
+    def format_breakdown(self, title, key_title, breakdown):
+        rows = [[key, *match_totals(instances, r_instances)] for key, (instances, r_instances) in breakdown.items()]
+        total = ['Total'] + [rounded(sum(row[i] for row in rows)) for i in (1, 2, 3)]
+        self._table(title, [key_title, 'Reserved', 'In Use', 'Delta'], rows, [total] + gap_rows(*breakdown_gaps(breakdown)))
+
+    def format_rollup(self, title, key_title, rows):
+        covered = sum(row[1] for row in rows)
+        in_use = sum(row[2] for row in rows)
+        self._table(title, [key_title, 'Covered', 'In Use', 'Delta'], (list(row) for row in rows),
+                    [['Total', rounded(covered), in_use, rounded(covered - in_use)]])
+
+    def format(self):
+        self.cfg.write(']}}</script><script>{}</script></body></html>\n'.format(SCRIPT))
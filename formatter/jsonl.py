@@ -0,0 +1,28 @@
+import json
+from formatter.formatter import Formatter, report_rows, row_columns
+
+
+class JsonLinesFormatter(Formatter):
+    '''
+    Writes one JSON object per (account, region, type) cell, one per line,
+    as each table is formatted.
+    '''
+
+    def format_table(self, title, instances, r_instances):
+        columns = row_columns(r_instances.expiries.horizons)
+        for row in report_rows(title, instances, r_instances):
+            self.cfg.write(json.dumps(dict(zip(columns, row)), separators=(',', ':')))
+            self.cfg.write('\n')
+
+    def format_breakdown(self, title, key_title, breakdown):
+        # Every row already has its account and region
+        pass
+
+    def format_rollup(self, title, key_title, rows):
+        for key, covered, in_use, delta in rows:
+            row = {'table': title, 'rollup': key_title, 'group': key, 'covered': covered, 'in_use': in_use, 'delta': delta}
+            self.cfg.write(json.dumps(row, separators=(',', ':')))
+            self.cfg.write('\n')
+
+    def format(self):
+        pass
@@ -0,0 +1,71 @@
+from formatter.formatter import Formatter, report_rows
+
+
+METRICS = [
+    ('reserved', 'Reserved instances by type.'),
+    ('in_use', 'On-demand instances in use by type.'),
+    ('delta', 'Reserved minus in use by type.  Negative is under-coverage.'),
+    ('expiring_by_type', 'Reserved instances by type expiring after the previous horizon and within this one.'),
+    ('expiring', 'Reserved instances expiring after the previous horizon and within this one.'),
+    ('group_covered', 'Instances covered by a reservation, by --group-by group.'),
+    ('group_in_use', 'On-demand instances in use, by --group-by group.')
+]
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def labels(**kwargs):
+    return '{' + ','.join('{}="{}"'.format(key, escape(value)) for key, value in kwargs.items()) + '}'
+
+
+class PrometheusFormatter(Formatter):
+    '''
+    Writes gauges in the Prometheus text exposition format, labelled by
+    service, account, region and type.  The exposition format needs every
+    sample of a metric together, so samples are kept until format().
+    services maps table titles to service names.
+    '''
+
+    def __init__(self, cfg, services=None, prefix='instance_count_'):
+        super().__init__(cfg)
+        self.services = services or {}
+        self.prefix = prefix
+        self.samples = {name: [] for name, text in METRICS}
+
+    def format_table(self, title, instances, r_instances):
+        service = self.services.get(title, title)
+        horizons = r_instances.expiries.horizons
+        within = ['{}d'.format(days) for days in horizons] + ['later']
+        samples = self.samples
+        for row in report_rows(title, instances, r_instances):
+            cell = labels(service=service, account=row[1], region=row[2], type=row[3])
+            samples['reserved'].append((cell, row[4]))
+            samples['in_use'].append((cell, row[5]))
+            samples['delta'].append((cell, row[6]))
+            for bucket, count in zip(within, row[7:]):
+                samples['expiring_by_type'].append((cell[:-1] + ',within="{}"}}'.format(bucket), count))
+        for (account, region), expiries in r_instances.expiry_shards.items():
+            for bucket, count in zip(within, expiries.totals.counts):
+                samples['expiring'].append((labels(service=service, account=account, region=region, within=bucket), count))
+
+    def format_breakdown(self, title, key_title, breakdown):
+        # Every sample already has its account and region labels
+        pass
+
+    def format_rollup(self, title, key_title, rows):
+        # Rollups are titled '<table title> by <key title>'
+        table = title[:-len(' by ' + key_title)]
+        service = self.services.get(table, table)
+        for key, covered, in_use, delta in rows:
+            cell = labels(service=service, rollup=key_title, group=key)
+            self.samples['group_covered'].append((cell, covered))
+            self.samples['group_in_use'].append((cell, in_use))
+
+    def format(self):
+        for name, text in METRICS:
+            metric = self.prefix + name
+            self.cfg.write('# HELP {} {}\n# TYPE {} gauge\n'.format(metric, text, metric))
+            for cell, value in self.samples[name]:
+                self.cfg.write('{}{} {}\n'.format(metric, cell, value))
@@ -0,0 +1,118 @@
+import gzip
+import io
+import os
+import secrets
+import sys
+
+
+class StdoutSink():
+    '''
+    Writes to stdout.  Closing it only flushes.
+    '''
+
+    def __init__(self):
+        self.file = sys.stdout
+
+    def write(self, text):
+        self.file.write(text)
+
+    def write_bytes(self, data):
+        self.file.flush()
+        self.file.buffer.write(data)
+
+    def close(self):
+        self.file.flush()
+
+    def abort(self):
+        self.close()
+
+
+class FileSink():
+    '''
+    Writes to a temporary file next to path, and renames it to path on close,
+    so readers never see a partly written file.  abort() removes the
+    temporary file instead.  The file is created with the permissions of any
+    new file, 0o666 less the umask, which the kernel applies, since reading
+    the umask would mean changing it for every thread.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        while True:
+            self.tmp = os.path.join(directory, '.{}.{}.tmp'.format(os.path.basename(path), secrets.token_hex(4)))
+            try:
+                fd = os.open(self.tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+                break
+            except FileExistsError:
+                continue
+        self.raw = os.fdopen(fd, 'wb')
+        self.file = self.raw
+
+    def write(self, text):
+        self.file.write(text.encode('utf-8'))
+
+    def write_bytes(self, data):
+        self.file.write(data)
+
+    def _close_files(self):
+        if self.file is not self.raw:
+            self.file.close()
+        self.raw.close()
+
+    def close(self):
+        self._close_files()
+        os.replace(self.tmp, self.path)
+
+    def abort(self):
+        self._close_files()
+        try:
+            os.unlink(self.tmp)
+        except FileNotFoundError:
+            pass
+
+
+class GzipSink(FileSink):
+    '''
+    A FileSink that gzip compresses what is written.
+    '''
+
+    def __init__(self, path, level=6):
+        super().__init__(path)
+        self.file = gzip.GzipFile(filename=os.path.basename(path)[:-3], fileobj=self.raw, mode='wb', compresslevel=level)
+
+
+class MemorySink():
+    '''
+    Collects what is written in memory, as UTF-8 bytes.
+    '''
+
+    def __init__(self):
+        self.file = io.BytesIO()
+
+    def write(self, text):
+        self.file.write(text.encode('utf-8'))
+
+    def write_bytes(self, data):
+        self.file.write(data)
+
+    def getvalue(self):
+        return self.file.getvalue()
+
+    def close(self):
+        pass
+
+    def abort(self):
+        self.file = io.BytesIO()
+
+
+def open_sink(destination=None):
+    '''
+    Returns the sink for a destination: stdout for None or '-', a GzipSink
+    for paths ending in .gz, and a FileSink otherwise.
+    '''
+    if destination is None or destination in ('', '-'):
+        return StdoutSink()
+    if destination.endswith('.gz'):
+        return GzipSink(destination)
+    return FileSink(destination)
@@ -1,4 +1,5 @@
-from colorama import init, Fore, Style
+from colorama import Fore, Style
+from matching import breakdown_gaps, match_gaps, match_rows, match_totals, rounded
 from formatter.formatter import Formatter
 
 
@@ -10,7 +11,6 @@ class TermioFormatter(Formatter):
         self.down_arrow = '\u2193'
         self.up_arrow = '\u2191'
         self.hline = '\u2500'
-        init()
 
     def _format_expiry_period(self, expiries, period):
         if expiries.totals.get(period) == 0:
@@ -21,10 +21,8 @@ class TermioFormatter(Formatter):
         banner_days = ''
         multi = ' days'
 
-        if period == 'month':
-            banner_days = '30'
-        elif period == 'week':
-            banner_days = '7'
+        if period > 1:
+            banner_days = str(period)
         else:
             pre_days = ''
             banner_days = 'today'
@@ -45,13 +43,13 @@ class TermioFormatter(Formatter):
         return lines
 
     def format_expiries(self, expiries):
-        if len(expiries.expiries.keys()) == 0:
-            self.lines.append("No instances expire in the next 30 days")
+        if expiries.upcoming() == 0:
+            self.lines.append("No instances expire in the next {} days".format(expiries.horizons[-1]))
             return
 
-        self.lines.extend(self._format_expiry_period(expiries, 'month'))
-        self.lines.extend(self._format_expiry_period(expiries, 'week'))
-        self.lines.extend(self._format_expiry_period(expiries, 'day'))
+        # Longest horizon first
+        for period in reversed(expiries.horizons):
+            self.lines.extend(self._format_expiry_period(expiries, period))
 
     def format_title(self, title):
         self.lines.extend([
@@ -60,59 +58,90 @@ class TermioFormatter(Formatter):
             self.hline * 46
         ])
 
-    def format_header(self):
+    def format_header(self, key_title='Type', reserved_title='Reserved'):
         arrows = Fore.RED + self.up_arrow + Fore.WHITE + '/' + Fore.BLUE + self.down_arrow
         self.lines.extend([
-            '{}{:<15s}{:>10}{:>10}{:>8}{}{}'.format(Style.BRIGHT, 'Type', 'Reserved', 'In Use', ' ', arrows, Style.RESET_ALL),
+            '{}{:<15s}{:>10}{:>10}{:>8}{}{}'.format(Style.BRIGHT, key_title, reserved_title, 'In Use', ' ', arrows, Style.RESET_ALL),
             self.hline * 46
         ])
 
-    def format_total(self, reserved, in_use):
+    def format_total(self, reserved, in_use, delta):
         self.lines.extend([
             self.hline * 46,
-            self.format_line('Total', reserved, in_use, True)
+            self.format_line('Total', reserved, in_use, delta, True)
         ])
 
-    def format_line(self, key, reserved, in_use, is_total=False):
+    def format_gaps(self, unused, uncovered):
+        '''
+        Adds the unused reservations and uncovered instances under a total,
+        which the total's delta nets against each other.
+        '''
+        self.lines.extend([
+            self.format_line('Unused', '', '', unused, True),
+            self.format_line('Uncovered', '', '', -uncovered, True)
+        ])
+
+    def format_line(self, key, reserved, in_use, delta, is_total=False):
         style = Style.NORMAL
-        diff = int(reserved - in_use)
 
         if is_total:
             style = Style.BRIGHT
 
-        if diff > 0:
+        if delta > 0:
             # We have too many instances
             arrow = self.up_arrow
             color = Fore.RED
-        elif diff < 0:
+        elif delta < 0:
             arrow = self.down_arrow
             color = Fore.BLUE
         else:
             color = Fore.WHITE
             arrow = ''
 
-        return '{}{:<15s}{:>10s}{:>10s}{}{:>10s}{}{}'.format(style, key, str(reserved), str(in_use), color, str(diff), arrow, Style.RESET_ALL)
+        return '{}{:<15s}{:>10s}{:>10s}{}{:>10s}{}{}'.format(style, key, str(reserved), str(in_use), color, str(delta), arrow, Style.RESET_ALL)
 
     def format_deltas(self, r_instances, instances):
+        # For each instance type, reserved or in use...
+        for key, reserved, in_use, delta in match_rows(instances, r_instances):
+            self.lines.append(self.format_line(key, reserved, in_use, delta))
+
+        # Add the total lines
+        self.format_total(*match_totals(instances, r_instances))
+        self.format_gaps(*match_gaps(instances, r_instances))
+
+    def format_breakdown(self, title, key_title, breakdown):
+        '''
+        Formats one row of reserved and in use totals per key, such as a region.
+        breakdown is a dict of key to (instances, r_instances).
+        '''
+        self.format_title(title)
+        self.format_header(key_title)
         r_total = 0
         iu_total = 0
-
-        # For each instance type...
-        for key, in_use in instances.types.items():
-            reserved = r_instances.get(key)
-            iu_total += in_use
+        delta_total = 0
+        for key, (instances, r_instances) in breakdown.items():
+            reserved, in_use, delta = match_totals(instances, r_instances)
             r_total += reserved
-            self.lines.append(self.format_line(key, reserved, in_use))
-
-        # Get any reserved instances types that don't have
-        for key, reserved in r_instances.types.items():
-            if key not in instances.types:
-                r_total += reserved
-                self.lines.append(self.format_line(key, reserved, 0))
-
-        # Add the total lines
-        self.format_total(r_total, iu_total)
-
+            iu_total += in_use
+            delta_total += delta
+            self.lines.append(self.format_line(key, reserved, in_use, delta))
+        self.format_total(r_total, iu_total, delta_total)
+        self.format_gaps(*breakdown_gaps(breakdown))
+
+    def format_rollup(self, title, key_title, rows):
+        '''
+        Formats one row of covered and in use instances per group, such as a
+        team tag.  rows is a list of (group, covered, in use, delta).
+        '''
+        self.format_title(title)
+        self.format_header(key_title, 'Covered')
+        c_total = 0
+        iu_total = 0
+        for key, covered, in_use, delta in rows:
+            c_total += covered
+            iu_total += in_use
+            self.lines.append(self.format_line(key, covered, in_use, delta))
+        self.format_total(rounded(c_total), iu_total, rounded(c_total - iu_total))
 
     def format_table(self, title, instances, r_instances):
         self.format_title(title)
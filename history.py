@@ -0,0 +1,272 @@
+'''
+A history of report snapshots in SQLite, for trends over time and for what
+changed since the previous run.  Each snapshot holds the reserved, in use and
+delta counts and expiry buckets of every (account, region, service, type) key.
+
+Keys are interned into a table of their own, and counts are stored clustered
+by (key, snapshot), so the history of a key is read in order from one place.
+Totals are also kept per snapshot for every service, by account, by region,
+by both and over all of them, so a trend that is not filtered by type reads
+one row per service and snapshot, however many keys there are.
+'''
+from datetime import datetime, timezone
+import argparse
+import os
+import sqlite3
+import time
+from formatter.formatter import report_rows
+from matching import rounded
+
+
+DEFAULT_PATH = os.path.join(os.environ.get('XDG_DATA_HOME', os.path.expanduser('~/.local/share')), 'instance-count', 'history.sqlite')
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS snapshots (
+    id INTEGER PRIMARY KEY,
+    taken INTEGER NOT NULL,
+    horizons TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS snapshots_taken ON snapshots (taken);
+CREATE TABLE IF NOT EXISTS keys (
+    id INTEGER PRIMARY KEY,
+    account TEXT NOT NULL,
+    region TEXT NOT NULL,
+    service TEXT NOT NULL,
+    type TEXT NOT NULL,
+    UNIQUE (account, region, service, type)
+);
+CREATE TABLE IF NOT EXISTS counts (
+    key INTEGER NOT NULL,
+    snapshot INTEGER NOT NULL,
+    reserved INTEGER NOT NULL,
+    in_use INTEGER NOT NULL,
+    delta REAL NOT NULL,
+    expiring TEXT NOT NULL,
+    PRIMARY KEY (key, snapshot)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS counts_snapshot ON counts (snapshot);
+CREATE TABLE IF NOT EXISTS totals (
+    account TEXT NOT NULL,
+    region TEXT NOT NULL,
+    service TEXT NOT NULL,
+    snapshot INTEGER NOT NULL,
+    reserved INTEGER NOT NULL,
+    in_use INTEGER NOT NULL,
+    delta REAL NOT NULL,
+    PRIMARY KEY (account, region, service, snapshot)
+) WITHOUT ROWID;
+'''
+
+# The account or region of totals over every account or region
+ALL = '*'
+
+# Trend buckets, in seconds.  The last snapshot in each bucket is shown.
+EVERY = {
+    'hour': 60 * 60,
+    'day': 24 * 60 * 60,
+    'week': 7 * 24 * 60 * 60
+}
+
+UNITS = {
+    'h': 60 * 60,
+    'd': 24 * 60 * 60,
+    'w': 7 * 24 * 60 * 60
+}
+
+
+def parse_time(value):
+    '''
+    Turns a --since or --until value into a Unix time.  Accepts an ISO 8601
+    date or time, taken as UTC if it has no zone, or an age such as 12h, 30d
+    or 52w.
+    '''
+    unit = UNITS.get(value[-1:])
+    if unit is not None and value[:-1].isdigit():
+        return int(time.time()) - int(value[:-1]) * unit
+    try:
+        when = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError('bad time {!r}. Use an ISO 8601 date or time, or an age such as 30d'.format(value))
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return int(when.timestamp())
+
+
+def format_time(taken):
+    return datetime.fromtimestamp(taken, timezone.utc).strftime('%Y-%m-%d %H:%M')
+
+
+class SnapshotStore():
+    '''
+    The snapshot history in one SQLite file.  record() adds a snapshot of the
+    table reports, and trend() and diff() query it.
+    '''
+
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self.keys = None
+
+    def close(self):
+        self.db.close()
+
+    def _key_ids(self, keys):
+        '''
+        Returns the ids of (account, region, service, type) keys, adding the
+        ones not seen before.
+        '''
+        if self.keys is None:
+            self.keys = {tuple(row[1:]): row[0] for row in self.db.execute('SELECT id, account, region, service, type FROM keys')}
+        new = [key for key in set(keys) if key not in self.keys]
+        if new:
+            self.db.executemany('INSERT OR IGNORE INTO keys (account, region, service, type) VALUES (?, ?, ?, ?)', new)
+            self.keys = {tuple(row[1:]): row[0] for row in self.db.execute('SELECT id, account, region, service, type FROM keys')}
+        return [self.keys[key] for key in keys]
+
+    def record(self, reports, services, taken=None):
+        '''
+        Adds a snapshot of table reports, as yielded by table_reports, and
+        returns its id.  services maps table titles to service names.
+        '''
+        taken = int(time.time() if taken is None else taken)
+        rows = []
+        horizons = ()
+        for report in reports:
+            title, instances, r_instances = report[1:4]
+            horizons = r_instances.expiries.horizons
+            service = services.get(title, title)
+            for row in report_rows(title, instances, r_instances):
+                rows.append(((row[1], row[2], service, row[3]), row[4:]))
+        return self.add(taken, horizons, rows)
+
+    def add(self, taken, horizons, rows):
+        '''
+        Adds a snapshot taken at a Unix time, of rows of ((account, region,
+        service, type), [reserved, in use, delta, expiring...]).
+        '''
+        with self.db:
+            snapshot = self.db.execute('INSERT INTO snapshots (taken, horizons) VALUES (?, ?)',
+                                       (taken, ','.join(str(days) for days in horizons))).lastrowid
+            ids = self._key_ids([key for key, counts in rows])
+            self.db.executemany(
+                'INSERT INTO counts (key, snapshot, reserved, in_use, delta, expiring) VALUES (?, ?, ?, ?, ?, ?)',
+                ((key, snapshot, counts[0], counts[1], counts[2], ','.join(str(n) for n in counts[3:]))
+                 for key, (_, counts) in zip(ids, rows)))
+            totals = {}
+            for (account, region, service, it), counts in rows:
+                for key in ((account, region), (account, ALL), (ALL, region), (ALL, ALL)):
+                    total = totals.setdefault(key + (service,), [0, 0, 0])
+                    for i in range(3):
+                        total[i] += counts[i]
+            self.db.executemany('INSERT INTO totals (account, region, service, snapshot, reserved, in_use, delta) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                                ((*key, snapshot, *total) for key, total in totals.items()))
+        return snapshot
+
+    def snapshots(self, since=None, until=None, every=None):
+        '''
+        Returns (id, taken) for the snapshots in a time range, in time order.
+        If every is given, only the last snapshot in each bucket of every
+        seconds is kept.
+        '''
+        rows = self.db.execute('SELECT id, taken FROM snapshots WHERE taken >= ? AND taken <= ? ORDER BY taken, id',
+                               (since or 0, until or 2 ** 62)).fetchall()
+        if every is None:
+            return rows
+        last = {}
+        for snapshot, taken in rows:
+            last[taken // every] = (snapshot, taken)
+        return list(last.values())
+
+    def trend(self, since=None, until=None, every=None, service=None, account=None, region=None, instance_type=None):
+        '''
+        Returns (taken, reserved, in use, delta) for each snapshot in a time
+        range, added up over the keys that match the filters.  Unless it is
+        filtered by type, the totals are read rather than the keys.
+        '''
+        snapshots = self.snapshots(since, until, every)
+        if not snapshots:
+            return []
+        ids = ','.join(str(snapshot) for snapshot, taken in snapshots)
+        if instance_type is None:
+            where = 'account = ? AND region = ?'
+            params = [account or ALL, region or ALL]
+            if service is not None:
+                where += ' AND service = ?'
+                params.append(service)
+            sums = self.db.execute(
+                'SELECT snapshot, SUM(reserved), SUM(in_use), SUM(delta) FROM totals WHERE {} AND snapshot IN ({}) GROUP BY snapshot'.format(
+                    where, ids), params)
+        else:
+            filters = [('service', service), ('account', account), ('region', region), ('type', instance_type)]
+            where = ' AND '.join('{} = ?'.format(column) for column, value in filters if value is not None)
+            keys = [row[0] for row in self.db.execute('SELECT id FROM keys WHERE ' + where, [value for column, value in filters if value is not None])]
+            if not keys:
+                return []
+            sums = self.db.execute(
+                'SELECT snapshot, SUM(reserved), SUM(in_use), SUM(delta) FROM counts WHERE key IN ({}) AND snapshot IN ({}) GROUP BY snapshot'.format(
+                    ','.join(str(key) for key in keys), ids))
+        sums = {row[0]: row[1:] for row in sums}
+        return [(taken,) + tuple(sums.get(snapshot, (0, 0, 0))) for snapshot, taken in snapshots]
+
+    def diff(self, snapshot=None):
+        '''
+        Returns (before, after, rows) for a snapshot, the latest by default,
+        and the one before it, where before and after are (id, taken, horizons)
+        and rows is a list of ((account, region, service, type), before counts,
+        after counts) for every key whose counts changed.  Counts are
+        (reserved, in use, delta, expiring), or None where the key is missing.
+        '''
+        if snapshot is None:
+            after = self.db.execute('SELECT id, taken, horizons FROM snapshots ORDER BY taken DESC, id DESC LIMIT 1').fetchone()
+        else:
+            after = self.db.execute('SELECT id, taken, horizons FROM snapshots WHERE id = ?', (snapshot,)).fetchone()
+        if after is None:
+            return (None, None, [])
+        before = self.db.execute('SELECT id, taken, horizons FROM snapshots WHERE taken < ? OR (taken = ? AND id < ?) ORDER BY taken DESC, id DESC LIMIT 1',
+                                 (after[1], after[1], after[0])).fetchone()
+
+        def counts(row):
+            if row is None:
+                return {}
+            return {
+                key: (reserved, in_use, delta, expiring)
+                for key, reserved, in_use, delta, expiring in self.db.execute(
+                    'SELECT key, reserved, in_use, delta, expiring FROM counts WHERE snapshot = ?', (row[0],))
+            }
+
+        old = counts(before)
+        new = counts(after)
+        names = {row[0]: tuple(row[1:]) for row in self.db.execute('SELECT id, account, region, service, type FROM keys')}
+        rows = [(names[key], old.get(key), new.get(key)) for key in set(old) | set(new) if old.get(key) != new.get(key)]
+        rows.sort(key=lambda row: row[0])
+        return (before, after, rows)
+
+
+def print_trend(rows, file=None):
+    print('{:<18}{:>10}{:>10}{:>10}'.format('Time', 'Reserved', 'In Use', 'Delta'), file=file)
+    for taken, reserved, in_use, delta in rows:
+        print('{:<18}{:>10}{:>10}{:>10}'.format(format_time(taken), reserved, in_use, rounded(delta)), file=file)
+
+
+def print_diff(before, after, rows, file=None):
+    if after is None:
+        print('No snapshots', file=file)
+        return
+    if before is None:
+        print('Only one snapshot, taken {}'.format(format_time(after[1])), file=file)
+        return
+    print('Changes from {} to {}'.format(format_time(before[1]), format_time(after[1])), file=file)
+    print('Expiring counts are by horizon: {} days, then later'.format(after[2]), file=file)
+    print('{:<14}{:<16}{:<8}{:<15}{:>14}{:>14}{:>18}  {}'.format('Account', 'Region', 'Service', 'Type', 'Reserved', 'In Use', 'Delta', 'Expiring'), file=file)
+    for (account, region, service, it), old, new in rows:
+        old = old or (0, 0, 0, '-')
+        new = new or (0, 0, 0, '-')
+        print('{:<14}{:<16}{:<8}{:<15}{:>14}{:>14}{:>18}  {}'.format(
+            account, region, service, it,
+            '{} -> {}'.format(old[0], new[0]), '{} -> {}'.format(old[1], new[1]),
+            '{} -> {}'.format(rounded(old[2]), rounded(new[2])),
+            new[3] if old[3] == new[3] else '{} -> {}'.format(old[3], new[3])), file=file)
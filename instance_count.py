@@ -1,10 +1,44 @@
 #!/usr/bin/env python3
-from datetime import datetime, timezone, timedelta
+from datetime import date, datetime, timezone, timedelta
 import argparse
-import boto3
+import sys
+import time
+from bisect import bisect_left
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from accounts import DEFAULT_ROLE_NAME, load_accounts, organization_accounts, session_pool
+from collections import Counter
+from aggregate import Counts, Shards
+from cache import DEFAULT_MAX_BYTES, DEFAULT_PATH, ResponseCache, cache_key
+from scheduler import CollectionScheduler
+from ratelimit import rate_limiter
+import fastparse
+import matching
+from collectors import SPECS, Extractors, getter
+from rollup import Rollups, dimension_values, parse_group_by, rollup_rows, uses_tags
+from partial import parse_shard, shard_targets
+import tracing
+from formatter import PROTOCOLS, formatter_class
 from formatter.formatter import FormatConfig
-from formatter.termio import TermioFormatter
-from formatter.html import HtmlFormatter
+from formatter.sinks import MemorySink, open_sink
+
+
+# Below this many, add_many does not import NumPy, which takes longer to
+# import than adding a few reservations one at a time.
+NUMPY_MIN_RECORDS = 256
+
+
+@lru_cache(maxsize=None)
+def _numpy():
+    '''
+    Returns numpy, or None if it is not installed.  It is imported on first
+    use, since it is slow to import.
+    '''
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
 
 
 def flatten(fat_list):
@@ -28,72 +62,120 @@ def flatten(fat_list):
     return flattened
 
 
+# Expiry horizons, in days.  Each horizon counts what expires after the
+# previous horizon and within it, so 7 is days 2 to 7.
+DEFAULT_HORIZONS = (1, 7, 30)
+
+# Names accepted for the default horizons
+PERIODS = {
+    'day': 1,
+    'week': 7,
+    'month': 30
+}
+
+
+def parse_horizons(value):
+    '''
+    Turns a comma separated list of days, such as '1,7,30,90', into a
+    sorted tuple of horizons.
+    '''
+    try:
+        horizons = sorted(set(int(days) for days in value.split(',') if days.strip()))
+    except ValueError:
+        raise ValueError('parse_horizons - horizons must be whole numbers of days: {}'.format(value))
+    if not horizons or horizons[0] < 1:
+        raise ValueError('parse_horizons - horizons must be greater than 0: {}'.format(value))
+    return tuple(horizons)
+
+
 class Expiry():
     '''
-    Keeps running totals of expiry periods, and provides print support to
-    display the results to stdout.
+    Keeps running totals by expiry horizon.  There is one bucket per horizon,
+    holding what expires after the previous horizon and within this one, and a
+    final bucket for everything later, so nothing is dropped.
     '''
 
-    def __init__(self, limit=30):
-        if limit < 1:
-            raise ValueError('Expiry - limit must be greater than 0')
+    def __init__(self, horizons=DEFAULT_HORIZONS):
+        if len(horizons) == 0 or horizons[0] < 1:
+            raise ValueError('Expiry - horizons must be greater than 0')
 
-        self.day = 0
-        self.week = 0
-        self.month = 0
+        self.horizons = tuple(horizons)
+        self.counts = [0] * (len(self.horizons) + 1)
+
+    def index(self, period):
+        '''
+        Returns the bucket for a period.
+        The period can be either a name [day, week, month, later], or a numeric
+        value.  As an int, the period is the number of days from the current
+        date.  day, week and month name the default horizons, so are only
+        accepted with them.
+        '''
+        if isinstance(period, str):
+            if period == 'later':
+                return len(self.horizons)
+            if period not in PERIODS:
+                raise ValueError('Expiry - Unknown period: {}'.format(period))
+            if self.horizons != DEFAULT_HORIZONS:
+                raise ValueError('Expiry - {} is not a period of horizons {}. Use days'.format(period, self.horizons))
+            period = PERIODS[period]
+        elif not isinstance(period, int):
+            raise ValueError('Expiry - Bad type for period. Must string or int: {}'.format(type(period)))
+        return bisect_left(self.horizons, period)
 
     def add(self, period, value):
         '''
         Adds a value to an expiry period.
-        The period can be either a name [day, week, month], or a numeric value.
-        As an int, the period is the number of days from the current date.
         '''
-
-        if (isinstance(period, str) and period == 'day') or (isinstance(period, int) and period < 2):
-            self.day += value
-        elif (isinstance(period, str) and period == 'week') or (isinstance(period, int) and period < 8):
-            self.week += value
-        elif (isinstance(period, str) and period == 'month') or (isinstance(period, int) and period < 31):
-            self.month += value
-        else:
-            if isinstance(period, str):
-                raise ValueError('Expiry.add - Unknown period: {}'.format(period))
-            elif isinstance(period, int):
-                raise ValueError('Expiry.add - Bad value for period. Must be between 0 and 30: {}'.format(str(period)))
-            else:
-                raise ValueError('Expiry.add - Bad type for period. Must string or int: {}'.format(type(period)))
+        self.counts[self.index(period)] += value
 
     def get(self, period):
         '''
         Returns the value for a period.
-        The period can be either a name [day, week, month], or a numeric value.
-        As an int, the period is the number of days from the current date.
-        '''
-        if (isinstance(period, str) and period == 'day') or (isinstance(period, int) and period < 2):
-            return self.day
-        elif (isinstance(period, str) and period == 'week') or (isinstance(period, int) and period < 8):
-            return self.week
-        elif (isinstance(period, str) and period == 'month') or (isinstance(period, int) and period < 31):
-            return self.month
-        else:
-            if isinstance(period, str):
-                raise ValueError('Expiry.get - Unknown period: {}'.format(period))
-            elif isinstance(period, int):
-                raise ValueError('Expiry.get - Bad value for period. Must be between 0 and 30: {}'.format(str(period)))
-            else:
-                raise ValueError('Expiry.get - Bad type for period. Must string or int: {}'.format(type(period)))
+        '''
+        return self.counts[self.index(period)]
+
+    def upcoming(self):
+        '''
+        Returns the total that expires within the last horizon.
+        '''
+        return sum(self.counts[:-1])
+
+    def merge(self, other):
+        '''
+        Adds the totals of another Expiry to this one.
+        '''
+        if other.horizons != self.horizons:
+            raise ValueError('Expiry.merge - horizons differ: {} and {}'.format(self.horizons, other.horizons))
+        for index, value in enumerate(other.counts):
+            self.counts[index] += value
+        return self
+
+    def state(self):
+        '''
+        Returns the horizons and counts as plain JSON data.
+        '''
+        return {'horizons': list(self.horizons), 'counts': list(self.counts)}
+
+    @classmethod
+    def from_state(cls, state):
+        expiry = cls(state['horizons'])
+        expiry.counts = list(state['counts'])
+        return expiry
 
 
 class ExpiryPeriods():
     '''
-    Manages a dict of periods by keyword
+    Manages a dict of Expiry by keyword, their totals, and a timeline of how
+    much expires on each date.
     '''
 
-    def __init__(self):
+    def __init__(self, horizons=DEFAULT_HORIZONS):
         now = datetime.utcnow()
         self.now = now.replace(tzinfo=timezone.utc)
+        self.horizons = tuple(horizons)
         self.expiries = {}
-        self.totals = Expiry()
+        self.totals = Expiry(self.horizons)
+        self.timeline = {}
 
     def _days(self, the_date):
         '''
@@ -105,177 +187,1313 @@ class ExpiryPeriods():
         dtd = the_date - self.now
         return dtd.days
 
+    def _expiry(self, key):
+        val = self.expiries.get(key)
+        if val is None:
+            val = Expiry(self.horizons)
+            self.expiries[key] = val
+        return val
+
     def add(self, key, count, end_date):
         '''
         Increments the count by period for the associated key.
         '''
+        index = bisect_left(self.horizons, self._days(end_date))
+        self.totals.counts[index] += count
+        self._expiry(key).counts[index] += count
 
-        days = self._days(end_date)
-        if days > 30:
+        day = end_date.astimezone(timezone.utc).date()
+        self.timeline[day] = self.timeline.get(day, 0) + count
+
+    def add_many(self, keys, counts, end_dates):
+        '''
+        Adds many (key, count, end_date) at once.  With NumPy installed, the
+        buckets and timeline of larger batches are computed as arrays, and
+        end_dates may be a datetime64 array of UTC times.
+        '''
+        np = _numpy() if len(keys) >= NUMPY_MIN_RECORDS or hasattr(end_dates, 'dtype') else None
+        if np is None:
+            for key, count, end_date in zip(keys, counts, end_dates):
+                self.add(key, count, end_date)
+            return
+        if len(keys) == 0:
             return
 
-        # Keep a running total  by period
-        self.totals.add(days, count)
+        if not isinstance(end_dates, np.ndarray):
+            end_dates = np.array([end.astimezone(timezone.utc).replace(tzinfo=None) for end in end_dates], dtype='datetime64[us]')
+        counts = np.asarray(counts, dtype=np.int64)
+        # In microseconds, as add() counts days, so both bucket alike
+        now = np.datetime64(self.now.replace(tzinfo=None), 'us')
+        days = (end_dates.astype('datetime64[us]') - now) // np.timedelta64(1, 'D')
+        indexes = np.searchsorted(np.asarray(self.horizons), days, side='left')
+
+        names, inverse = np.unique(np.asarray(keys, dtype=object).astype(str), return_inverse=True)
+        matrix = np.zeros((len(names), len(self.horizons) + 1), dtype=np.int64)
+        np.add.at(matrix, (inverse, indexes), counts)
+        for name, row in zip(names.tolist(), matrix.tolist()):
+            val = self._expiry(name)
+            for index, value in enumerate(row):
+                val.counts[index] += value
+                self.totals.counts[index] += value
+
+        dates, inverse = np.unique(end_dates.astype('datetime64[D]'), return_inverse=True)
+        for day, count in zip(dates.astype(object), np.bincount(inverse, weights=counts).astype(np.int64).tolist()):
+            self.timeline[day] = self.timeline.get(day, 0) + count
+
+    def upcoming(self):
+        '''
+        Returns the total that expires within the last horizon.
+        '''
+        return self.totals.upcoming()
+
+    def merge(self, other):
+        '''
+        Adds the periods of another ExpiryPeriods to this one.
+        '''
+        self.totals.merge(other.totals)
+        for key, value in other.expiries.items():
+            self._expiry(key).merge(value)
+        for day, count in other.timeline.items():
+            self.timeline[day] = self.timeline.get(day, 0) + count
+        return self
+
+    def state(self):
+        '''
+        Returns the periods as plain JSON data, with the counts of each key
+        and the timeline in key and date order.  The totals are left out,
+        since they are the sum of the keys.
+        '''
+        return {
+            'now': self.now.isoformat(),
+            'horizons': list(self.horizons),
+            'expiries': {key: list(self.expiries[key].counts) for key in sorted(self.expiries)},
+            'timeline': {day.isoformat(): self.timeline[day] for day in sorted(self.timeline)}
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        periods = cls(state['horizons'])
+        periods.now = datetime.fromisoformat(state['now'])
+        for key, counts in state['expiries'].items():
+            expiry = periods._expiry(key)
+            for index, value in enumerate(counts):
+                expiry.counts[index] += value
+                periods.totals.counts[index] += value
+        for day, count in state['timeline'].items():
+            periods.timeline[date.fromisoformat(day)] = count
+        return periods
 
-        if key in self.expiries:
-            val = self.expiries[key]
-        else:
-            val = Expiry()
 
-        val.add(days, count)
-        self.expiries[key] = val
+def add_reserved_records(collection, counts):
+    '''
+    Adds a Counter of (type, count, end) records to a reserved collection,
+    with the expiries added as one batch.
+    '''
+    keys = []
+    totals = []
+    ends = []
+    for record, n in counts.items():
+        it, cnt, end = record[:3]
+        collection.add(it, cnt * n)
+        collection.place(collection.placement(record), cnt * n)
+        keys.append(it)
+        totals.append(cnt * n)
+        ends.append(end)
+    collection.expiries.add_many(keys, totals, ends)
 
 
 class InstancesBase():
-    def __init__(self, client):
+    '''
+    Running totals of instances by type.  Subclasses provide page_items(),
+    which yields the items of one response page, record(), which reduces an
+    item to a hashable tuple of the fields that are counted, and add_record(),
+    which counts it.  Collections that can be matched by placement also
+    override placement(), and their records are counted by placement for
+    matching.  If a ResponseCache is given, the records are read from and
+    stored in it.
+
+    Building a collection makes no calls.  collect() fills it from its
+    client, and aio fills it without blocking an event loop.
+    '''
+
+    # The describe_* call, and the (min, max) page size it accepts, or None if
+    # it cannot be paginated.
+    operation = None
+    page_limits = None
+    # Changed with the fields of record(), so older cache entries are not read
+    record_format = 1
+
+    def __init__(self, client, page_size=None, cache=None):
         self.client = client
-        self.types = {}
-        self.total = 0
+        self.page_size = page_size
+        self.cache = cache
+        self.filters = []
+        self.types = Counts()
+        self.shards = Shards()
+        self.expiry_shards = {}
+        self.placements = Counter()
+        self.placement_shards = {}
+        self.rollups = Rollups()
+        self.rollup_shards = {}
+        self.pages = 0
+        self.items = 0
+        self.expiries = None
+
+    @property
+    def total(self):
+        return self.types.total
 
     def get(self, key):
-        if key in self.types:
-            return self.types[key]
-        return 0
+        return self.types.get(key)
 
     def add(self, key, value=1):
-        self.total += value
-        if key in self.types:
-            val = self.types[key]
-            self.types[key] = val + value
+        self.types.add(key, value)
+
+    def group(self, group_by):
+        '''
+        Sets the groupings, each a tuple of dimensions, that instances are
+        rolled up by as they are counted.
+        '''
+        self.rollups = Rollups(group_by)
+
+    def place(self, placement, value=1):
+        '''
+        Counts a (type, zone, platform, tenancy) placement for matching.
+        None is not counted.
+        '''
+        if placement is not None:
+            self.placements[placement] += value
+
+    def merge(self, other):
+        '''
+        Adds the counts, expiries and stats of another collection to this one.
+        '''
+        self.types.merge(other.types)
+        self.shards.merge(other.shards)
+        self.pages += other.pages
+        self.items += other.items
+        if other.expiries is not None:
+            if self.expiries is None:
+                self.expiries = ExpiryPeriods(other.expiries.horizons)
+            self.expiries.merge(other.expiries)
+        for key, expiries in other.expiry_shards.items():
+            if key in self.expiry_shards:
+                horizons = self.expiry_shards[key].horizons
+                self.expiry_shards[key] = ExpiryPeriods(horizons).merge(self.expiry_shards[key]).merge(expiries)
+            else:
+                self.expiry_shards[key] = expiries
+        for key, placements in other.placement_shards.items():
+            if key in self.placement_shards:
+                self.placement_shards[key] = self.placement_shards[key] + placements
+            else:
+                self.placement_shards[key] = placements
+        for key, rollups in other.rollup_shards.items():
+            if key in self.rollup_shards:
+                self.rollup_shards[key] = self.rollup_shards[key].merge(rollups)
+            else:
+                self.rollup_shards[key] = rollups
+        return self
+
+    def state(self):
+        '''
+        Returns the counts of every (account, region) cell, and the stats, as
+        plain JSON data that collection_from_states() turns back into a
+        collection.  Totals are left out, since they are the sums of the
+        cells.
+        '''
+        cells = []
+        for cell, counts in self.shards.cells.items():
+            expiries = self.expiry_shards.get(cell)
+            rollups = self.rollup_shards.get(cell)
+            cells.append({
+                'account': cell[0],
+                'region': cell[1],
+                'types': dict(counts.items()),
+                'placements': [list(placement) + [n] for placement, n in self.placement_shards.get(cell, {}).items()],
+                'expiries': expiries.state() if expiries is not None else None,
+                'rollups': rollups.state() if rollups else None
+            })
+        return {'pages': self.pages, 'items': self.items, 'cells': cells}
+
+    def paginator_config(self):
+        '''
+        Returns the PaginationConfig of the describe_* call, with the page
+        size clamped to what it accepts.
+        '''
+        config = {}
+        if self.page_size is not None and self.page_limits is not None:
+            low, high = self.page_limits
+            config['PageSize'] = min(max(self.page_size, low), high)
+        return config
+
+    def page_params(self):
+        '''
+        Returns the arguments of the describe_* call.
+        '''
+        return {'Filters': self.filters}
+
+    def paginate(self, operation, **kwargs):
+        '''
+        Yields the pages of a describe_* call one at a time, so only a single
+        page is held in memory.  Calls that cannot be paginated yield their one
+        response.
+        '''
+        if self.client.can_paginate(operation):
+            pages = self.client.get_paginator(operation).paginate(PaginationConfig=self.paginator_config(), **kwargs)
         else:
-            self.types[key] = value
+            pages = self._call(operation, kwargs)
+        pages = iter(pages)
+        while True:
+            with tracing.span('page', 'aws', operation=operation) as span:
+                page = next(pages, None)
+                if page is None:
+                    span.drop()
+                    return
+                metadata = page.get('ResponseMetadata', {})
+                span.set('retries', metadata.get('RetryAttempts', 0))
+                span.set('bytes', int(metadata.get('HTTPHeaders', {}).get('content-length', 0)))
+            self.pages += 1
+            yield page
+
+    def _call(self, operation, kwargs):
+        while kwargs is not None:
+            page = getattr(self.client, operation)(**kwargs)
+            yield page
+            kwargs = self.next_params(kwargs, page)
+
+    def next_params(self, kwargs, page):
+        '''
+        Returns the arguments for the page after page of a call with no
+        paginator, or None if page was the last.
+        '''
+        return None
+
+    def stats(self):
+        return {'pages': self.pages, 'items': self.items}
+
+    def scope(self):
+        '''
+        Returns the (account, region) the client is for, as part of the cache
+        key.  Plain boto3 clients do not know their account.
+        '''
+        scope = getattr(self.client, 'scope', None)
+        if scope is None:
+            scope = ('default', self.client.meta.region_name)
+        return scope
+
+    def _pages(self):
+        return self.paginate(self.operation, **self.page_params())
+
+    def page_items(self, page):
+        raise NotImplementedError('{}.page_items'.format(type(self).__name__))
+
+    def _items(self):
+        for page in self._pages():
+            yield from self.page_items(page)
+
+    def record(self, item):
+        raise NotImplementedError('{}.record'.format(type(self).__name__))
+
+    def add_record(self, record, n=1):
+        raise NotImplementedError('{}.add_record'.format(type(self).__name__))
+
+    def placement(self, record):
+        return None
+
+    def add_records(self, counts):
+        '''
+        Adds a Counter of records at once, as read from the cache.
+        '''
+        for record, n in counts.items():
+            self.add_record(record, n)
+
+    def _records(self):
+        for item in self._items():
+            yield self.record(item)
+
+    def cache_id(self):
+        return cache_key(self.scope(), self.operation, self.filters, self.record_format, self.rollups.dimensions)
+
+    def collect(self):
+        '''
+        Reads every page of the describe_* call, or the cached records, counts
+        them, and returns the collection.
+        '''
+        scope = self.scope()
+        with tracing.span(self.operation, 'collect', account=scope[0], region=scope[1]) as span:
+            if self.cache is None:
+                for record in self._records():
+                    self.items += 1
+                    self.add_record(record)
+            else:
+                counts = self.cache.fetch(self.cache_id(), self._records())
+                self.items += sum(counts.values())
+                self.add_records(counts)
+            span.set('items', self.items)
+            span.set('pages', self.pages)
+        self.add_shards()
+        return self
+
+    def add_shards(self):
+        '''
+        Files the counts under the (account, region) of the client, once they
+        have been collected.
+        '''
+        self.shards.add(self.scope(), self.types)
+        if self.expiries is not None:
+            self.expiry_shards[self.scope()] = self.expiries
+        if self.placements:
+            self.placement_shards[self.scope()] = self.placements
+        if self.rollups:
+            self.rollup_shards[self.scope()] = self.rollups
 
     def __str__(self):
-        result = ''
-        for k, v in self.types.items():
-            result += '"{!s}"\t{!s}\n'.format(k, v)
-        result += '{:<10}\t{}\n'.format('Total', self.total)
-        return result
+        lines = ['"{!s}"\t{!s}'.format(k, v) for k, v in self.types.items()]
+        lines.append('{:<10}\t{}\n'.format('Total', self.total))
+        return '\n'.join(lines)
+
+
+def instance_platform(details, platform):
+    '''
+    Returns an instance's platform as a reservation names it, from its
+    PlatformDetails, or its Platform where PlatformDetails is missing.
+    '''
+    if details is not None:
+        return details
+    return 'Windows' if platform == 'windows' else matching.FLEXIBLE_PLATFORM
 
 
 class Instances(InstancesBase):
-    def __init__(self, client):
-        super().__init__(client)
+    operation = 'describe_instances'
+    page_limits = (5, 1000)
+    record_format = 3
+
+    def __init__(self, client, page_size=None, cache=None, group_by=()):
+        super().__init__(client, page_size, cache)
+        self.group(group_by)
         self.filters = [
             {
                 'Name': 'instance-state-name',
                 'Values': ['running']
             }
         ]
-        self._run()
 
-    def _run(self):
-        response = self.client.describe_instances(Filters=self.filters)
-        for reservation in response['Reservations']:
+    def page_items(self, page):
+        # Only on demand instances can use a reservation.  Spot, scheduled and
+        # capacity block instances have an InstanceLifecycle.
+        for reservation in page['Reservations']:
             for instance in reservation['Instances']:
-                it = instance['InstanceType']
-                self.add(it)
+                if 'InstanceLifecycle' not in instance:
+                    yield instance
+
+    def record(self, instance):
+        placement = instance.get('Placement', {})
+        record = (instance['InstanceType'], placement.get('AvailabilityZone'),
+                  instance_platform(instance.get('PlatformDetails'), instance.get('Platform')),
+                  placement.get('Tenancy', 'default'))
+        return record + (self.dimension_values(record, instance.get('Tags')),)
+
+    def dimension_values(self, record, tags=None):
+        if not self.rollups:
+            return ()
+        it, zone, platform, tenancy = record
+        fields = {'type': it, 'az': zone, 'platform': platform, 'tenancy': tenancy}
+        return dimension_values(self.rollups.dimensions, fields, tags)
+
+    def add_record(self, record, n=1):
+        placement = self.placement(record)
+        self.add(record[0], n)
+        self.place(placement, n)
+        if self.rollups:
+            self.rollups.add(record[4], placement, n)
+
+    def placement(self, record):
+        return record[:4]
+
+
+class FastInstances(Instances):
+    '''
+    Instances, read with the streaming parser in fastparse instead of
+    botocore's.  Tags are not read, so it cannot be grouped by tag.
+    '''
+
+    def _count_page(self):
+        self.pages += 1
+
+    def _records(self):
+        page_size = None
+        if self.page_size is not None:
+            low, high = self.page_limits
+            page_size = min(max(self.page_size, low), high)
+        fields = ('instanceType', 'instanceLifecycle', 'placement/availabilityZone', 'placement/tenancy', 'platformDetails', 'platform')
+        for item in fastparse.query(self.client, 'DescribeInstances', fields, self.filters, page_size, self._count_page):
+            if item.get('instanceLifecycle') is None:
+                record = (item['instanceType'], item['placement/availabilityZone'],
+                          instance_platform(item['platformDetails'], item['platform']),
+                          item['placement/tenancy'] or 'default')
+                yield record + (self.dimension_values(record),)
 
 
 class ReservedInstances(InstancesBase):
-    def __init__(self, client):
-        super().__init__(client)
-        self.expiries = ExpiryPeriods()
+    operation = 'describe_reserved_instances'
+    record_format = 2
+
+    def __init__(self, client, page_size=None, cache=None, horizons=DEFAULT_HORIZONS):
+        super().__init__(client, page_size, cache)
+        self.expiries = ExpiryPeriods(horizons)
         self.filters = [
             {
                 'Name': 'state',
                 'Values': ['active']
             }
         ]
-        self._run()
 
-    def _run(self):
-        response = self.client.describe_reserved_instances(Filters=self.filters)
-        for instance in response['ReservedInstances']:
-            it = instance['InstanceType']
-            cnt = instance['InstanceCount']
-            end = instance['End']
-            self.add(it, cnt)
-            self.expiries.add(it, cnt, end)
+    def page_items(self, page):
+        return page['ReservedInstances']
 
+    def record(self, instance):
+        zone = instance.get('AvailabilityZone') if instance.get('Scope') == 'Availability Zone' else None
+        return (instance['InstanceType'], instance['InstanceCount'], instance['End'], zone,
+                matching.platform(instance.get('ProductDescription', matching.FLEXIBLE_PLATFORM)),
+                instance.get('InstanceTenancy', 'default'))
 
-class RdsInstances(InstancesBase):
-    def __init__(self, client):
-        super().__init__(client)
-        self.filters = [
-            {
-                'Name': 'state',
-                'Values': ['running']
-            }
-        ]
-        self._run()
+    def add_record(self, record, n=1):
+        it, cnt, end = record[:3]
+        self.add(it, cnt * n)
+        self.expiries.add(it, cnt * n, end)
+        self.place(self.placement(record), cnt * n)
 
-    def _run(self):
-        response = self.client.describe_db_instances()
-        for instance in response['DBInstances']:
-            it = instance['DBInstanceClass']
-            self.add(it)
+    def add_records(self, counts):
+        add_reserved_records(self, counts)
 
+    def placement(self, record):
+        it, cnt, end, zone, platform, tenancy = record
+        return (it, zone, platform, tenancy)
 
-class ReservedRdsInstances(InstancesBase):
-    def __init__(self, client):
-        super().__init__(client)
-        self.expiries = ExpiryPeriods()
-        self.filters = [
-            {
-                'Name': 'state',
-                'Values': ['active']
-            }
-        ]
-        self._run()
-
-    def _run(self):
-        response = self.client.describe_reserved_db_instances()
-        for instance in response['ReservedDBInstances']:
-            it = instance['DBInstanceClass']
-            cnt = instance['DBInstanceCount']
-            startTime = instance['StartTime']
-            duration = instance['Duration']
-            end = startTime + timedelta(seconds=duration)
-            self.add(it, cnt)
-            self.expiries.add(it, cnt, end)
-
-
-def collect_ec2_info():
-    client = boto3.client('ec2')
-    instances = Instances(client)
-    r_instances = ReservedInstances(client)
+
+class FastReservedInstances(ReservedInstances):
+    '''
+    ReservedInstances, read with the streaming parser in fastparse instead of
+    botocore's.
+    '''
+
+    def _count_page(self):
+        self.pages += 1
+
+    def _records(self):
+        fields = ('instanceType', 'instanceCount', 'end', 'scope', 'availabilityZone', 'productDescription', 'instanceTenancy')
+        for item in fastparse.query(self.client, 'DescribeReservedInstances', fields, self.filters, None, self._count_page):
+            zone = item['availabilityZone'] if item['scope'] == 'Availability Zone' else None
+            yield (item['instanceType'], int(item['instanceCount']), fastparse.parse_timestamp(item['end']), zone,
+                   matching.platform(item['productDescription'] or matching.FLEXIBLE_PLATFORM), item['instanceTenancy'] or 'default')
+
+
+class SpecInstances(InstancesBase):
+    '''
+    What is in use of a service described by a CollectorSpec.  Each service
+    has a subclass, made by spec_collection, with the compiled spec.
+    Records are (type, count, dimension values).
+    '''
+    spec = None
+    extract = None
+    record_format = 3
+
+    def __init__(self, client, page_size=None, cache=None, group_by=()):
+        super().__init__(client, page_size, cache)
+        self.group(group_by)
+        self.filters = [self.spec.params, self.spec.where]
+
+    def page_params(self):
+        return dict(self.spec.params)
+
+    def _pages(self):
+        spec = self.spec
+        if spec.names is None:
+            yield from self.paginate(self.operation, **self.page_params())
+            return
+        for params in self.batch_params(self.paginate(spec.names[0])):
+            yield from self.paginate(self.operation, **params)
+
+    def batch_params(self, list_pages):
+        '''
+        Returns the arguments of each describe call of a spec with names,
+        given the pages of its list call.
+        '''
+        list_operation, key, path, argument, batch = self.spec.names
+        name = getter(path)
+        names = [name(item) for page in list_pages for item in page.get(key, ())]
+        return [dict(self.spec.params, **{argument: names[start:start + batch]}) for start in range(0, len(names), batch)]
+
+    def next_params(self, kwargs, page):
+        # Calls without a paginator are paged by hand if the spec has a token
+        token = self.spec.token
+        if token is None or not page.get(token[1]):
+            return None
+        return dict(kwargs, **{token[0]: page[token[1]]})
+
+    def page_items(self, page):
+        keep = self.extract.keep
+        return [item for item in page.get(self.spec.items, ()) if keep(item)]
+
+    def record(self, item):
+        extract = self.extract
+        values = ()
+        if self.rollups:
+            tags = extract.tags(item) if extract.tags is not None else None
+            values = dimension_values(self.rollups.dimensions, extract.fields(item, self.rollups.dimensions), tags)
+        return (extract.type(item), extract.count(item), values)
+
+    def add_record(self, record, n=1):
+        it, cnt, values = record
+        self.add(it, cnt * n)
+        if self.rollups:
+            # Matched by type alone
+            self.rollups.add(values, (it, None, None, None), cnt * n)
+
+
+class SpecReservations(SpecInstances):
+    '''
+    What is reserved for a service described by a CollectorSpec.  Records
+    are (type, count, end).
+    '''
+    record_format = 2
+
+    def __init__(self, client, page_size=None, cache=None, horizons=DEFAULT_HORIZONS):
+        InstancesBase.__init__(self, client, page_size, cache)
+        self.expiries = ExpiryPeriods(horizons)
+        self.filters = [self.spec.params, self.spec.where]
+
+    def record(self, item):
+        extract = self.extract
+        return (extract.type(item), extract.count(item), extract.end(item))
+
+    def add_record(self, record, n=1):
+        it, cnt, end = record
+        self.add(it, cnt * n)
+        self.expiries.add(it, cnt * n, end)
+
+    def add_records(self, counts):
+        add_reserved_records(self, counts)
+
+
+def spec_collection(name, spec):
+    '''
+    Returns a SpecInstances or SpecReservations subclass for a CollectorSpec,
+    with the spec compiled once.
+    '''
+    base = SpecReservations if spec.reserved else SpecInstances
+    return type(name, (base,), {
+        'spec': spec,
+        'extract': Extractors(spec),
+        'operation': spec.operation,
+        'page_limits': spec.page_limits
+    })
+
+
+# service: (in use collection, reserved collection) for the services in SPECS
+SPEC_COLLECTIONS = {
+    service: (spec_collection(name + 'Instances', in_use), spec_collection('Reserved' + name + 'Instances', reserved))
+    for service, (title, name, in_use, reserved) in SPECS.items()
+}
+RdsInstances, ReservedRdsInstances = SPEC_COLLECTIONS['rds']
+
+
+def merge_collections(collections):
+    '''
+    Merges a list of InstancesBase results into a single InstancesBase.
+    '''
+    merged = InstancesBase(None)
+    with tracing.span('merge_collections', 'aggregate', collections=len(collections)):
+        for collection in collections:
+            merged.merge(collection)
+    return merged
+
+
+def cell_collection(cell, types, expiries=None, placements=None, rollups=None):
+    '''
+    Returns a collection of one (account, region) cell, laid out as a
+    collection that has just been run for it.
+    '''
+    collection = InstancesBase(None)
+    collection.types = types
+    collection.shards.add(cell, types)
+    if expiries is not None:
+        collection.expiries = expiries
+        collection.expiry_shards[cell] = expiries
+    if placements:
+        collection.placements = placements
+        collection.placement_shards[cell] = placements
+    if rollups:
+        collection.rollups = rollups
+        collection.rollup_shards[cell] = rollups
+    return collection
+
+
+def split_collection(collection):
+    '''
+    Splits a merged collection back into one collection per (account,
+    region) cell, keyed by cell, as collect_collection returns them.
+    '''
+    return {
+        cell: cell_collection(cell, counts, collection.expiry_shards.get(cell), collection.placement_shards.get(cell),
+                              collection.rollup_shards.get(cell))
+        for cell, counts in collection.shards.cells.items()
+    }
+
+
+def state_cells(state):
+    '''
+    Returns a collection for each (account, region) cell of an
+    InstancesBase.state().
+    '''
+    cells = []
+    for cell in state['cells']:
+        types = Counts()
+        for name, n in cell['types'].items():
+            types.add(name, n)
+        cells.append(cell_collection(
+            (cell['account'], cell['region']), types,
+            ExpiryPeriods.from_state(cell['expiries']) if cell['expiries'] is not None else None,
+            Counter({tuple(placement[:-1]): placement[-1] for placement in cell['placements']}),
+            Rollups.from_state(cell['rollups']) if cell['rollups'] is not None else None))
+    return cells
+
+
+def collection_from_states(states):
+    '''
+    Returns the merged collection of any number of InstancesBase.state(),
+    with its cells in (account, region) order, whatever order the states are
+    in.
+    '''
+    cells = [cell for state in states for cell in state_cells(state)]
+    cells.sort(key=lambda collection: next(iter(collection.shards.cells)))
+    collection = merge_collections(cells)
+    collection.pages = sum(state['pages'] for state in states)
+    collection.items = sum(state['items'] for state in states)
+    return collection
+
+
+def collect_ec2_info(page_size=None, region=None, account=None, cache=None, horizons=DEFAULT_HORIZONS):
+    client = session_pool().lazy_client('ec2', region, account)
+    instances = Instances(client, page_size, cache).collect()
+    r_instances = ReservedInstances(client, page_size, cache, horizons).collect()
     return (instances, r_instances)
 
 
-def collect_rds_info():
-    client = boto3.client('rds')
-    instances = RdsInstances(client)
-    r_instances = ReservedRdsInstances(client)
+def collect_rds_info(page_size=None, region=None, account=None, cache=None, horizons=DEFAULT_HORIZONS):
+    client = session_pool().lazy_client('rds', region, account)
+    instances = RdsInstances(client, page_size, cache).collect()
+    r_instances = ReservedRdsInstances(client, page_size, cache, horizons).collect()
     return (instances, r_instances)
 
 
+@lru_cache(maxsize=None)
+def enabled_regions():
+    '''
+    Returns the regions enabled for the caller's account.  describe_regions
+    leaves out opt-in regions that have not been enabled, which every call
+    would fail in.
+    '''
+    response = session_pool().client('ec2').describe_regions()
+    return frozenset(region['RegionName'] for region in response['Regions'])
+
+
+def available_regions(service):
+    '''
+    Returns the regions the service is offered in that are enabled for the
+    caller's account.
+    '''
+    enabled = enabled_regions()
+    return [region for region in session_pool().base_session().get_available_regions(service) if region in enabled]
+
+
+def parse_regions(value, service):
+    '''
+    Turns the --regions value into a list of regions.  'all' expands to every
+    enabled region the service is available in.
+    '''
+    if value is None:
+        return [None]
+    if value == 'all':
+        return available_regions(service)
+    return [region.strip() for region in value.split(',') if region.strip()]
+
+
+def parse_accounts(value, role_name):
+    '''
+    Turns the --accounts value into a list of Accounts.  'org' lists the
+    accounts of the caller's Organization, anything else is an account list
+    file.  None is the caller's own account.
+    '''
+    if value is None:
+        return [None]
+    if value == 'org':
+        return organization_accounts(role_name)
+    return load_accounts(value, role_name)
+
+
+def collect_collection(cls, service, targets, page_size=None, max_workers=8, cache=None, on_target=None, **options):
+    '''
+    Builds a cls collection for every (account, region) target concurrently,
+    on a pool of at most max_workers threads.  options are passed on to cls.
+    Returns the merged collection, and a dict of the per-target collections,
+    keyed by their SessionPool.scope() labels, in the order the targets were
+    given.  A target that fails, such as an account whose role cannot be
+    assumed or a region that is not enabled, is reported on stderr and left
+    out, unless every target fails.  If on_target is given, it is called
+    with the key and collection of each target as it finishes, on the
+    thread that collected it.
+    '''
+    def build(key, account, region):
+        collection = cls(session_pool().lazy_client(service, region, account), page_size, cache, **options).collect()
+        if on_target is not None:
+            on_target(key, collection)
+        return collection
+
+    if len(targets) == 1:
+        account, region = targets[0]
+        key = session_pool().scope(region, account)
+        collection = build(key, account, region)
+        return (collection, {key: collection})
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for account, region in targets:
+            key = session_pool().scope(region, account)
+            futures[key] = executor.submit(build, key, account, region)
+        results = {}
+        errors = {}
+        for key, future in futures.items():
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+
+    if errors and not results:
+        raise next(iter(errors.values()))
+    for (account, region), error in errors.items():
+        print('Skipped {} in account {}, region {}: {}'.format(cls.operation, account, region, error), file=sys.stderr)
+    return (merge_collections(results.values()), results)
+
+
+def breakdown(in_use, reserved, index):
+    '''
+    Merges per-target in use and reserved collections by account (index 0) or
+    region (index 1).  A target skipped on one side counts as empty there.
+    '''
+    grouped = {}
+    for key in list(in_use) + [key for key in reserved if key not in in_use]:
+        grouped.setdefault(key[index], []).append(key)
+    return {
+        group: (merge_collections([in_use[key] for key in keys if key in in_use]),
+                merge_collections([reserved[key] for key in keys if key in reserved]))
+        for group, keys in grouped.items()
+    }
+
+
+# (title, stats name, service, in use collection, reserved collection)
+TABLES = [('EC2 Instances', 'EC2', 'ec2', Instances, ReservedInstances)] + [
+    (title, name, service) + SPEC_COLLECTIONS[service]
+    for service, (title, name, in_use, reserved) in SPECS.items()
+]
+
+SERVICES = [table[2] for table in TABLES]
+DEFAULT_SERVICES = ('ec2', 'rds')
+
+
+def parse_services(value):
+    '''
+    Turns the --services value, a comma separated list, into a tuple of
+    services.
+    '''
+    services = tuple(service.strip() for service in value.split(',') if service.strip())
+    for service in services:
+        if service not in SERVICES:
+            raise argparse.ArgumentTypeError('unknown service {!r}. Choose from {}'.format(service, ', '.join(SERVICES)))
+    return services
+
+
+def selected_tables(args):
+    '''
+    Returns the TABLES of the --services, in TABLES order.
+    '''
+    return [table for table in TABLES if table[2] in args.services]
+
+
+# Collections replaced by --fast-parse
+FAST_COLLECTIONS = {
+    Instances: FastInstances,
+    ReservedInstances: FastReservedInstances
+}
+
+
+def schedule_tables(args, cache=None, on_target=None):
+    '''
+    Starts collecting every selected table, and returns the scheduler.  If
+    on_target is given, it is called with (title, side, key, collection) as
+    each target of a table finishes, where side is 0 for in use and 1 for
+    reserved, as collect_collection() calls its on_target.
+    '''
+    tables = selected_tables(args)
+    scheduler = CollectionScheduler(max_workers=2 * len(tables))
+    for title, name, service, in_use, reserved in tables:
+        # The fast parser does not read tags
+        if args.fast_parse and not uses_tags(args.group_by):
+            in_use = FAST_COLLECTIONS.get(in_use, in_use)
+            reserved = FAST_COLLECTIONS.get(reserved, reserved)
+        targets = shard_targets([(account, region) for account in args.account_list for region in parse_regions(args.regions, service)], args.shard)
+        progress = (None, None) if on_target is None else (partial(on_target, title, 0), partial(on_target, title, 1))
+        scheduler.add_table(
+            title,
+            scheduler.submit('{} {}'.format(name, in_use.__name__), collect_collection, in_use, service, targets, args.page_size, args.max_workers, cache, progress[0], group_by=args.group_by),
+            scheduler.submit('{} {}'.format(name, reserved.__name__), collect_collection, reserved, service, targets, args.page_size, args.max_workers, cache, progress[1], horizons=args.horizons))
+    return scheduler
+
+
+def print_stats(title, instances, r_instances):
+    for label, collection in (('in use', instances), ('reserved', r_instances)):
+        stats = collection.stats()
+        print('{} {}: {} pages, {} items'.format(title, label, stats['pages'], stats['items']), file=sys.stderr)
+
+
+def parse_output(value):
+    '''
+    Splits an --output value of protocol[:destination].
+    '''
+    protocol, _, destination = value.partition(':')
+    if protocol not in PROTOCOLS:
+        raise argparse.ArgumentTypeError('unknown protocol {!r}. Choose from {}'.format(protocol, ', '.join(PROTOCOLS)))
+    return (protocol, destination or None)
+
+
+def make_formatter(protocol, cfg, horizons=DEFAULT_HORIZONS):
+    cls = formatter_class(protocol)
+    if protocol == 'arrow':
+        # The schema is needed even if no table is formatted
+        return cls(cfg, horizons=horizons)
+    if protocol == 'html':
+        return cls(cfg, streaming=True)
+    if protocol == 'metrics':
+        return cls(cfg, {table[0]: table[2] for table in TABLES})
+    return cls(cfg)
+
+
+def open_outputs(outputs, horizons=DEFAULT_HORIZONS):
+    '''
+    Returns a formatter for each (protocol, destination) output, each writing
+    to its own sink.
+    '''
+    formatters = []
+    try:
+        for protocol, destination in outputs:
+            formatters.append(make_formatter(protocol, FormatConfig(open_sink(destination)), horizons))
+    except BaseException:
+        for formatter in formatters:
+            formatter.cfg.abort()
+        raise
+    return formatters
+
+
+def table_reports(args, results):
+    '''
+    Yields (name, title, in use, reserved, breakdowns, rollups) for each
+    table as its collections finish, where breakdowns is a list of (title,
+    key title, breakdown) for the --by-account and --by-region tables, and
+    rollups a list of (title, key title, rows) for the --group-by tables.
+    results yields the collections of the selected tables, as
+    CollectionScheduler.results() does.
+    '''
+    names = [table[1] for table in selected_tables(args)]
+    for name, (title, (instances, in_use), (r_instances, reserved)) in zip(names, results):
+        breakdowns = []
+        if args.by_account and len(in_use) > 1:
+            breakdowns.append(('{} by Account'.format(title), 'Account', breakdown(in_use, reserved, 0)))
+        if args.by_region and len(in_use) > 1:
+            breakdowns.append(('{} by Region'.format(title), 'Region', breakdown(in_use, reserved, 1)))
+        rollups = []
+        for grouping, rows in rollup_rows(instances, r_instances):
+            key_title = ' / '.join(grouping)
+            rollups.append(('{} by {}'.format(title, key_title), key_title, rows))
+        yield (name, title, instances, r_instances, breakdowns, rollups)
+
+
+def format_report(formatter, report):
+    name, title, instances, r_instances, breakdowns, rollups = report
+    formatter_name = type(formatter).__name__
+    with tracing.span('format_table', 'format', formatter=formatter_name, table=title):
+        formatter.format_table(title, instances, r_instances)
+    for breakdown_title, key_title, rows in breakdowns:
+        with tracing.span('format_breakdown', 'format', formatter=formatter_name, table=breakdown_title):
+            formatter.format_breakdown(breakdown_title, key_title, rows)
+    for rollup_title, key_title, rows in rollups:
+        with tracing.span('format_rollup', 'format', formatter=formatter_name, table=rollup_title):
+            formatter.format_rollup(rollup_title, key_title, rows)
+
+
+def finish_output(formatter):
+    with tracing.span('format', 'format', formatter=type(formatter).__name__):
+        formatter.format()
+        formatter.cfg.close()
+
+
+def render_report(protocol, reports):
+    '''
+    Renders the table reports with a protocol, and returns the bytes.
+    '''
+    sink = MemorySink()
+    formatter = make_formatter(protocol, FormatConfig(sink))
+    for report in reports:
+        format_report(formatter, report)
+    finish_output(formatter)
+    return sink.getvalue()
+
+
+def run_report(args, outputs, cache=None, results=None):
+    '''
+    Collects the tables, or takes them from results, as table_reports does,
+    and formats them to every output.
+    '''
+    scheduler = None
+    if results is None:
+        scheduler = schedule_tables(args, cache)
+        results = scheduler.results()
+    formatters = open_outputs(outputs, args.horizons)
+    reports = []
+    try:
+        for report in table_reports(args, results):
+            for formatter in formatters:
+                format_report(formatter, report)
+            if args.history:
+                reports.append(report)
+            if args.stats:
+                print_stats(report[0], report[2], report[3])
+
+        for formatter in formatters:
+            finish_output(formatter)
+    except BaseException:
+        for formatter in formatters:
+            formatter.cfg.abort()
+        raise
+
+    if args.history:
+        record_history(args.history, reports)
+
+    if args.stats:
+        if scheduler is not None:
+            scheduler.report()
+        if cache is not None:
+            print('Cache: {} hits, {} misses'.format(cache.hits, cache.misses), file=sys.stderr)
+        rate_limiter().report()
+    print_throttles()
+
+
+def run_map(args, cache=None):
+    '''
+    Collects the selected tables from the --shard of the targets, and writes
+    them to the --partial file for reduce.
+    '''
+    from partial import write_partial
+    scheduler = schedule_tables(args, cache)
+    tables = []
+    for table, (title, (instances, in_use), (r_instances, reserved)) in zip(selected_tables(args), scheduler.results()):
+        with tracing.span('state', 'partial', table=title):
+            tables.append((table[2], instances.state(), r_instances.state()))
+    with tracing.span('write_partial', 'partial'):
+        write_partial(args.partial[0], args.horizons, args.group_by, tables)
+    if args.stats:
+        scheduler.report()
+    print_throttles()
+
+
+def reduced_results(args, tables):
+    '''
+    Merges the states of each selected table from the partial files, and
+    yields its collections as CollectionScheduler.results() does.
+    '''
+    from partial import paused_gc
+    for title, name, service, in_use, reserved in selected_tables(args):
+        in_use_states, reserved_states = tables[service]
+        with tracing.span('reduce', 'partial', table=title, partials=len(in_use_states)), paused_gc():
+            instances = collection_from_states(in_use_states)
+            r_instances = collection_from_states(reserved_states)
+            if r_instances.expiries is None:
+                r_instances.expiries = ExpiryPeriods(args.horizons)
+            in_use = split_collection(instances)
+            reserved = split_collection(r_instances)
+            # Every cell is on both sides, as when collected
+            for cell in set(in_use) | set(reserved):
+                in_use.setdefault(cell, InstancesBase(None))
+                reserved.setdefault(cell, InstancesBase(None))
+        yield (title, (instances, in_use), (r_instances, reserved))
+
+
+def run_reduce(args, outputs):
+    '''
+    Merges the --partial files written by map, and formats the report to
+    every output.
+    '''
+    from partial import read_partials
+    if not args.partial:
+        raise SystemExit('reduce needs at least one --partial file')
+    try:
+        args.horizons, args.group_by, tables = read_partials(args.partial)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    args.services = tuple(service for service in SERVICES if service in tables)
+    run_report(args, outputs, results=reduced_results(args, tables))
+
+
+def watch_events(args, cache=None):
+    '''
+    Collects the tables in the background, and returns a queue of their
+    progress: ('target', (title, side, key, collection)) as each target of
+    a table finishes, ('report', report) as each table does, as
+    table_reports() yields them, then ('done', None), or ('error', e) if
+    collecting failed.
+    '''
+    import queue
+    import threading
+    events = queue.Queue()
+    scheduler = schedule_tables(args, cache, lambda *target: events.put(('target', target)))
+
+    def finish():
+        try:
+            for report in table_reports(args, scheduler.results()):
+                events.put(('report', report))
+        except BaseException as e:
+            events.put(('error', e))
+        else:
+            events.put(('done', None))
+
+    threading.Thread(target=finish, daemon=True).start()
+    return events
+
+
+def watch_report(args, title, targets):
+    '''
+    Returns the report of a table that is still being collected, from the
+    in use and reserved collections of the targets finished so far.
+    '''
+    name = next(table[1] for table in selected_tables(args) if table[0] == title)
+    instances, r_instances = (merge_collections(list(collections.values())) for collections in targets)
+    if r_instances.expiries is None:
+        r_instances.expiries = ExpiryPeriods(args.horizons)
+    return (name, title, instances, r_instances, [], [])
+
+
+def run_watch(args, cache=None):
+    '''
+    Shows the termio report live, collecting it again every --interval
+    seconds.  Each table is redrawn as each of its accounts and regions
+    finishes, then replaced by the whole table with its breakdowns once its
+    collections finish.  Only the rows that changed are redrawn.  Runs until
+    interrupted.
+    '''
+    from watch import LiveScreen, split_lines
+    titles = [table[0] for table in selected_tables(args)]
+    sections = {title: ['Collecting {}...'.format(title)] for title in titles}
+    screen = LiveScreen()
+    cfg = FormatConfig()
+
+    def draw(status):
+        screen.update([status, ''] + [line for title in titles for line in sections[title]])
+
+    def render(report):
+        formatter = make_formatter('termio', cfg)
+        format_report(formatter, report)
+        return split_lines(formatter.lines) + ['']
+
+    screen.start()
+    try:
+        while True:
+            started = time.time()
+            draw('Collecting {} tables (Ctrl-C to quit)'.format(len(titles)))
+            try:
+                events = watch_events(args, cache)
+                targets = {title: ({}, {}) for title in titles}
+                finished = 0
+                reports = []
+                while True:
+                    # Everything that arrived while the last update was drawn
+                    # is drawn at once
+                    batch = [events.get()]
+                    while not events.empty():
+                        batch.append(events.get())
+                    changed = set()
+                    for kind, item in batch:
+                        if kind == 'target':
+                            title, side, key, collection = item
+                            targets[title][side][key] = collection
+                            changed.add(title)
+                            finished += 1
+                        elif kind == 'report':
+                            sections[item[1]] = render(item)
+                            reports.append(item)
+                            changed.discard(item[1])
+                        elif kind == 'error':
+                            raise item
+                    for title in changed:
+                        sections[title] = render(watch_report(args, title, targets[title]))
+                    if batch[-1][0] == 'done':
+                        break
+                    draw('Collected {} of {} tables, from {} account and region collections (Ctrl-C to quit)'.format(len(reports), len(titles), finished))
+                if args.history:
+                    record_history(args.history, reports)
+                status = 'Updated'
+            except Exception as e:
+                status = 'Refresh failed ({}: {}) at'.format(type(e).__name__, e)
+            draw('{} {:%H:%M:%S}, next refresh in {}s (Ctrl-C to quit)'.format(status, datetime.now(), args.interval))
+            time.sleep(max(0, args.interval - (time.time() - started)))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        screen.stop()
+    print_throttles()
+
+
+def print_throttles():
+    '''
+    Prints how many AWS calls were throttled, if any were.
+    '''
+    limiter = rate_limiter()
+    if limiter.throttles:
+        print('Throttled: {} of {} AWS calls'.format(limiter.throttles, limiter.calls), file=sys.stderr)
+
+
+def record_history(path, reports):
+    '''
+    Adds a snapshot of the table reports to the history at path.
+    '''
+    from history import SnapshotStore
+    with tracing.span('record_history', 'history'):
+        store = SnapshotStore(path)
+        try:
+            store.record(reports, {table[0]: table[2] for table in TABLES})
+        finally:
+            store.close()
+
+
+def run_history(args):
+    '''
+    Prints the trend or the latest diff from the history.
+    '''
+    from history import DEFAULT_PATH as HISTORY_PATH, EVERY, SnapshotStore, print_diff, print_trend
+    store = SnapshotStore(args.history or HISTORY_PATH)
+    try:
+        if args.command == 'trend':
+            print_trend(store.trend(args.since, args.until, EVERY[args.every], args.only_service,
+                                    args.only_account, args.only_region, args.only_type))
+        else:
+            print_diff(*store.diff())
+    finally:
+        store.close()
+
+
+def parse_history_time(value):
+    from history import parse_time
+    return parse_time(value)
+
+
 def main():
-    formatter = None
     parser = argparse.ArgumentParser(description='Calculate AWS instance diffs')
-    parser.add_argument("-p", "--protocol", default="termio", help='The output protocol to use', choices=['html', 'termio'])
+    parser.add_argument("command", nargs='?', default='report', choices=['report', 'serve', 'trend', 'diff', 'map', 'reduce'], help="'report' prints the report once. 'serve' serves it over HTTP, refreshing it in the background. 'trend' and 'diff' read the --history of earlier runs. 'map' collects a --shard of the accounts and regions into a --partial file, and 'reduce' merges --partial files into the report")
+    parser.add_argument("-p", "--protocol", default="termio", help='The output protocol to use', choices=PROTOCOLS)
     parser.add_argument("-f", "--file", help='Optional file to output to. Defaults to stdout')
+    parser.add_argument("-o", "--output", type=parse_output, action='append', help="An output, as protocol[:destination]. May be repeated. Destinations ending in .gz are compressed, and '-' or none is stdout. Overrides -p and -f")
+    parser.add_argument("--page-size", type=int, help='Number of items to request per describe_* page')
+    parser.add_argument("--stats", action='store_true', help='Print page and item counts, and AWS calls and throttles by API, to stderr')
+    parser.add_argument("--services", type=parse_services, default=DEFAULT_SERVICES, help="Comma separated services to report on, from {}. Defaults to {}".format(', '.join(SERVICES), ','.join(DEFAULT_SERVICES)))
+    parser.add_argument("--regions", help="Regions to collect from: 'all', or a comma separated list. Defaults to the configured region")
+    parser.add_argument("--accounts", help="Accounts to collect from: 'org' for every account in the Organization, or an account list file. Defaults to the caller's account")
+    parser.add_argument("--role-name", default=DEFAULT_ROLE_NAME, help='Role to assume in accounts that do not name one')
+    parser.add_argument("--max-workers", type=int, default=8, help='Maximum number of accounts and regions to collect from at once')
+    parser.add_argument("--no-rate-limit", dest='rate_limit', action='store_false', help="Send AWS calls as fast as possible, rather than at the rate each API sustains without throttling")
+    parser.add_argument("--shard", type=parse_shard, help="Only collect every COUNT-th account and region, from INDEX, given as INDEX/COUNT such as 0/8. For 'map' workers")
+    parser.add_argument("--partial", action='append', default=[], help="The partial file 'map' writes, or one of those 'reduce' merges. May be repeated for 'reduce'. Files ending in .gz are compressed")
+    parser.add_argument("--by-region", action='store_true', help='Add a per-region breakdown table when --regions is used')
+    parser.add_argument("--by-account", action='store_true', help='Add a per-account breakdown table when --accounts is used')
+    parser.add_argument("--group-by", type=parse_group_by, action='append', default=[], help="Add a coverage table grouped by comma separated dimensions: tag:KEY, type, az, platform, tenancy or engine (RDS and ElastiCache). May be repeated, and every table is computed in the same pass")
+    parser.add_argument("--horizons", type=parse_horizons, default=DEFAULT_HORIZONS, help='Comma separated expiry horizons in days. Defaults to 1,7,30')
+    parser.add_argument("--fast-parse", action='store_true', help='Stream-parse EC2 responses, keeping only the fields that are counted')
+    parser.add_argument("--max-age", type=int, default=0, help='Reuse cached describe_* results up to this many seconds old. 0 disables the cache')
+    parser.add_argument("--refresh", action='store_true', help='Ignore cached results, and cache fresh ones')
+    parser.add_argument("--cache-dir", default=DEFAULT_PATH, help='Directory for cached results')
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES // (1024 * 1024), help='Maximum size of the cache in MB')
+    parser.add_argument("--trace", help='Write a Chrome trace of the run to this file, and print a summary of where the time went to stderr')
+    parser.add_argument("--profile", help='Profile the run with cProfile, write the stats to this file, and print the slowest functions to stderr')
+    parser.add_argument("--history", nargs='?', const='', help="Record each report in this history file, or the default one if none is given. 'trend' and 'diff' read it")
+    parser.add_argument("--since", type=parse_history_time, help="Start of the trend, as an ISO 8601 date or time, or an age such as 30d. Defaults to 30d")
+    parser.add_argument("--until", type=parse_history_time, help='End of the trend, as for --since. Defaults to now')
+    parser.add_argument("--every", default='day', choices=['hour', 'day', 'week'], help='Show the last snapshot of every hour, day or week in the trend')
+    parser.add_argument("--only-service", choices=SERVICES, help="Only count this service, from {}, in the trend".format(', '.join(SERVICES)))
+    parser.add_argument("--only-account", help='Only count this account in the trend')
+    parser.add_argument("--only-region", help='Only count this region in the trend')
+    parser.add_argument("--only-type", help='Only count this instance type in the trend')
+    parser.add_argument("--bind", default='127.0.0.1', help='Address to serve on')
+    parser.add_argument("--port", type=int, default=8000, help='Port to serve on')
+    parser.add_argument("--watch", action='store_true', help='Show the termio report live, redrawing the rows that change, and collect it again every --interval seconds')
+    parser.add_argument("--interval", type=int, default=300, help='Seconds between refreshes when serving or with --watch. Requests never trigger collection, so this is also the minimum refresh interval')
     args, unknownargs = parser.parse_known_args()
-    protocol = args.protocol
+    if args.command in ('trend', 'diff'):
+        if args.since is None:
+            args.since = parse_history_time('30d')
+        run_history(args)
+        return
+    if args.history == '':
+        from history import DEFAULT_PATH as HISTORY_PATH
+        args.history = HISTORY_PATH
+    rate_limiter().enabled = args.rate_limit
+    # Every worker of every collection may share the clients that are not
+    # regional
+    session_pool().configure(2 * len(selected_tables(args)) * args.max_workers)
+    if args.command == 'map' and len(args.partial) != 1:
+        parser.error("map needs one --partial file to write")
+    # reduce makes no AWS calls, so does not list the accounts
+    if args.command != 'reduce':
+        args.account_list = parse_accounts(args.accounts, args.role_name)
+    outputs = args.output or [(args.protocol, args.file)]
+    if args.watch or any(protocol == 'termio' for protocol, destination in outputs):
+        # Once, as it wraps stdout for the whole process
+        from colorama import init
+        init()
 
-    f = None
-    if args.file:
-        f = open(args.file, 'w')
+    cache = None
+    if args.max_age > 0 or args.refresh:
+        cache = ResponseCache(args.cache_dir, args.max_age, args.refresh, args.cache_size * 1024 * 1024)
 
-    cfg = FormatConfig(f)
+    if args.watch:
+        run_watch(args, cache)
+        return
 
-    if protocol == 'html':
-        formatter = HtmlFormatter(cfg)
-    else:
-        formatter = TermioFormatter(cfg)
-
-    instances, r_instances = collect_ec2_info()
-    formatter.format_table('EC2 Instances', instances, r_instances)
+    if args.command == 'serve':
+        from server import ReportServer
+        def collect():
+            reports = list(table_reports(args, schedule_tables(args, cache).results()))
+            if args.history:
+                record_history(args.history, reports)
+            return reports
+        ReportServer(collect, render_report, args.interval).serve(args.bind, args.port)
+        return
 
-    instances, r_instances = collect_rds_info()
-    formatter.format_table('RDS Instances', instances, r_instances)
-
-    formatter.format()
+    tracer = tracing.enable() if args.trace else None
+    profiler = None
+    if args.profile:
+        profiler = tracing.Profiler()
+        profiler.start()
+    try:
+        if args.command == 'map':
+            run_map(args, cache)
+        elif args.command == 'reduce':
+            run_reduce(args, outputs)
+        else:
+            run_report(args, outputs, cache)
+    finally:
+        if profiler is not None:
+            profiler.stop()
+            profiler.write(args.profile)
+        if tracer is not None:
+            tracer.write(args.trace)
+            tracer.summary()
 
 
 if __name__ == '__main__':
@@ -16,16 +16,16 @@ class comment(HtmlElement):
         else:
             self.child(lines)
 
-    def format_open(self, cfg):
-        cfg.startline('<!-- ')
+    def open_text(self, indent):
+        text = '{}<!-- '.format('\t' * indent)
         if not self.single_line:
-            cfg.endline()
+            text += '\n'
+        return text
 
-    def format_close(self, cfg):
+    def close_text(self, indent):
         if not self.single_line:
-            cfg.writeline('-->')
-        else:
-            cfg.endline(' -->')
+            return '{}-->\n'.format('\t' * indent)
+        return ' -->\n'
 
 
 class head(HtmlElement):
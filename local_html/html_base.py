@@ -1,3 +1,4 @@
+from functools import lru_cache
 from utils import getparam
 
 
@@ -8,18 +9,28 @@ def htmlize(val):
         return '{}'.format(str(val))
 
 
+@lru_cache(maxsize=1024)
+def render_attribute(key, value):
+    '''
+    Returns the text of an attribute, such as ' class="row"'.  Cached, since
+    the same few class and style attributes are repeated on every row.
+    '''
+    key = key.replace('_hyphen_', '-')
+    if key == 'clasz' or key == 'clazz':
+        key = 'class'
+    if value is None:
+        return ' {}'.format(key)
+    return ' {}={}'.format(key, htmlize(value))
+
+
 class HtmlAttribute():
     def __init__(self, key, value=None):
         self.key = key
         self.value = value
+        self.text = render_attribute(key, value)
 
     def format(self, cfg):
-        key = self.key.replace('_hyphen_', '-')
-        if key == 'clasz' or key == 'clazz':
-            key = 'class'
-        cfg.write(' {}'.format(key))
-        if self.value is not None:
-            cfg.write('={}'.format(htmlize(self.value)))
+        cfg.write(self.text)
 
 
 class HtmlElement():
@@ -48,41 +59,64 @@ class HtmlElement():
             self.child(elems)
         return self
 
-    def format_attrs(self, cfg):
-        for attr in self.attrs:
-            attr.format(cfg)
-
-    def format_open(self, cfg):
-        cfg.startline('<{}'.format(self.tag))
-        self.format_attrs(cfg)
-        cfg.write('>')
+    def open_text(self, indent):
+        text = '{}<{}{}>'.format('\t' * indent, self.tag, ''.join(attr.text for attr in self.attrs))
         if not self.single_line:
-            cfg.endline()
+            text += '\n'
+        return text
 
-    def format_close(self, cfg):
+    def close_text(self, indent):
+        text = ''
         if self.close_tag:
             if not self.single_line:
-                cfg.startline()
-            cfg.write('</{}>'.format(self.tag))
-        cfg.endline()
+                text = '\t' * indent
+            text += '</{}>'.format(self.tag)
+        return text + '\n'
 
-    def format_children(self, cfg):
+    def render_children(self, indent):
         for child in self.children:
             if isinstance(child, HtmlElement):
-                child.format(cfg)
+                yield from child.render(indent)
+            elif self.single_line:
+                yield str(child)
             else:
-                if not self.single_line:
-                    cfg.startline()
-                cfg.write(str(child))
-                if not self.single_line:
-                    cfg.endline()
+                yield '{}{}\n'.format('\t' * indent, child)
+
+    def render(self, indent=0):
+        '''
+        Yields the text of the element and its children in chunks, without
+        building the whole document as one string.
+        '''
+        yield self.open_text(indent)
+        yield from self.render_children(indent if self.single_line else indent + 1)
+        yield self.close_text(indent)
 
     def format(self, cfg):
-        self.format_open(cfg)
-        if not self.single_line:
-            cfg.inc()
-        self.format_children(cfg)
-        if not self.single_line:
-            cfg.dec()
-        self.format_close(cfg)
+        cfg.write_chunks(self.render(cfg.indent))
+
+
+class StreamingElement(HtmlElement):
+    '''
+    An element whose children are written to cfg as soon as they are added,
+    instead of being kept.  Rendering the document stops at this element, with
+    a STREAM marker, until the children have all been written.
+    '''
+    STREAM = object()
+
+    def __init__(self, cfg, element):
+        self.__dict__.update(element.__dict__)
+        self.cfg = cfg
+        self.indent = 0
+
+    def child(self, elem):
+        if isinstance(elem, HtmlElement):
+            self.cfg.write_chunks(elem.render(self.indent + 1))
+        else:
+            self.cfg.write('{}{}\n'.format('\t' * (self.indent + 1), elem))
+        return elem
 
+    def render(self, indent=0):
+        self.indent = indent
+        yield self.open_text(indent)
+        yield self.STREAM
+        yield self.close_text(indent)
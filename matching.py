@@ -0,0 +1,257 @@
+'''
+Matches reservations to the instances they cover, the way EC2 applies them.
+Zonal reservations cover instances of their type in their zone.  Regional
+reservations cover their type in any zone, and regional Linux/UNIX
+reservations with default tenancy are also size-flexible: within a family,
+they cover any size, in units of the size's normalization factor, so one
+m5.2xlarge reservation covers four m5.large instances.  Reservations and
+instances only match on the same platform and tenancy.
+
+Counts are given per placement, a (type, zone, platform, tenancy) tuple, with
+zone None for regional reservations.  Matching sorts the distinct placements
+of each family, so its cost depends on the number of distinct placements and
+not on the number of instances.
+'''
+from collections import Counter
+from aggregate import Counts
+
+
+# Normalization factors by size.  Sizes of nxlarge are 8n.  .metal sizes vary
+# by family, so they only match their own type.
+SIZE_FACTORS = {
+    'nano': 0.25,
+    'micro': 0.5,
+    'small': 1,
+    'medium': 2,
+    'large': 4,
+    'xlarge': 8
+}
+
+# The only platform and tenancy whose regional reservations are size-flexible
+FLEXIBLE_PLATFORM = 'Linux/UNIX'
+FLEXIBLE_TENANCY = 'default'
+
+
+def normalization_factor(instance_type):
+    '''
+    Returns the normalization factor of an instance type, such as 16 for
+    m5.2xlarge, or None if the size has no fixed factor.
+    '''
+    size = instance_type.rpartition('.')[2]
+    factor = SIZE_FACTORS.get(size)
+    if factor is None and size.endswith('xlarge') and size[:-6].isdigit():
+        factor = 8 * int(size[:-6])
+    return factor
+
+
+def family(instance_type):
+    return instance_type.rpartition('.')[0]
+
+
+def platform(description):
+    '''
+    Returns the platform of a reservation's ProductDescription or an
+    instance's PlatformDetails, which differ only by an ' (Amazon VPC)'
+    suffix on older reservations.
+    '''
+    if description is None:
+        return None
+    return description.replace(' (Amazon VPC)', '')
+
+
+def is_flexible(placement):
+    instance_type, zone, platform, tenancy = placement
+    return (zone is None and platform == FLEXIBLE_PLATFORM and tenancy == FLEXIBLE_TENANCY
+            and normalization_factor(instance_type) is not None)
+
+
+def rounded(value):
+    '''
+    Rounds a matched count to 2 places, and to an int where it is whole.
+    '''
+    # Factors of 3 in sizes such as 24xlarge leave float noise
+    value = round(value, 2)
+    return int(value) if value == int(value) else value
+
+
+def _order(placement):
+    # Sorts placements with None zones, platforms and tenancies first
+    return tuple('' if value is None else value for value in placement)
+
+
+def match(reserved, in_use):
+    '''
+    Matches reservations to instances in one account and region.  reserved
+    and in_use map placements to counts.  Returns (unused, uncovered), the
+    reservations and instances left over by placement.  Counts are fractions
+    where a size-flexible reservation is partly used, or an instance partly
+    covered.
+    '''
+    unused = Counter({placement: count for placement, count in reserved.items() if count})
+    uncovered = Counter({placement: count for placement, count in in_use.items() if count})
+
+    def cover(placement, candidates):
+        for other in candidates:
+            n = min(unused[placement], uncovered[other])
+            if n:
+                unused[placement] -= n
+                uncovered[other] -= n
+
+    # Zonal reservations cover their own placement only
+    for placement in sorted((p for p in unused if p[1] is not None), key=_order):
+        cover(placement, [placement])
+
+    # Regional reservations cover their own type in any zone first
+    by_type = {}
+    for placement in sorted((p for p in uncovered if uncovered[p]), key=_order):
+        instance_type, zone, platform, tenancy = placement
+        by_type.setdefault((instance_type, platform, tenancy), []).append(placement)
+    for placement in sorted((p for p in unused if p[1] is None), key=_order):
+        instance_type, zone, platform, tenancy = placement
+        cover(placement, by_type.get((instance_type, platform, tenancy), []))
+
+    # Then size-flexible reservations pool what is left of them by family, and
+    # cover the remaining instances of the family from the smallest size up
+    pools = {}
+    for placement in unused:
+        if unused[placement] and is_flexible(placement):
+            instance_type, zone, platform, tenancy = placement
+            pools.setdefault((family(instance_type), platform, tenancy), []).append(placement)
+    if not pools:
+        return (unused, uncovered)
+    instances = {}
+    for placement in uncovered:
+        instance_type, zone, platform, tenancy = placement
+        key = (family(instance_type), platform, tenancy)
+        if uncovered[placement] and key in pools and normalization_factor(instance_type) is not None:
+            instances.setdefault(key, []).append(placement)
+
+    for key, reservations in pools.items():
+        reservations.sort(key=lambda p: (normalization_factor(p[0]), _order(p)))
+        units = sum(unused[p] * normalization_factor(p[0]) for p in reservations)
+        available = units
+        for placement in sorted(instances.get(key, []), key=lambda p: (normalization_factor(p[0]), _order(p))):
+            if available <= 0:
+                break
+            factor = normalization_factor(placement[0])
+            n = min(available, uncovered[placement] * factor)
+            uncovered[placement] -= n / factor
+            available -= n
+        # The units used are taken from the smallest reservations first
+        used = units - available
+        for placement in reservations:
+            factor = normalization_factor(placement[0])
+            n = min(used, unused[placement] * factor)
+            unused[placement] -= n / factor
+            used -= n
+
+    return (unused, uncovered)
+
+
+def placements(collection, cell):
+    '''
+    Returns the counts by placement of one (account, region) cell of a
+    collection.  Collections that do not record placements, such as RDS,
+    count every type as one regional placement that only matches itself.
+    '''
+    counts = collection.placement_shards.get(cell)
+    if counts is not None:
+        return counts
+    return {(name, None, None, None): n for name, n in collection.shards.cells.get(cell, Counts()).items()}
+
+
+def _cells(instances, r_instances):
+    r_cells = r_instances.shards.cells
+    return list(r_cells) + [cell for cell in instances.shards.cells if cell not in r_cells]
+
+
+def _add_rows(rows, reserved, in_use):
+    unused, uncovered = match(reserved, in_use)
+    for placement, count in reserved.items():
+        rows.setdefault(placement[0], [0, 0, 0])[0] += count
+    for placement, count in in_use.items():
+        rows.setdefault(placement[0], [0, 0, 0])[1] += count
+    for placement, count in unused.items():
+        rows[placement[0]][2] += count
+    for placement, count in uncovered.items():
+        rows[placement[0]][2] -= count
+
+
+def _sorted_rows(rows):
+    return [(key, reserved, in_use, rounded(delta)) for key, (reserved, in_use, delta) in sorted(rows.items())
+            if reserved or in_use]
+
+
+def cell_rows(instances, r_instances, cell):
+    '''
+    Returns (type, reserved, in use, delta) for every type with a reservation
+    or an instance in one cell, in type name order.  delta is what is left of
+    the type's reservations less what is left of its instances after
+    matching, so it is negative where instances are not covered.
+    '''
+    rows = {}
+    _add_rows(rows, placements(r_instances, cell), placements(instances, cell))
+    return _sorted_rows(rows)
+
+
+def match_rows(instances, r_instances):
+    '''
+    Returns cell_rows added up over every cell.  Reservations only cover
+    instances in their own account and region.
+    '''
+    rows = {}
+    cells = _cells(instances, r_instances)
+    if not cells:
+        _add_rows(rows, {(name, None, None, None): n for name, n in r_instances.types.items()},
+                  {(name, None, None, None): n for name, n in instances.types.items()})
+    for cell in cells:
+        _add_rows(rows, placements(r_instances, cell), placements(instances, cell))
+    return _sorted_rows(rows)
+
+
+def match_gaps(instances, r_instances):
+    '''
+    Returns (unused, uncovered), the reservations left unused and the
+    instances left uncovered after matching, added up over every cell and
+    placement.  Unlike the delta of match_totals, they never cancel out, so
+    unused reservations of one type cannot hide uncovered instances of
+    another.
+    '''
+    unused_total = uncovered_total = 0
+    cells = _cells(instances, r_instances)
+    if not cells:
+        unused, uncovered = match({(name, None, None, None): n for name, n in r_instances.types.items()},
+                                  {(name, None, None, None): n for name, n in instances.types.items()})
+        return (rounded(sum(unused.values())), rounded(sum(uncovered.values())))
+    for cell in cells:
+        unused, uncovered = match(placements(r_instances, cell), placements(instances, cell))
+        unused_total += sum(unused.values())
+        uncovered_total += sum(uncovered.values())
+    return (rounded(unused_total), rounded(uncovered_total))
+
+
+def breakdown_gaps(breakdown):
+    '''
+    Returns the match_gaps of a breakdown, a dict of key to (instances,
+    r_instances), added up over its keys.
+    '''
+    unused = uncovered = 0
+    for instances, r_instances in breakdown.values():
+        key_unused, key_uncovered = match_gaps(instances, r_instances)
+        unused += key_unused
+        uncovered += key_uncovered
+    return (rounded(unused), rounded(uncovered))
+
+
+def match_totals(instances, r_instances):
+    '''
+    Returns the (reserved, in use, delta) totals of match_rows.  delta nets
+    the unused reservations of some types against the uncovered instances
+    of others, so match_gaps is reported alongside it.
+    '''
+    reserved = in_use = delta = 0
+    for key, r, u, d in match_rows(instances, r_instances):
+        reserved += r
+        in_use += u
+        delta += d
+    return (reserved, in_use, rounded(delta))
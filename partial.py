@@ -0,0 +1,120 @@
+'''
+Partial results, for spreading collection across hosts.  Each worker runs
+`map` over its --shard of the accounts and regions and writes what it
+collected as a partial file, and `reduce` merges any number of them into the
+report, as if one process had collected everything.
+
+A partial file is JSON, gzip compressed when its name ends in .gz, holding
+the horizons and groupings it was collected with, and the state of the in
+use and reserved collections of each service, cell by cell.  Merging adds
+the cells, so partials can be reduced in any order and in any grouping.
+'''
+from contextlib import contextmanager
+import argparse
+import gc
+import gzip
+import json
+from formatter.sinks import open_sink
+
+
+# Changed with the layout of the states, so older partials are refused
+FORMAT = 1
+
+
+@contextmanager
+def paused_gc():
+    '''
+    Pauses the cyclic garbage collector.  Loading and merging partials makes
+    millions of small containers and no cycles, and would otherwise trigger
+    collection over and over, which takes longer than the work itself.
+    '''
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def parse_shard(value):
+    '''
+    Turns a --shard value of INDEX/COUNT, such as 0/8, into (index, count).
+    '''
+    index, _, count = value.partition('/')
+    try:
+        index = int(index)
+        count = int(count)
+    except ValueError:
+        raise argparse.ArgumentTypeError('bad shard {!r}. Use INDEX/COUNT, such as 0/8'.format(value))
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError('bad shard {!r}. INDEX must be from 0 to COUNT - 1'.format(value))
+    return (index, count)
+
+
+def shard_targets(targets, shard):
+    '''
+    Returns every COUNT-th target, starting from INDEX, so workers given the
+    same accounts and regions and each their own index collect every target
+    exactly once between them.
+    '''
+    if shard is None:
+        return targets
+    index, count = shard
+    return targets[index::count]
+
+
+def write_partial(path, horizons, group_by, tables):
+    '''
+    Writes a partial file.  tables is a list of (service, in use state,
+    reserved state).
+    '''
+    data = {
+        'format': FORMAT,
+        'horizons': list(horizons),
+        'group_by': [list(grouping) for grouping in group_by],
+        'tables': [{'service': service, 'in_use': in_use, 'reserved': reserved} for service, in_use, reserved in tables]
+    }
+    sink = open_sink(path)
+    try:
+        sink.write(json.dumps(data, sort_keys=True, separators=(',', ':')))
+    except BaseException:
+        sink.abort()
+        raise
+    sink.close()
+
+
+def read_partial(path):
+    opener = gzip.open if path.endswith('.gz') else open
+    with opener(path, 'rb') as f, paused_gc():
+        data = json.loads(f.read())
+    if data.get('format') != FORMAT:
+        raise ValueError('{}: partial format {!r}, expected {}'.format(path, data.get('format'), FORMAT))
+    return data
+
+
+def read_partials(paths):
+    '''
+    Reads partial files, and returns (horizons, group_by, tables), where
+    tables maps each service to (in use states, reserved states).  Raises
+    ValueError if the files were collected with different horizons or
+    groupings, since their counts could not be added.
+    '''
+    horizons = None
+    group_by = None
+    tables = {}
+    for path in paths:
+        data = read_partial(path)
+        file_horizons = tuple(data['horizons'])
+        file_group_by = [tuple(grouping) for grouping in data['group_by']]
+        if horizons is None:
+            horizons = file_horizons
+            group_by = file_group_by
+        elif file_horizons != horizons or file_group_by != group_by:
+            raise ValueError('{}: collected with horizons {} and groupings {}, but {} has {} and {}'.format(
+                path, file_horizons, file_group_by, paths[0], horizons, group_by))
+        for table in data['tables']:
+            in_use, reserved = tables.setdefault(table['service'], ([], []))
+            in_use.append(table['in_use'])
+            reserved.append(table['reserved'])
+    return (horizons, group_by, tables)
@@ -0,0 +1,239 @@
+'''
+A rate limiter shared by every client, with one token bucket per API call per
+account and region, since that is how AWS meters requests.  Each bucket
+starts at a rate the service is known to sustain, creeps up by about one
+request a second every second while calls succeed, and drops by BACKOFF
+whenever a call is throttled, so a run settles just under the highest rate AWS
+allows rather than bursting into throttling and botocore's backoff.
+
+Clients are attached with attach(), which hooks botocore's before-send event,
+sent before every attempt, and needs-retry event, sent after it, or with
+attach_async() for aiobotocore clients, which wait for a token without
+blocking the event loop.  fastparse, which sends its own requests, uses the
+buckets directly.
+'''
+import sys
+import threading
+import time
+
+
+# Error codes that mean the request was throttled
+THROTTLE_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'RequestThrottled',
+    'SlowDown',
+    'EC2ThrottledException',
+    'PriorRequestNotComplete'
+])
+
+# service: (starting requests per second, most requests per second, burst).
+# EC2 describe calls refill at 20 a second into a bucket of 100.
+RATES = {
+    'ec2': (20, 50, 100)
+}
+DEFAULT_RATE = (10, 50, 20)
+MIN_RATE = 0.5
+
+# Attempts per call, by botocore and by fastparse, before a throttle is an
+# error
+MAX_ATTEMPTS = 8
+
+# A throttled bucket's rate is multiplied by this
+BACKOFF = 0.7
+# A bucket's rate rises by this many requests a second for every second of
+# successful calls
+INCREASE = 1.0
+
+
+class TokenBucket():
+    '''
+    Hands out one token per request at rate tokens a second, after an
+    initial burst.  acquire() reserves a token and sleeps until it is due,
+    so waiting threads are served in order without holding the lock.
+    acquire_async() does the same in a coroutine.
+    '''
+
+    def __init__(self, rate, max_rate, burst):
+        self.rate = float(rate)
+        self.max_rate = float(max_rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.throttles = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def _reserve(self):
+        # Returns how long to wait for the reserved token
+        with self.lock:
+            self._refill(time.monotonic())
+            self.tokens -= 1
+            self.calls += 1
+            return -self.tokens / self.rate if self.tokens < 0 else 0
+
+    def acquire(self):
+        wait = self._reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        # asyncio is only loaded by the async API, to keep startup quick
+        import asyncio
+        wait = self._reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def succeeded(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + INCREASE / self.rate)
+
+    def throttled(self):
+        with self.lock:
+            self.throttles += 1
+            self._refill(time.monotonic())
+            self.rate = max(MIN_RATE, self.rate * BACKOFF)
+            # No burst until the rate has recovered
+            self.tokens = min(self.tokens, 0.0)
+
+
+class NullBucket():
+    calls = 0
+    throttles = 0
+
+    def acquire(self):
+        pass
+
+    async def acquire_async(self):
+        pass
+
+    def succeeded(self):
+        pass
+
+    def throttled(self):
+        pass
+
+
+NULL_BUCKET = NullBucket()
+
+
+def throttle_code(parsed):
+    '''
+    Returns the error code of a parsed botocore response if it is a
+    throttle, or None.
+    '''
+    if not parsed:
+        return None
+    code = parsed.get('Error', {}).get('Code')
+    return code if code in THROTTLE_CODES else None
+
+
+class RateLimiter():
+    '''
+    The token buckets, by (account, region, service, operation).  Disabled,
+    every bucket is a NullBucket.
+    '''
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, account, region, service, operation):
+        if not self.enabled:
+            return NULL_BUCKET
+        key = (account or 'default', region or 'default', service, operation)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                bucket = self.buckets.get(key)
+                if bucket is None:
+                    bucket = self.buckets[key] = TokenBucket(*RATES.get(service, DEFAULT_RATE))
+        return bucket
+
+    def attach(self, client, account=None):
+        '''
+        Limits every request a botocore client sends, and adapts to the
+        throttling it sees.
+        '''
+        bucket = self._register(client, account)
+
+        def before_send(event_name, **kwargs):
+            bucket(event_name).acquire()
+
+        client.meta.events.register('before-send', before_send)
+
+    def attach_async(self, client, account=None):
+        '''
+        attach() for an aiobotocore client, whose event handlers may be
+        coroutines.
+        '''
+        bucket = self._register(client, account)
+
+        async def before_send(event_name, **kwargs):
+            await bucket(event_name).acquire_async()
+
+        client.meta.events.register('before-send', before_send)
+
+    def _register(self, client, account):
+        '''
+        Registers the needs-retry handler of a client, and returns a function
+        from event names to the bucket of their call.
+        '''
+        region = client.meta.region_name
+
+        def bucket(event_name):
+            # Event names are <event>.<service>.<operation>
+            parts = event_name.split('.')
+            return self.bucket(account, region, parts[1], parts[2] if len(parts) > 2 else None)
+
+        def needs_retry(event_name, response=None, **kwargs):
+            if response is None:
+                return None
+            http_response, parsed = response
+            if throttle_code(parsed) is not None:
+                bucket(event_name).throttled()
+            elif http_response.status_code < 400:
+                bucket(event_name).succeeded()
+            # Leaves the retry decision to botocore
+            return None
+
+        client.meta.events.register('needs-retry', needs_retry)
+        return bucket
+
+    @property
+    def throttles(self):
+        return sum(bucket.throttles for bucket in self.buckets.values())
+
+    @property
+    def calls(self):
+        return sum(bucket.calls for bucket in self.buckets.values())
+
+    def report(self, file=sys.stderr):
+        '''
+        Prints the calls, throttled calls and final rate of each service and
+        operation, over every account and region.
+        '''
+        totals = {}
+        for (account, region, service, operation), bucket in self.buckets.items():
+            total = totals.setdefault((service, operation), [0, 0, 0.0])
+            total[0] += bucket.calls
+            total[1] += bucket.throttles
+            total[2] = max(total[2], bucket.rate)
+        for (service, operation), (calls, throttles, rate) in sorted(totals.items()):
+            print('{:<40}{:>8} calls{:>8} throttled{:>8.1f}/s'.format('{} {}'.format(service, operation), calls, throttles, rate), file=file)
+
+
+_limiter = RateLimiter()
+
+
+def rate_limiter():
+    return _limiter
@@ -0,0 +1,139 @@
+'''
+Rollups of instances by configurable dimensions, such as a team tag and
+availability zone.  The in use collectors read the values of every requested
+dimension from each item as they count it, and add it to every rollup at
+once, keyed by (group, placement), so no rollup needs another pass over the
+inventory.  Coverage is then shared out to the groups from the matching of
+each (account, region) cell: a group is covered in proportion to its share of
+each placement.
+'''
+import argparse
+from collections import Counter
+from matching import match, placements, rounded
+
+
+# Dimensions read from every item, as well as tag:KEY for any tag
+DIMENSIONS = ('type', 'az', 'platform', 'tenancy', 'engine')
+
+# Shown for items without a value, such as an untagged instance
+MISSING = '(none)'
+
+
+def parse_group_by(value):
+    '''
+    Turns a --group-by value, a comma separated list of dimensions, into a
+    tuple of dimensions.
+    '''
+    dimensions = tuple(dimension.strip() for dimension in value.split(',') if dimension.strip())
+    for dimension in dimensions:
+        if dimension not in DIMENSIONS and not (dimension.startswith('tag:') and len(dimension) > 4):
+            raise argparse.ArgumentTypeError('unknown dimension {!r}. Use tag:KEY or one of {}'.format(dimension, ', '.join(DIMENSIONS)))
+    if not dimensions:
+        raise argparse.ArgumentTypeError('no dimensions given')
+    return dimensions
+
+
+def uses_tags(group_by):
+    return any(dimension.startswith('tag:') for dimensions in group_by for dimension in dimensions)
+
+
+def dimension_values(dimensions, fields, tags=None):
+    '''
+    Returns the values of dimensions for one item, as a tuple.  fields maps
+    the dimensions in DIMENSIONS to values, and tags is the item's tag list,
+    in the [{'Key': ..., 'Value': ...}] form of both EC2 and RDS.
+    '''
+    values = []
+    for dimension in dimensions:
+        if dimension.startswith('tag:'):
+            key = dimension[4:]
+            values.append(next((tag['Value'] for tag in tags or () if tag['Key'] == key), None))
+        else:
+            values.append(fields.get(dimension))
+    return tuple(values)
+
+
+class Rollups():
+    '''
+    Counts by (group, placement) for each of a list of groupings, where a
+    grouping is a tuple of dimensions.  Values are read once per item for
+    the union of the dimensions, in dimensions order, and each grouping
+    picks its own out of them.
+    '''
+    __slots__ = ('group_by', 'dimensions', 'indexes', 'counts')
+
+    def __init__(self, group_by=()):
+        self.group_by = tuple(group_by)
+        dimensions = []
+        for grouping in self.group_by:
+            dimensions.extend(dimension for dimension in grouping if dimension not in dimensions)
+        self.dimensions = tuple(dimensions)
+        self.indexes = [tuple(dimensions.index(dimension) for dimension in grouping) for grouping in self.group_by]
+        self.counts = [Counter() for grouping in self.group_by]
+
+    def add(self, values, placement, n=1):
+        for index, counts in zip(self.indexes, self.counts):
+            counts[(tuple(values[i] for i in index), placement)] += n
+
+    def merge(self, other):
+        '''
+        Returns new Rollups with the counts of both.
+        '''
+        merged = Rollups(self.group_by)
+        merged.counts = [mine + theirs for mine, theirs in zip(self.counts, other.counts)]
+        return merged
+
+    def state(self):
+        '''
+        Returns the groupings and counts as plain JSON data.  Placements are
+        listed once, and each count is [group, placement index, n].
+        '''
+        index = {}
+        counts = [[[list(group), index.setdefault(placement, len(index)), n] for (group, placement), n in grouped.items()]
+                  for grouped in self.counts]
+        return {
+            'group_by': [list(grouping) for grouping in self.group_by],
+            'placements': [list(placement) for placement in index],
+            'counts': counts
+        }
+
+    @classmethod
+    def from_state(cls, state):
+        rollups = cls(tuple(grouping) for grouping in state['group_by'])
+        placements = [tuple(placement) for placement in state['placements']]
+        rollups.counts = [Counter({(tuple(group), placements[index]): n for group, index, n in grouped}) for grouped in state['counts']]
+        return rollups
+
+    def __bool__(self):
+        return bool(self.group_by)
+
+
+def _order(group):
+    return tuple('' if value is None else str(value) for value in group)
+
+
+def group_label(group):
+    return ' / '.join(MISSING if value is None else str(value) for value in group)
+
+
+def rollup_rows(instances, r_instances):
+    '''
+    Returns a list of (grouping, rows) for the rollups of instances, where
+    rows is a list of (group label, covered, in use, covered - in use) in
+    group order.  Each cell is matched once, for all of the groupings.
+    '''
+    group_by = next((rollups.group_by for rollups in instances.rollup_shards.values()), ())
+    rows = [{} for grouping in group_by]
+    for cell, rollups in instances.rollup_shards.items():
+        in_use = placements(instances, cell)
+        unused, uncovered = match(placements(r_instances, cell), in_use)
+        for grouped, counts in zip(rows, rollups.counts):
+            for (group, placement), n in counts.items():
+                row = grouped.setdefault(group, [0, 0])
+                row[0] += n * (1 - uncovered[placement] / in_use[placement])
+                row[1] += n
+    return [
+        (grouping, [(group_label(group), rounded(covered), total, rounded(covered - total))
+                    for group, (covered, total) in sorted(grouped.items(), key=lambda item: _order(item[0]))])
+        for grouping, grouped in zip(group_by, rows)
+    ]
@@ -0,0 +1,76 @@
+from concurrent.futures import ThreadPoolExecutor
+import sys
+import time
+
+
+class CollectionScheduler():
+    '''
+    Runs collection workloads concurrently, and hands back each table as soon
+    as both of its workloads have finished.  Tables are always handed back in
+    the order they were added, so the output does not depend on which call
+    returns first.
+    '''
+
+    def __init__(self, max_workers=4):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.tables = []
+        self.timings = {}
+        self.waited = 0.0
+        self.started = time.perf_counter()
+        self.finished = None
+
+    def _timed(self, name, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def submit(self, name, fn, *args, **kwargs):
+        '''
+        Starts fn(*args, **kwargs) in the background, and records how long it
+        takes under name.
+        '''
+        self.timings[name] = None
+        return self.executor.submit(self._timed, name, fn, args, kwargs)
+
+    def add_table(self, title, in_use, reserved):
+        '''
+        Adds a table whose in use and reserved collections are produced by the
+        futures returned from submit.
+        '''
+        self.tables.append((title, in_use, reserved))
+
+    def results(self):
+        '''
+        Yields (title, in use result, reserved result) for each table, in the
+        order the tables were added.
+        '''
+        try:
+            for title, in_use, reserved in self.tables:
+                start = time.perf_counter()
+                result = (title, in_use.result(), reserved.result())
+                self.waited += time.perf_counter() - start
+                yield result
+        finally:
+            self.finished = time.perf_counter()
+            self.executor.shutdown(wait=False)
+
+    def report(self, file=sys.stderr):
+        '''
+        Prints how long each call took against the total run time.
+        '''
+        end = self.finished if self.finished is not None else time.perf_counter()
+        total = end - self.started
+        busy = 0.0
+        for name, elapsed in self.timings.items():
+            if elapsed is None:
+                print('{:<40}{:>10}'.format(name, 'running'), file=file)
+                continue
+            busy += elapsed
+            print('{:<40}{:>9.3f}s'.format(name, elapsed), file=file)
+        print('{:<40}{:>9.3f}s'.format('Sum of calls', busy), file=file)
+        print('{:<40}{:>9.3f}s'.format('Waiting for results', self.waited), file=file)
+        print('{:<40}{:>9.3f}s'.format('Total', total), file=file)
+        if total > 0:
+            print('{:<40}{:>9.2f}x'.format('Speedup', busy / total), file=file)
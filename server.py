@@ -0,0 +1,207 @@
+'''
+Serves the report over HTTP from an in-memory snapshot, which is collected
+again in the background every interval seconds.  Each rendering of a snapshot
+is made once and cached, with an ETag, so requests cost no AWS calls and, when
+the client already has the current version, no body either.
+'''
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import gzip
+import hashlib
+import sys
+import threading
+import time
+import traceback
+
+
+PATHS = {
+    '/': 'html',
+    '/index.html': 'html',
+    '/compact.html': 'html-compact',
+    '/report.jsonl': 'jsonl',
+    '/report.csv': 'csv',
+    '/report.arrow': 'arrow',
+    '/metrics': 'metrics'
+}
+
+CONTENT_TYPES = {
+    'html': 'text/html; charset=utf-8',
+    'html-compact': 'text/html; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+    'arrow': 'application/vnd.apache.arrow.file',
+    'metrics': 'text/plain; version=0.0.4; charset=utf-8'
+}
+
+
+class Rendering():
+    '''
+    One rendering of a snapshot, with its ETag.  The gzipped body is made the
+    first time a client asks for it, and has an ETag of its own.
+    '''
+
+    def __init__(self, protocol, body):
+        self.protocol = protocol
+        self.body = body
+        digest = hashlib.sha1(body).hexdigest()
+        self.etag = '"{}"'.format(digest)
+        self.gzip_etag = '"{}-gzip"'.format(digest)
+        self.gzipped = None
+
+    def gzip(self):
+        if self.gzipped is None:
+            self.gzipped = gzip.compress(self.body)
+        return self.gzipped
+
+
+class Snapshot():
+    def __init__(self, version, reports, elapsed):
+        self.version = version
+        self.reports = reports
+        self.elapsed = elapsed
+        self.collected = datetime.now(timezone.utc)
+        self.renderings = {}
+
+
+class ReportServer():
+    '''
+    Holds the latest snapshot of the table reports.  collect() returns a new
+    list of reports, and render(protocol, reports) returns their bytes.
+    '''
+
+    def __init__(self, collect, render, interval=300):
+        self.collect = collect
+        self.render = render
+        self.interval = interval
+        self.snapshot = None
+        self.version = 0
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+
+    def refresh(self):
+        '''
+        Collects a new snapshot and makes it current.  The previous snapshot is
+        served until this one is complete.
+        '''
+        start = time.perf_counter()
+        reports = self.collect()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.version += 1
+            self.snapshot = Snapshot(self.version, reports, elapsed)
+        return self.snapshot
+
+    def _refresh_loop(self):
+        while not self.stopped.is_set():
+            start = time.monotonic()
+            try:
+                snapshot = self.refresh()
+                print('Collected snapshot {} in {:.1f}s'.format(snapshot.version, snapshot.elapsed), file=sys.stderr)
+            except Exception:
+                # Keep serving the last good snapshot
+                traceback.print_exc()
+            self.stopped.wait(max(0, self.interval - (time.monotonic() - start)))
+
+    def start(self):
+        thread = threading.Thread(target=self._refresh_loop, name='refresh', daemon=True)
+        thread.start()
+        return thread
+
+    def stop(self):
+        self.stopped.set()
+
+    def rendering(self, protocol):
+        '''
+        Returns (snapshot, Rendering) for the current snapshot with protocol,
+        or None if nothing has been collected yet.
+        '''
+        snapshot = self.snapshot
+        if snapshot is None:
+            return None
+        rendering = snapshot.renderings.get(protocol)
+        if rendering is None:
+            with self.lock:
+                rendering = snapshot.renderings.get(protocol)
+                if rendering is None:
+                    rendering = Rendering(protocol, self.render(protocol, snapshot.reports))
+                    snapshot.renderings[protocol] = rendering
+        return (snapshot, rendering)
+
+    def handler(self):
+        server = self
+
+        class Handler(ReportHandler):
+            report_server = server
+        return Handler
+
+    def serve(self, bind='127.0.0.1', port=8000):
+        '''
+        Starts refreshing in the background, and serves until interrupted.
+        '''
+        self.start()
+        httpd = ThreadingHTTPServer((bind, port), self.handler())
+        print('Serving on http://{}:{}/'.format(bind, port), file=sys.stderr)
+        try:
+            httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+            httpd.server_close()
+
+
+class ReportHandler(BaseHTTPRequestHandler):
+    report_server = None
+
+    def do_HEAD(self):
+        self.respond(head=True)
+
+    def do_GET(self):
+        self.respond()
+
+    def respond(self, head=False):
+        protocol = PATHS.get(self.path.split('?', 1)[0])
+        if protocol is None:
+            self.send_error(404)
+            return
+        result = self.report_server.rendering(protocol)
+        if result is None:
+            self.send_response(503)
+            self.send_header('Retry-After', '5')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        snapshot, rendering = result
+        gzipped = 'gzip' in self.headers.get('Accept-Encoding', '')
+        etag = rendering.gzip_etag if gzipped else rendering.etag
+
+        if etag in _etags(self.headers.get('If-None-Match', '')):
+            self.send_response(304)
+            self._cache_headers(snapshot, etag)
+            self.end_headers()
+            return
+
+        body = rendering.gzip() if gzipped else rendering.body
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[protocol])
+        self.send_header('Content-Length', str(len(body)))
+        if gzipped:
+            self.send_header('Content-Encoding', 'gzip')
+        self._cache_headers(snapshot, etag)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _cache_headers(self, snapshot, etag):
+        self.send_header('ETag', etag)
+        self.send_header('Last-Modified', format_datetime(snapshot.collected, usegmt=True))
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+
+    def log_message(self, format, *args):
+        pass
+
+
+def _etags(value):
+    return [tag.strip() for tag in value.split(',')]
@@ -0,0 +1,50 @@
+import pytest
+from accounts import Account, SessionPool
+
+
+pytest.importorskip('boto3')
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    path = tmp_path / 'config'
+    path.write_text('[default]\nregion = us-east-1\n\n[profile prod]\nregion = eu-west-1\n')
+    monkeypatch.setenv('AWS_CONFIG_FILE', str(path))
+    for name in ('AWS_PROFILE', 'AWS_DEFAULT_PROFILE', 'AWS_REGION', 'AWS_DEFAULT_REGION'):
+        monkeypatch.delenv(name, raising=False)
+
+
+def test_scope_of_the_callers_account_follows_the_profile(config, monkeypatch):
+    assert SessionPool().scope() == ('default', 'us-east-1')
+    monkeypatch.setenv('AWS_PROFILE', 'prod')
+    assert SessionPool().scope() == ('prod', 'eu-west-1')
+    monkeypatch.setenv('AWS_DEFAULT_REGION', 'ap-south-1')
+    assert SessionPool().scope() == ('prod', 'ap-south-1')
+
+
+def test_scope_of_a_named_target(config):
+    pool = SessionPool()
+    assert pool.scope('us-west-2', Account('111111111111')) == ('111111111111', 'us-west-2')
+    assert pool.lazy_client('ec2', 'us-west-2').scope == ('default', 'us-west-2')
+
+
+def test_role_sessions_resolve_credentials_through_the_pool(config, monkeypatch):
+    from datetime import datetime, timedelta, timezone
+    pool = SessionPool()
+    expiries = [datetime.now(timezone.utc) + timedelta(minutes=5), datetime.now(timezone.utc) + timedelta(hours=1)]
+    calls = []
+
+    def assume(role_arn):
+        calls.append(role_arn)
+        return {'access_key': 'AKID%d' % len(calls), 'secret_key': 'secret', 'token': 'token',
+                'expiry_time': expiries[len(calls) - 1].isoformat()}
+
+    monkeypatch.setattr(pool, 'assume', assume)
+    session = pool.session(Account('111111111111', 'arn:aws:iam::111111111111:role/reader'))
+    credentials = session.get_credentials()
+    assert credentials.method == 'sts-assume-role'
+    assert calls == ['arn:aws:iam::111111111111:role/reader']
+    # Within botocore's mandatory refresh window, so it assumes the role again
+    assert credentials.get_frozen_credentials().access_key == 'AKID2'
+    assert credentials.get_frozen_credentials().access_key == 'AKID2'
+    assert len(calls) == 2
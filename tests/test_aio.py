@@ -0,0 +1,109 @@
+import asyncio
+import importlib
+import sys
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+import instance_count
+from accounts import Account, session_pool
+from bench.suite import SyntheticClient, instance_types
+from cache import ResponseCache
+
+
+def test_missing_aiobotocore_says_how_to_install(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'aiobotocore', None)
+    monkeypatch.delitem(sys.modules, 'aio', raising=False)
+    with pytest.raises(ImportError, match='pip install aiobotocore'):
+        importlib.import_module('aio')
+
+
+@pytest.fixture
+def aio():
+    pytest.importorskip('aiobotocore')
+    return importlib.import_module('aio')
+
+
+class AsyncPages():
+    def __init__(self, pages):
+        self.pages = list(pages)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self.pages:
+            raise StopAsyncIteration
+        return self.pages.pop(0)
+
+
+class AsyncClient():
+    '''
+    An aiobotocore client answering from the pages of a SyntheticClient.
+    '''
+
+    def __init__(self, synthetic):
+        self.meta = synthetic.meta
+        self.synthetic = synthetic
+        self.calls = 0
+
+    def can_paginate(self, operation):
+        return self.synthetic.can_paginate(operation)
+
+    def get_paginator(self, operation):
+        def paginate(PaginationConfig=None, **kwargs):
+            self.calls += 1
+            return AsyncPages(self.synthetic.instance_pages)
+        return SimpleNamespace(paginate=paginate)
+
+    async def describe_reserved_instances(self, **kwargs):
+        self.calls += 1
+        return self.synthetic.describe_reserved_instances(**kwargs)
+
+
+def synthetic(region='us-east-1'):
+    return SyntheticClient(region, 2500, 40, instance_types(12))
+
+
+def test_collect_matches_the_threaded_collections(aio):
+    client = synthetic()
+    instances, r_instances = asyncio.run(aio.collect_ec2_info(AsyncClient(client)))
+    expected = instance_count.Instances(client).collect()
+    expected_reserved = instance_count.ReservedInstances(client).collect()
+    assert dict(instances.types.items()) == dict(expected.types.items())
+    assert dict(r_instances.types.items()) == dict(expected_reserved.types.items())
+    assert (instances.pages, instances.items) == (expected.pages, expected.items)
+    assert r_instances.expiries.totals.counts == expected_reserved.expiries.totals.counts
+
+
+def test_collect_reads_the_cache(aio, tmp_path):
+    cache = ResponseCache(str(tmp_path), 3600)
+    client = AsyncClient(synthetic())
+    first = asyncio.run(aio.collect(instance_count.Instances(client, cache=cache)))
+    calls = client.calls
+    second = asyncio.run(aio.collect(instance_count.Instances(client, cache=cache)))
+    assert client.calls == calls
+    assert dict(second.types.items()) == dict(first.types.items())
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_collect_service_keys_results_by_scope(aio):
+    clients = {('default', region): aio.ScopedClient(AsyncClient(synthetic(region)), 'default')
+               for region in ('us-east-1', 'eu-west-1')}
+    title, (instances, in_use), (r_instances, reserved) = asyncio.run(aio.collect_service('ec2', clients))
+    assert title == 'EC2 Instances'
+    assert list(in_use) == list(reserved) == list(clients)
+    assert instances.total == sum(collection.total for collection in in_use.values())
+    assert set(instances.shards.cells) == set(clients)
+
+
+def test_role_sessions_resolve_credentials_through_the_pool(aio, monkeypatch):
+    expiry = (datetime.now(timezone.utc) + timedelta(hours=1)).isoformat()
+    monkeypatch.setattr(session_pool(), 'assume', lambda role_arn: {
+        'access_key': 'AKIDROLE', 'secret_key': 'secret', 'token': 'token', 'expiry_time': expiry})
+
+    async def credentials():
+        session = await aio.account_session(Account('111111111111', 'arn:aws:iam::111111111111:role/reader'))
+        resolved = await session.get_credentials()
+        return resolved.method, (await resolved.get_frozen_credentials()).access_key
+
+    assert asyncio.run(credentials()) == ('sts-assume-role', 'AKIDROLE')
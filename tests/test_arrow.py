@@ -0,0 +1,39 @@
+import pytest
+from aggregate import Counts
+import instance_count
+from formatter.formatter import FormatConfig, row_columns
+from formatter.sinks import MemorySink
+
+
+pa = pytest.importorskip('pyarrow')
+
+
+def read(data):
+    return pa.ipc.open_file(pa.BufferReader(data)).read_all()
+
+
+def test_no_tables_is_an_empty_file_with_the_schema():
+    data = instance_count.render_report('arrow', [])
+    table = read(data)
+    assert table.num_rows == 0
+    assert table.schema.names == row_columns(instance_count.DEFAULT_HORIZONS)
+
+
+def test_rows_follow_the_tables_horizons():
+    from formatter.arrow import ArrowFormatter
+    sink = MemorySink()
+    formatter = ArrowFormatter(FormatConfig(sink), horizons=instance_count.DEFAULT_HORIZONS)
+    cell = ('111111111111', 'us-east-1')
+    in_use = Counts()
+    in_use.add('t3.micro', 2)
+    reserved = Counts()
+    reserved.add('t3.micro', 1)
+    instances = instance_count.cell_collection(cell, in_use)
+    reserved = instance_count.cell_collection(cell, reserved, expiries=instance_count.ExpiryPeriods((14,)))
+    formatter.format_table('EC2 Instances', instances, reserved)
+    formatter.format()
+    formatter.cfg.close()
+    table = read(sink.getvalue())
+    assert table.schema.names == row_columns((14,))
+    assert table.to_pylist() == [{'table': 'EC2 Instances', 'account': '111111111111', 'region': 'us-east-1', 'type': 't3.micro',
+                                  'reserved': 1, 'in_use': 2, 'delta': -1.0, 'expiring_14d': 0, 'expiring_later': 0}]
@@ -0,0 +1,95 @@
+from collections import Counter
+import os
+import time
+import pytest
+from cache import HEADER, MAGIC, ResponseCache, cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path), max_age=300)
+
+
+def entry(cache, key):
+    return os.path.join(cache.path, key + '.entry')
+
+
+def test_cache_key_depends_on_every_part():
+    key = cache_key(('111111111111', 'us-east-1'), 'describe_instances', [], 3)
+    assert key == cache_key(('111111111111', 'us-east-1'), 'describe_instances', [], 3)
+    assert key != cache_key(('111111111111', 'eu-west-1'), 'describe_instances', [], 3)
+    assert key != cache_key(('222222222222', 'us-east-1'), 'describe_instances', [], 3)
+
+
+def test_round_trip(cache):
+    counts = Counter({('m5.large', 'us-east-1a'): 3, ('c5.xlarge', 'us-east-1b'): 1})
+    cache.put('k', counts)
+    assert cache.get('k') == counts
+    assert cache.get('other') is None
+
+
+def test_fetch_counts_records_once(cache):
+    records = [('m5.large',), ('m5.large',), ('c5.large',)]
+    assert cache.fetch('k', iter(records)) == Counter(records)
+    assert cache.fetch('k', iter(())) == Counter(records)
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_refresh_ignores_entries(cache, tmp_path):
+    cache.put('k', Counter({'a': 1}))
+    refresh = ResponseCache(str(tmp_path), refresh=True)
+    assert refresh.get('k') is None
+    assert refresh.fetch('k', iter(['b'])) == Counter({'b': 1})
+    assert cache.get('k') == Counter({'b': 1})
+
+
+def test_entries_expire_after_max_age(cache, monkeypatch):
+    cache.put('k', Counter({'a': 1}))
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 301)
+    assert cache.get('k') is None
+    assert os.path.exists(entry(cache, 'k'))
+
+
+@pytest.mark.parametrize('damage', [
+    lambda data: data[:len(data) // 2],
+    lambda data: data[:HEADER.size - 1],
+    lambda data: data[:HEADER.size] + b'not zlib',
+    lambda data: b'XXXX' + data[4:],
+])
+def test_damaged_entries_are_misses_and_removed(cache, damage):
+    cache.put('k', Counter({('m5.large', 'us-east-1a'): 3}))
+    path = entry(cache, 'k')
+    with open(path, 'rb') as f:
+        data = f.read()
+    with open(path, 'wb') as f:
+        f.write(damage(data))
+    assert cache.get('k') is None
+    assert not os.path.exists(path)
+    assert cache.fetch('k', iter(['a'])) == Counter({'a': 1})
+
+
+def test_damaged_pickle_is_a_miss(cache):
+    import zlib
+    with open(entry(cache, 'k'), 'wb') as f:
+        f.write(HEADER.pack(MAGIC, time.time()) + zlib.compress(b'\x80\x05not a pickle'))
+    assert cache.get('k') is None
+
+
+def test_evict_removes_old_entries_and_their_locks(cache, tmp_path):
+    cache.fetch('old', iter(['a']))
+    cache.fetch('new', iter(['b']))
+    orphan = os.path.join(cache.path, 'orphan.lock')
+    open(orphan, 'w').close()
+    old = time.time() - cache.ttl - 60
+    for path in (entry(cache, 'old'), orphan):
+        os.utime(path, (old, old))
+    cache.evict()
+    assert sorted(os.listdir(cache.path)) == ['new.entry', 'new.lock']
+
+
+def test_evict_trims_to_max_bytes(tmp_path):
+    cache = ResponseCache(str(tmp_path), max_bytes=1)
+    cache.fetch('a', iter(['x']))
+    cache.fetch('b', iter(['y']))
+    assert [name for name in os.listdir(str(tmp_path)) if name.endswith('.entry')] == []
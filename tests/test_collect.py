@@ -0,0 +1,67 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+import instance_count
+
+
+END = datetime.now(timezone.utc) + timedelta(days=100)
+
+
+class Client():
+    def __init__(self, region, account):
+        self.meta = SimpleNamespace(region_name=region)
+        self.scope = (account.account_id if account is not None else 'default', region)
+        self.fail = region == 'me-south-1' or account == 'broken'
+
+    def can_paginate(self, operation):
+        return False
+
+    def describe_reserved_instances(self, **kwargs):
+        if self.fail:
+            raise RuntimeError('AuthFailure')
+        return {'ReservedInstances': [{'InstanceType': 'm5.large', 'InstanceCount': 2, 'End': END, 'Scope': 'Region'}]}
+
+
+class Pool():
+    def lazy_client(self, service, region=None, account=None):
+        return Client(region, account)
+
+    def scope(self, region=None, account=None):
+        return ('default', region)
+
+
+@pytest.fixture(autouse=True)
+def pool(monkeypatch):
+    monkeypatch.setattr(instance_count, 'session_pool', Pool)
+
+
+def test_a_failed_target_is_skipped(capsys):
+    targets = [(None, 'us-east-1'), (None, 'me-south-1'), (None, 'eu-west-1')]
+    merged, results = instance_count.collect_collection(instance_count.ReservedInstances, 'ec2', targets)
+    assert list(results) == [('default', 'us-east-1'), ('default', 'eu-west-1')]
+    assert merged.get('m5.large') == 4
+    assert 'account default, region me-south-1: AuthFailure' in capsys.readouterr().err
+
+
+def test_every_target_failing_raises():
+    with pytest.raises(RuntimeError):
+        instance_count.collect_collection(instance_count.ReservedInstances, 'ec2', [(None, 'me-south-1'), (None, 'me-south-1')])
+
+
+def test_breakdown_counts_a_side_skipped_as_empty():
+    merged, reserved = instance_count.collect_collection(
+        instance_count.ReservedInstances, 'ec2', [(None, 'us-east-1'), (None, 'eu-west-1')])
+    in_use = {('default', 'us-east-1'): instance_count.InstancesBase(None)}
+    by_region = instance_count.breakdown(in_use, reserved, 1)
+    assert sorted(by_region) == ['eu-west-1', 'us-east-1']
+    assert by_region['eu-west-1'][0].total == 0
+    assert by_region['eu-west-1'][1].get('m5.large') == 2
+
+
+def test_each_finished_target_is_reported():
+    finished = []
+    targets = [(None, 'us-east-1'), (None, 'me-south-1'), (None, 'eu-west-1')]
+    merged, results = instance_count.collect_collection(
+        instance_count.ReservedInstances, 'ec2', targets, on_target=lambda key, collection: finished.append((key, collection)))
+    assert sorted(key for key, collection in finished) == [('default', 'eu-west-1'), ('default', 'us-east-1')]
+    assert all(results[key] is collection for key, collection in finished)
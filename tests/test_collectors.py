@@ -0,0 +1,172 @@
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+import pytest
+import instance_count
+from collectors import SPECS, CollectorSpec, Extractors, getter
+
+
+START = datetime.now(timezone.utc) - timedelta(days=30)
+YEAR = 365 * 24 * 3600
+
+
+class Client():
+    '''
+    Answers each operation with its next listed page, and records the calls.
+    '''
+
+    def __init__(self, responses, region='us-east-1'):
+        self.meta = SimpleNamespace(region_name=region)
+        self.responses = {operation: list(pages) for operation, pages in responses.items()}
+        self.calls = []
+
+    def can_paginate(self, operation):
+        return False
+
+    def __getattr__(self, operation):
+        if operation not in self.responses:
+            raise AttributeError(operation)
+
+        def call(**kwargs):
+            self.calls.append((operation, kwargs))
+            return self.responses[operation].pop(0)
+        return call
+
+
+def reservation(type_key, count_key, type, count, state='active'):
+    return {type_key: type, count_key: count, 'StartTime': START, 'Duration': YEAR, 'State': state}
+
+
+# service: (in use items, in use counts, reserved items, reserved counts)
+CASES = {
+    'rds': (
+        [{'DBInstanceClass': 'db.r5.large', 'AvailabilityZone': 'us-east-1a', 'Engine': 'postgres'}] * 2,
+        {'db.r5.large': 2},
+        [reservation('DBInstanceClass', 'DBInstanceCount', 'db.r5.large', 3),
+         reservation('DBInstanceClass', 'DBInstanceCount', 'db.r5.large', 5, 'retired')],
+        {'db.r5.large': 3}),
+    'elasticache': (
+        [{'CacheNodeType': 'cache.m5.large', 'NumCacheNodes': 3}],
+        {'cache.m5.large': 3},
+        [reservation('CacheNodeType', 'CacheNodeCount', 'cache.m5.large', 2)],
+        {'cache.m5.large': 2}),
+    'redshift': (
+        [{'NodeType': 'ra3.4xlarge', 'NumberOfNodes': 4}],
+        {'ra3.4xlarge': 4},
+        [reservation('NodeType', 'NodeCount', 'ra3.4xlarge', 2)],
+        {'ra3.4xlarge': 2}),
+    'opensearch': (
+        [{'ClusterConfig': {'InstanceType': 'r6g.large.search', 'InstanceCount': 3}}],
+        {'r6g.large.search': 3},
+        [reservation('InstanceType', 'InstanceCount', 'r6g.large.search', 1)],
+        {'r6g.large.search': 1}),
+    'memorydb': (
+        [{'NodeType': 'db.r6g.large', 'Shards': [{'NumberOfNodes': 2}, {'NumberOfNodes': 3}]}],
+        {'db.r6g.large': 5},
+        [reservation('NodeType', 'NodeCount', 'db.r6g.large', 2)],
+        {'db.r6g.large': 2})
+}
+
+
+def pages(spec, items):
+    '''
+    Returns the responses of a spec's calls, split over two pages, linked by
+    the spec's token where it has one.
+    '''
+    if spec.token is None:
+        return {spec.operation: [{spec.items: items}]}
+    return {spec.operation: [{spec.items: items[:1], spec.token[1]: 'next'}, {spec.items: items[1:]}]}
+
+
+def named_pages(spec, items, count):
+    list_operation, key, path, argument, batch = spec.names
+    return {
+        list_operation: [{key: [{path: 'domain-{}'.format(n)} for n in range(count)]}],
+        spec.operation: [{spec.items: items}] + [{spec.items: []}] * ((count - 1) // batch)
+    }
+
+
+def test_getter_reads_dotted_paths():
+    item = {'ClusterConfig': {'InstanceType': 'r6g.large.search'}}
+    assert getter('ClusterConfig.InstanceType')(item) == 'r6g.large.search'
+    assert getter('ClusterConfig.InstanceCount')(item) is None
+    assert getter('Missing.InstanceType')(item) is None
+    assert getter(len)(item) == 1
+    assert getter(None) is None
+
+
+def test_extractors_compile_a_spec():
+    spec = CollectorSpec('describe', 'Items', 'Type', start='StartTime', duration='Duration', where={'State': ('active',)})
+    extract = Extractors(spec)
+    item = reservation('Type', 'Count', 'x.large', 2)
+    assert extract.type(item) == 'x.large'
+    # No count path counts one per item
+    assert extract.count(item) == 1
+    assert extract.end(item) == START + timedelta(seconds=YEAR)
+    assert extract.keep(item) and not extract.keep(dict(item, State='retired'))
+
+
+@pytest.mark.parametrize('service', sorted(SPECS))
+def test_each_spec_collects_from_its_calls(service):
+    title, name, in_use_spec, reserved_spec = SPECS[service]
+    in_use_cls, reserved_cls = instance_count.SPEC_COLLECTIONS[service]
+    in_use_items, in_use_counts, reserved_items, reserved_counts = CASES[service]
+
+    if in_use_spec.names is not None:
+        client = Client(named_pages(in_use_spec, in_use_items, 7))
+    else:
+        client = Client(pages(in_use_spec, in_use_items))
+    in_use = in_use_cls(client).collect()
+    assert dict(in_use.types.items()) == in_use_counts
+
+    client = Client(pages(reserved_spec, reserved_items))
+    reserved = reserved_cls(client, horizons=(30,)).collect()
+    assert dict(reserved.types.items()) == reserved_counts
+    # Started a month ago for a year, so none expire within the horizon
+    assert reserved.expiries.totals.get('later') == sum(reserved_counts.values())
+    assert all(not pages for pages in client.responses.values())
+
+
+@pytest.mark.parametrize('service', sorted(service for service in SPECS if SPECS[service][3].token is not None))
+def test_calls_without_a_paginator_follow_the_token(service):
+    spec = SPECS[service][3]
+    reserved_items = CASES[service][2] * 2
+    client = Client(pages(spec, reserved_items))
+    collection = instance_count.SPEC_COLLECTIONS[service][1](client).collect()
+    assert collection.pages == 2
+    assert [call[1].get(spec.token[0]) for call in client.calls] == [None, 'next']
+
+
+def test_calls_without_a_token_stop_after_one_page():
+    spec = SPECS['rds'][2]
+    client = Client({spec.operation: [{spec.items: CASES['rds'][0], 'Marker': 'ignored'}]})
+    collection = instance_count.RdsInstances(client).collect()
+    assert collection.pages == 1
+
+
+def test_named_resources_are_described_in_batches():
+    spec = SPECS['opensearch'][2]
+    client = Client(named_pages(spec, CASES['opensearch'][0], 7))
+    instance_count.SPEC_COLLECTIONS['opensearch'][0](client).collect()
+    batches = [kwargs['DomainNames'] for operation, kwargs in client.calls if operation == spec.operation]
+    assert batches == [['domain-{}'.format(n) for n in range(5)], ['domain-5', 'domain-6']]
+
+
+def test_every_service_collects_across_targets(monkeypatch):
+    class Pool():
+        def lazy_client(self, service, region=None, account=None):
+            title, name, in_use, reserved = SPECS[service]
+            return Client(dict(pages(in_use, CASES[service][0]) if in_use.names is None else named_pages(in_use, CASES[service][0], 1),
+                               **pages(reserved, CASES[service][2])), region)
+
+        def scope(self, region=None, account=None):
+            return ('default', region)
+
+    monkeypatch.setattr(instance_count, 'session_pool', Pool)
+    targets = [(None, 'us-east-1'), (None, 'eu-west-1')]
+    for service in SPECS:
+        in_use_cls, reserved_cls = instance_count.SPEC_COLLECTIONS[service]
+        merged, results = instance_count.collect_collection(in_use_cls, service, targets)
+        assert list(results) == [('default', 'us-east-1'), ('default', 'eu-west-1')]
+        assert merged.total == 2 * sum(CASES[service][1].values())
+        merged, results = instance_count.collect_collection(reserved_cls, service, targets)
+        assert merged.total == 2 * sum(CASES[service][3].values())
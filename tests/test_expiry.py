@@ -0,0 +1,57 @@
+from datetime import datetime, timedelta, timezone
+import random
+import pytest
+import instance_count
+from instance_count import DEFAULT_HORIZONS, NUMPY_MIN_RECORDS, Expiry, ExpiryPeriods
+
+
+def periods(horizons, now):
+    expiries = ExpiryPeriods(horizons)
+    expiries.now = now
+    return expiries
+
+
+def test_buckets_hold_what_expires_after_the_previous_horizon():
+    expiries = periods((1, 7, 30), datetime(2024, 1, 1, 12, tzinfo=timezone.utc))
+    for days, count in ((0, 1), (1, 2), (2, 4), (7, 8), (8, 16), (30, 32), (31, 64)):
+        expiries.add('m5.large', count, expiries.now + timedelta(days=days, hours=1))
+    assert expiries.totals.counts == [1 + 2, 4 + 8, 16 + 32, 64]
+    assert expiries.upcoming() == 63
+
+
+def test_named_periods_follow_the_default_horizons():
+    expiry = Expiry(DEFAULT_HORIZONS)
+    expiry.add('week', 3)
+    assert expiry.get(7) == 3 and expiry.get('later') == 0
+
+
+@pytest.mark.parametrize('period', ['day', 'week', 'month'])
+def test_named_periods_are_refused_with_other_horizons(period):
+    expiry = Expiry((14, 90))
+    with pytest.raises(ValueError, match='Use days'):
+        expiry.get(period)
+    assert expiry.get('later') == 0
+
+
+@pytest.mark.parametrize('horizons', [DEFAULT_HORIZONS, (14, 90, 365)])
+def test_numpy_batches_match_adding_one_at_a_time(horizons):
+    pytest.importorskip('numpy')
+    rng = random.Random(7)
+    # Microseconds in now, and ends on whole days from it, test the rounding
+    now = datetime(2024, 1, 1, 12, 0, 0, 700000, tzinfo=timezone.utc)
+    types = ['m5.large', 'r6i.xlarge', 't3.micro', 'c7g.2xlarge']
+    keys, counts, ends = [], [], []
+    for n in range(4 * NUMPY_MIN_RECORDS):
+        keys.append(rng.choice(types))
+        counts.append(rng.randint(1, 8))
+        ends.append(now.replace(microsecond=0) + timedelta(days=rng.randint(-3, 400), seconds=rng.choice([0, 1, 43200, 86399])))
+
+    batched = periods(horizons, now)
+    batched.add_many(keys, counts, ends)
+    single = periods(horizons, now)
+    for key, count, end in zip(keys, counts, ends):
+        single.add(key, count, end)
+
+    assert batched.totals.counts == single.totals.counts
+    assert {key: value.counts for key, value in batched.expiries.items()} == {key: value.counts for key, value in single.expiries.items()}
+    assert batched.timeline == single.timeline
@@ -0,0 +1,92 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs
+import threading
+import pytest
+import fastparse
+
+
+botocore_session = pytest.importorskip('botocore.session')
+
+NAMESPACE = 'http://ec2.amazonaws.com/doc/2016-11-15/'
+
+PAGES = {
+    None: ('<item><instanceType>m5.large</instanceType></item>'
+           '<item><instanceType>c5.large</instanceType><instanceLifecycle>spot</instanceLifecycle></item>', 'page-2'),
+    'page-2': ('<item><instanceType>m5.xlarge</instanceType></item>', None)
+}
+
+
+def describe_instances(token):
+    items, next_token = PAGES[token]
+    return ('<?xml version="1.0" encoding="UTF-8"?>\n<DescribeInstancesResponse xmlns="{}">'
+            '<reservationSet><item><instancesSet>{}</instancesSet></item></reservationSet>{}'
+            '</DescribeInstancesResponse>').format(
+                NAMESPACE, items, '<nextToken>{}</nextToken>'.format(next_token) if next_token else '')
+
+
+THROTTLE = ('<?xml version="1.0" encoding="UTF-8"?>\n<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+            '<Message>Request limit exceeded.</Message></Error></Errors></Response>')
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        params = parse_qs(self.rfile.read(int(self.headers['Content-Length'])).decode())
+        self.server.requests.append(params)
+        if self.server.throttles:
+            self.server.throttles -= 1
+            status, body = 503, THROTTLE
+        else:
+            status, body = 200, describe_instances(params.get('NextToken', [None])[0])
+        body = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/xml;charset=UTF-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    server.requests = []
+    server.throttles = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(server):
+    session = botocore_session.get_session()
+    return session.create_client('ec2', region_name='us-east-1', endpoint_url='http://127.0.0.1:{}'.format(server.server_port),
+                                 aws_access_key_id='AKIDEXAMPLE', aws_secret_access_key='secret')
+
+
+def test_send_streams_the_body(client):
+    response = fastparse._send(client, fastparse.query_params('DescribeInstances', '2016-11-15'))
+    assert response.status_code == 200
+    assert b''.join(response.raw.stream(fastparse.CHUNK_SIZE)).endswith(b'</DescribeInstancesResponse>')
+
+
+def test_query_follows_next_token(client, server):
+    pages = []
+    records = list(fastparse.query(client, 'DescribeInstances', ('instanceType', 'instanceLifecycle'),
+                                   [{'Name': 'instance-state-name', 'Values': ['running']}], 5, lambda: pages.append(1)))
+    assert [record['instanceType'] for record in records] == ['m5.large', 'c5.large', 'm5.xlarge']
+    assert records[1]['instanceLifecycle'] == 'spot'
+    assert len(pages) == 2
+    assert server.requests[0]['Filter.1.Name'] == ['instance-state-name']
+    assert server.requests[0]['MaxResults'] == ['5']
+    assert server.requests[1]['NextToken'] == ['page-2']
+
+
+def test_query_retries_throttles(client, server):
+    server.throttles = 2
+    records = list(fastparse.query(client, 'DescribeInstances', ('instanceType',)))
+    assert len(records) == 3
+    assert len(server.requests) == 4
@@ -0,0 +1,112 @@
+import argparse
+from datetime import datetime, timezone
+import pytest
+import history
+from history import EVERY, SnapshotStore, parse_time
+
+
+DAY = EVERY['day']
+T0 = int(datetime(2024, 3, 1, tzinfo=timezone.utc).timestamp())
+
+
+def row(account, region, service, it, reserved, in_use, expiring=(0, 0, 0, 0)):
+    return ((account, region, service, it), [reserved, in_use, reserved - in_use] + list(expiring))
+
+
+@pytest.fixture
+def store():
+    store = SnapshotStore(':memory:')
+    yield store
+    store.close()
+
+
+@pytest.fixture
+def filled(store):
+    store.add(T0, (1, 7, 30), [
+        row('111', 'us-east-1', 'ec2', 'm5.large', 4, 3),
+        row('111', 'eu-west-1', 'ec2', 't3.micro', 0, 2),
+        row('222', 'us-east-1', 'rds', 'db.r5.large', 2, 2)
+    ])
+    store.add(T0 + DAY, (1, 7, 30), [
+        row('111', 'us-east-1', 'ec2', 'm5.large', 4, 5),
+        row('222', 'us-east-1', 'rds', 'db.r5.large', 2, 2),
+        row('222', 'us-east-1', 'ec2', 'c5.xlarge', 1, 0, (0, 1, 0, 0))
+    ])
+    return store
+
+
+def test_trend_totals_match_adding_up_the_keys(filled):
+    assert filled.trend() == [(T0, 6, 7, -1), (T0 + DAY, 7, 7, 0)]
+    assert filled.trend(service='ec2') == [(T0, 4, 5, -1), (T0 + DAY, 5, 5, 0)]
+    assert filled.trend(account='111') == [(T0, 4, 5, -1), (T0 + DAY, 4, 5, -1)]
+    assert filled.trend(region='us-east-1', service='ec2') == [(T0, 4, 3, 1), (T0 + DAY, 5, 5, 0)]
+
+
+def test_trend_by_type_reads_the_keys(filled):
+    assert filled.trend(instance_type='m5.large') == [(T0, 4, 3, 1), (T0 + DAY, 4, 5, -1)]
+    # Missing from a snapshot counts as nothing
+    assert filled.trend(instance_type='c5.xlarge') == [(T0, 0, 0, 0), (T0 + DAY, 1, 0, 1)]
+    assert filled.trend(instance_type='t3.micro', account='222') == []
+
+
+def test_trend_keeps_the_last_snapshot_of_every_bucket(store):
+    for hour, in_use in ((0, 1), (5, 2), (23, 3), (24, 4), (24 * 8, 5)):
+        store.add(T0 + hour * 3600, (1, 7, 30), [row('111', 'us-east-1', 'ec2', 'm5.large', 0, in_use)])
+    assert [in_use for taken, reserved, in_use, delta in store.trend(every=DAY)] == [3, 4, 5]
+    assert [in_use for taken, reserved, in_use, delta in store.trend(every=EVERY['week'])] == [4, 5]
+    assert [in_use for taken, reserved, in_use, delta in store.trend(since=T0 + 3600, until=T0 + DAY)] == [2, 3, 4]
+
+
+def test_diff_against_the_previous_snapshot(filled):
+    before, after, rows = filled.diff()
+    assert (before[1], after[1]) == (T0, T0 + DAY)
+    assert rows == [
+        (('111', 'eu-west-1', 'ec2', 't3.micro'), (0, 2, -2, '0,0,0,0'), None),
+        (('111', 'us-east-1', 'ec2', 'm5.large'), (4, 3, 1, '0,0,0,0'), (4, 5, -1, '0,0,0,0')),
+        (('222', 'us-east-1', 'ec2', 'c5.xlarge'), None, (1, 0, 1, '0,1,0,0'))
+    ]
+
+
+def test_diff_of_the_first_snapshot_has_nothing_before_it(filled):
+    before, after, rows = filled.diff(snapshot=1)
+    assert before is None and after[1] == T0
+    assert len(rows) == 3
+
+
+def test_diff_of_an_empty_store(store):
+    assert store.diff() == (None, None, [])
+
+
+def test_record_takes_table_reports(store):
+    import instance_count
+    from aggregate import Counts
+    in_use, reserved = Counts(), Counts()
+    in_use.add('m5.large', 3)
+    reserved.add('m5.large', 1)
+    cell = ('111', 'us-east-1')
+    report = ('EC2', 'EC2 Instances', instance_count.cell_collection(cell, in_use),
+              instance_count.cell_collection(cell, reserved, expiries=instance_count.ExpiryPeriods()), [], [])
+    store.record([report], {'EC2 Instances': 'ec2'}, taken=T0)
+    assert store.trend(service='ec2') == [(T0, 1, 3, -2)]
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('2024-03-01', T0),
+    ('2024-03-01T06:30', T0 + 6 * 3600 + 1800),
+    ('2024-03-01T06:30+02:00', T0 + 4 * 3600 + 1800)
+])
+def test_parse_time_reads_iso_times_as_utc(value, expected):
+    assert parse_time(value) == expected
+
+
+def test_parse_time_reads_ages(monkeypatch):
+    monkeypatch.setattr(history.time, 'time', lambda: T0 + 0.5)
+    assert parse_time('12h') == T0 - 12 * 3600
+    assert parse_time('30d') == T0 - 30 * DAY
+    assert parse_time('2w') == T0 - 14 * DAY
+
+
+@pytest.mark.parametrize('value', ['yesterday', '30x', 'd', '2024-13-01'])
+def test_parse_time_refuses_anything_else(value):
+    with pytest.raises(argparse.ArgumentTypeError):
+        parse_time(value)
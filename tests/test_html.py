@@ -0,0 +1,46 @@
+import json
+import re
+import pytest
+import instance_count
+from formatter.formatter import FormatConfig
+from formatter.html import HtmlFormatter
+from formatter.html_compact import CompactHtmlFormatter
+from formatter.sinks import MemorySink
+
+
+EVIL = '<b>x</b><script>alert(1)</script>'
+
+
+def render(cls, **options):
+    sink = MemorySink()
+    formatter = cls(FormatConfig(sink), **options)
+    instances = instance_count.InstancesBase(None)
+    instances.add(EVIL, 2)
+    reserved = instance_count.InstancesBase(None)
+    reserved.expiries = instance_count.ExpiryPeriods((1, 7, 30))
+    reserved.add(EVIL, 1)
+    reserved.expiries.add(EVIL, 1, instance_count.datetime.now(instance_count.timezone.utc))
+    formatter.format_table('EC2 Instances', instances, reserved)
+    formatter.format_breakdown('EC2 Instances by Account', 'Account', {EVIL: (instances, reserved)})
+    formatter.format_rollup('EC2 Instances by tag:team', 'tag:team', [(EVIL, 1, 2, -1)])
+    formatter.format()
+    formatter.cfg.close()
+    return sink.getvalue().decode()
+
+
+@pytest.mark.parametrize('streaming', [False, True])
+def test_html_escapes_keys(streaming):
+    page = render(HtmlFormatter, streaming=streaming)
+    assert '<b>' not in page
+    assert '<script>alert' not in page
+    assert page.count('&lt;b&gt;x&lt;/b&gt;') >= 3
+    # The arrows of the header are still markup
+    assert 'arrow_upward</i>' in page
+
+
+def test_compact_html_embeds_keys_as_data():
+    page = render(CompactHtmlFormatter)
+    assert '<b>' not in page
+    assert '<script>alert' not in page
+    data = json.loads(re.search(r'<script type="application/json" id="d">(.*?)</script>', page, re.S).group(1))
+    assert EVIL in [row[0] for table in data['tables'] for row in table['rows']]
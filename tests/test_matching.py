@@ -0,0 +1,71 @@
+from collections import Counter
+import pytest
+from aggregate import Counts
+import instance_count
+from matching import match, match_gaps, match_rows, match_totals, normalization_factor
+
+
+LINUX = 'Linux/UNIX'
+
+
+def collection(cell, placements):
+    types = Counts()
+    for placement, n in placements.items():
+        types.add(placement[0], n)
+    return instance_count.cell_collection(cell, types, placements=Counter(placements))
+
+
+@pytest.mark.parametrize('instance_type, factor', [
+    ('t3.nano', 0.25), ('m5.large', 4), ('m5.xlarge', 8), ('m5.2xlarge', 16), ('m5.24xlarge', 192), ('m5.metal', None)
+])
+def test_normalization_factor(instance_type, factor):
+    assert normalization_factor(instance_type) == factor
+
+
+def test_zonal_reservations_cover_their_zone_only():
+    unused, uncovered = match({('m5.large', 'us-east-1a', LINUX, 'default'): 2},
+                              {('m5.large', 'us-east-1a', LINUX, 'default'): 1, ('m5.large', 'us-east-1b', LINUX, 'default'): 1})
+    assert +unused == {('m5.large', 'us-east-1a', LINUX, 'default'): 1}
+    assert +uncovered == {('m5.large', 'us-east-1b', LINUX, 'default'): 1}
+
+
+def test_regional_reservations_cover_any_zone():
+    unused, uncovered = match({('c5.large', None, 'Windows', 'default'): 2},
+                              {('c5.large', 'us-east-1a', 'Windows', 'default'): 1, ('c5.large', 'us-east-1b', 'Windows', 'default'): 1})
+    assert not +unused and not +uncovered
+
+
+def test_size_flexible_reservations_cover_the_family():
+    unused, uncovered = match({('m5.2xlarge', None, LINUX, 'default'): 1},
+                              {('m5.large', 'us-east-1a', LINUX, 'default'): 3, ('m5.xlarge', 'us-east-1b', LINUX, 'default'): 1})
+    # 16 units cover three m5.large (12) and half of the m5.xlarge (4 of 8)
+    assert not +unused
+    assert +uncovered == {('m5.xlarge', 'us-east-1b', LINUX, 'default'): 0.5}
+
+
+def test_only_linux_default_tenancy_is_flexible():
+    unused, uncovered = match({('m5.2xlarge', None, 'Windows', 'default'): 1, ('m5.2xlarge', None, LINUX, 'dedicated'): 1},
+                              {('m5.large', 'us-east-1a', 'Windows', 'default'): 1, ('m5.large', 'us-east-1a', LINUX, 'dedicated'): 1})
+    assert sum(unused.values()) == 2
+    assert sum(uncovered.values()) == 2
+
+
+def test_platform_and_tenancy_must_match():
+    unused, uncovered = match({('c5.large', None, 'Windows', 'default'): 1}, {('c5.large', 'us-east-1a', LINUX, 'default'): 1})
+    assert sum(unused.values()) == 1 and sum(uncovered.values()) == 1
+
+
+def test_reservations_only_cover_their_own_cell():
+    reserved = collection(('a', 'us-east-1'), {('m5.large', None, LINUX, 'default'): 2})
+    in_use = collection(('a', 'eu-west-1'), {('m5.large', 'eu-west-1a', LINUX, 'default'): 2})
+    assert match_rows(in_use, reserved) == [('m5.large', 2, 2, 0)]
+    assert match_gaps(in_use, reserved) == (2, 2)
+
+
+def test_gaps_are_not_netted_out_by_the_total():
+    cell = ('a', 'us-east-1')
+    reserved = collection(cell, {('m5.large', None, LINUX, 'default'): 8})
+    in_use = collection(cell, {('m5.large', 'us-east-1a', LINUX, 'default'): 4, ('c5.xlarge', 'us-east-1a', LINUX, 'default'): 4})
+    assert match_rows(in_use, reserved) == [('c5.xlarge', 0, 4, -4), ('m5.large', 8, 4, 4)]
+    assert match_totals(in_use, reserved) == (8, 8, 0)
+    assert match_gaps(in_use, reserved) == (4, 4)
@@ -0,0 +1,78 @@
+import pytest
+import instance_count
+
+
+botocore_session = pytest.importorskip('botocore.session')
+from botocore.stub import Stubber
+
+
+RUNNING = [{'Name': 'instance-state-name', 'Values': ['running']}]
+
+
+def stubbed(service):
+    client = botocore_session.get_session().create_client(
+        service, region_name='us-east-1', aws_access_key_id='AKID', aws_secret_access_key='secret')
+    return client, Stubber(client)
+
+
+def instances(*types):
+    return {'Reservations': [{'Instances': [dict({'InstanceType': it}, **extra) for it, extra in types]}]}
+
+
+def test_instances_follow_next_token():
+    client, stubber = stubbed('ec2')
+    page = dict(instances(('m5.large', {}), ('m5.large', {'InstanceLifecycle': 'spot'})), NextToken='page-2')
+    stubber.add_response('describe_instances', page, {'Filters': RUNNING, 'MaxResults': 5})
+    stubber.add_response('describe_instances', instances(('t3.micro', {})),
+                         {'Filters': RUNNING, 'MaxResults': 5, 'NextToken': 'page-2'})
+    with stubber:
+        collection = instance_count.Instances(client, page_size=5).collect()
+    stubber.assert_no_pending_responses()
+    assert collection.pages == 2
+    # Spot instances cannot use a reservation, so are not counted
+    assert collection.items == 2
+    assert collection.get('m5.large') == 1 and collection.get('t3.micro') == 1
+
+
+@pytest.mark.parametrize('page_size, expected', [(1, 5), (500, 500), (5000, 1000)])
+def test_page_size_is_clamped_to_the_call(page_size, expected):
+    client, stubber = stubbed('ec2')
+    stubber.add_response('describe_instances', instances(), {'Filters': RUNNING, 'MaxResults': expected})
+    with stubber:
+        instance_count.Instances(client, page_size=page_size).collect()
+    stubber.assert_no_pending_responses()
+
+
+def test_no_page_size_leaves_the_call_default():
+    client, stubber = stubbed('ec2')
+    stubber.add_response('describe_instances', instances(('m5.large', {})), {'Filters': RUNNING})
+    with stubber:
+        collection = instance_count.Instances(client).collect()
+    assert (collection.pages, collection.items) == (1, 1)
+
+
+def test_rds_instances_follow_marker():
+    client, stubber = stubbed('rds')
+    stubber.add_response('describe_db_instances', {'DBInstances': [{'DBInstanceClass': 'db.r5.large'}] * 2, 'Marker': 'm2'},
+                         {'MaxRecords': 100})
+    stubber.add_response('describe_db_instances', {'DBInstances': [{'DBInstanceClass': 'db.t3.micro'}]},
+                         {'MaxRecords': 100, 'Marker': 'm2'})
+    with stubber:
+        collection = instance_count.RdsInstances(client, page_size=1000).collect()
+    stubber.assert_no_pending_responses()
+    assert (collection.pages, collection.items) == (2, 3)
+    assert collection.get('db.r5.large') == 2
+
+
+def test_pages_are_read_one_at_a_time():
+    client, stubber = stubbed('ec2')
+    stubber.add_response('describe_instances', dict(instances(('m5.large', {})), NextToken='page-2'))
+    stubber.add_response('describe_instances', instances(('m5.large', {})))
+    collection = instance_count.Instances(client)
+    with stubber:
+        items = collection._items()
+        next(items)
+        # The second page is only requested once the first is used up
+        assert collection.pages == 1
+        assert len(list(items)) == 1
+    assert collection.pages == 2
@@ -0,0 +1,127 @@
+from types import SimpleNamespace
+import pytest
+import ratelimit
+from ratelimit import BACKOFF, MIN_RATE, NULL_BUCKET, RateLimiter, TokenBucket
+
+
+class Clock():
+    '''
+    Stands in for the time module, and only moves when slept on or advanced.
+    '''
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(ratelimit, 'time', clock)
+    return clock
+
+
+class Events():
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, event, handler):
+        self.handlers[event] = handler
+
+
+def test_burst_then_refill_at_the_rate(clock):
+    bucket = TokenBucket(10, 50, 5)
+    for _ in range(5):
+        bucket.acquire()
+    assert clock.slept == []
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(0.1)]
+
+    # A long pause refills the burst, and no more
+    clock.now += 60
+    for _ in range(5):
+        bucket.acquire()
+    assert len(clock.slept) == 1
+    bucket.acquire()
+    assert clock.slept[-1] == pytest.approx(0.1)
+    assert bucket.calls == 12
+
+
+def test_waiting_requests_are_spaced_at_the_rate(clock):
+    bucket = TokenBucket(4, 50, 1)
+    bucket.acquire()
+    # Reserved before either sleeps, as threads arriving together would
+    assert [bucket._reserve() for _ in range(3)] == [pytest.approx(0.25), pytest.approx(0.5), pytest.approx(0.75)]
+
+
+def test_a_throttle_cuts_the_rate_and_the_burst(clock):
+    bucket = TokenBucket(20, 50, 100)
+    bucket.throttled()
+    assert bucket.rate == pytest.approx(20 * BACKOFF)
+    assert bucket.throttles == 1
+    bucket.acquire()
+    assert clock.slept == [pytest.approx(1 / (20 * BACKOFF))]
+
+    for _ in range(100):
+        bucket.throttled()
+    assert bucket.rate == MIN_RATE
+
+
+def test_the_rate_recovers_after_a_throttle(clock):
+    bucket = TokenBucket(20, 25, 100)
+    bucket.throttled()
+    rates = [bucket.rate]
+    # About a request a second more for every second of successful calls
+    for _ in range(500):
+        bucket.succeeded()
+        rates.append(bucket.rate)
+    assert rates == sorted(rates)
+    assert rates[-1] == 25
+
+
+def test_buckets_are_kept_per_account_region_and_call():
+    limiter = RateLimiter()
+    bucket = limiter.bucket('111111111111', 'us-east-1', 'ec2', 'DescribeInstances')
+    assert limiter.bucket('111111111111', 'us-east-1', 'ec2', 'DescribeInstances') is bucket
+    others = [
+        limiter.bucket('222222222222', 'us-east-1', 'ec2', 'DescribeInstances'),
+        limiter.bucket('111111111111', 'eu-west-1', 'ec2', 'DescribeInstances'),
+        limiter.bucket('111111111111', 'us-east-1', 'ec2', 'DescribeReservedInstances')
+    ]
+    assert all(other is not bucket for other in others)
+    assert limiter.bucket(None, None, 'rds', 'DescribeDBInstances') is limiter.bucket('default', 'default', 'rds', 'DescribeDBInstances')
+    # Each service starts at its own rate
+    assert (bucket.rate, bucket.burst) == ratelimit.RATES['ec2'][::2]
+    assert limiter.bucket(None, None, 'rds', 'DescribeDBInstances').rate == ratelimit.DEFAULT_RATE[0]
+
+
+def test_disabled_limiter_hands_out_the_null_bucket():
+    assert RateLimiter(enabled=False).bucket('a', 'us-east-1', 'ec2', 'DescribeInstances') is NULL_BUCKET
+
+
+def test_attached_clients_adapt_to_their_responses(clock):
+    limiter = RateLimiter()
+    events = Events()
+    client = SimpleNamespace(meta=SimpleNamespace(region_name='us-east-1', events=events))
+    limiter.attach(client, '111111111111')
+    bucket = limiter.bucket('111111111111', 'us-east-1', 'ec2', 'DescribeInstances')
+
+    events.handlers['before-send']('before-send.ec2.DescribeInstances')
+    assert bucket.calls == 1
+    retry = events.handlers['needs-retry']
+    retry('needs-retry.ec2.DescribeInstances', response=(SimpleNamespace(status_code=503), {'Error': {'Code': 'RequestLimitExceeded'}}))
+    assert bucket.throttles == 1 and bucket.rate < ratelimit.RATES['ec2'][0]
+    throttled = bucket.rate
+    retry('needs-retry.ec2.DescribeInstances', response=(SimpleNamespace(status_code=200), {}))
+    assert bucket.rate > throttled
+    # Other errors leave the rate alone
+    retry('needs-retry.ec2.DescribeInstances', response=(SimpleNamespace(status_code=400), {'Error': {'Code': 'AuthFailure'}}))
+    assert bucket.throttles == 1
+    assert (limiter.calls, limiter.throttles) == (1, 1)
@@ -0,0 +1,41 @@
+from types import SimpleNamespace
+import pytest
+import instance_count
+
+
+class Pool():
+    def __init__(self):
+        self.calls = 0
+
+    def client(self, service):
+        assert service == 'ec2'
+
+        def describe_regions():
+            self.calls += 1
+            return {'Regions': [{'RegionName': 'us-east-1'}, {'RegionName': 'eu-west-1'}, {'RegionName': 'ap-south-1'}]}
+        return SimpleNamespace(describe_regions=describe_regions)
+
+    def base_session(self):
+        offered = {'ec2': ['af-south-1', 'ap-south-1', 'eu-west-1', 'me-south-1', 'us-east-1'], 'rds': ['eu-west-1', 'us-east-1']}
+        return SimpleNamespace(get_available_regions=offered.__getitem__)
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = Pool()
+    monkeypatch.setattr(instance_count, 'session_pool', lambda: pool)
+    instance_count.enabled_regions.cache_clear()
+    yield pool
+    instance_count.enabled_regions.cache_clear()
+
+
+def test_all_regions_leaves_out_regions_not_enabled(pool):
+    assert instance_count.parse_regions('all', 'ec2') == ['ap-south-1', 'eu-west-1', 'us-east-1']
+    assert instance_count.parse_regions('all', 'rds') == ['eu-west-1', 'us-east-1']
+    assert pool.calls == 1
+
+
+def test_listed_regions(pool):
+    assert instance_count.parse_regions(' us-east-1, me-south-1,', 'ec2') == ['us-east-1', 'me-south-1']
+    assert instance_count.parse_regions(None, 'ec2') == [None]
+    assert pool.calls == 0
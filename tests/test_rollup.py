@@ -0,0 +1,62 @@
+import json
+from collections import Counter
+from aggregate import Counts
+import instance_count
+from partial import read_partials, write_partial
+from rollup import Rollups, rollup_rows
+
+
+LINUX = 'Linux/UNIX'
+GROUP_BY = (('tag:team',), ('tag:team', 'az'))
+LARGE_A = ('m5.large', 'us-east-1a', LINUX, 'default')
+LARGE_B = ('m5.large', 'us-east-1b', LINUX, 'default')
+
+
+def rollups(*items):
+    rollups = Rollups(GROUP_BY)
+    for team, placement, n in items:
+        rollups.add((team, placement[1]), placement, n)
+    return rollups
+
+
+def collection(cell, placements, rollups=None):
+    types = Counts()
+    for placement, n in placements.items():
+        types.add(placement[0], n)
+    return instance_count.cell_collection(cell, types, placements=Counter(placements), rollups=rollups)
+
+
+def test_state_round_trips_through_json():
+    # An untagged item has no team
+    original = rollups(('web', LARGE_A, 2), (None, LARGE_A, 1), ('web', LARGE_B, 3))
+    restored = Rollups.from_state(json.loads(json.dumps(original.state())))
+    assert restored.group_by == original.group_by
+    assert restored.dimensions == ('tag:team', 'az')
+    assert restored.counts == original.counts
+    assert restored.state() == original.state()
+
+
+def test_map_and_reduce_give_the_rollups_of_one_run(tmp_path):
+    cells = [('111111111111', 'us-east-1'), ('222222222222', 'us-east-1')]
+    in_use = [
+        collection(cells[0], {LARGE_A: 3, LARGE_B: 1}, rollups(('web', LARGE_A, 2), (None, LARGE_A, 1), ('db', LARGE_B, 1))),
+        collection(cells[1], {LARGE_A: 2}, rollups(('web', LARGE_A, 2)))
+    ]
+    reserved = [collection(cells[0], {LARGE_A: 2}), collection(cells[1], {LARGE_B: 1})]
+    expected = rollup_rows(instance_count.merge_collections(in_use), instance_count.merge_collections(reserved))
+
+    # One partial per cell, as two map workers would write them
+    paths = []
+    for index, (instances, r_instances) in enumerate(zip(in_use, reserved)):
+        path = str(tmp_path / '{}.json'.format(index))
+        write_partial(path, (1, 7, 30), GROUP_BY, [('ec2', instances.state(), r_instances.state())])
+        paths.append(path)
+    horizons, group_by, tables = read_partials(list(reversed(paths)))
+    assert group_by == list(GROUP_BY)
+    in_use_states, reserved_states = tables['ec2']
+    reduced = rollup_rows(instance_count.collection_from_states(in_use_states),
+                          instance_count.collection_from_states(reserved_states))
+
+    assert reduced == expected
+    # Zone a reservations in the first account cover 2 of its 3 instances there
+    assert expected[0] == (('tag:team',), [('(none)', 0.67, 1, -0.33), ('db', 0, 1, -1), ('web', 1.33, 4, -2.67)])
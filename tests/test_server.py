@@ -0,0 +1,92 @@
+import gzip
+import http.client
+import threading
+from http.server import ThreadingHTTPServer
+import pytest
+from server import ReportServer
+
+
+class Reports():
+    '''
+    collect() and render() for a ReportServer, counting the renderings.
+    '''
+
+    def __init__(self):
+        self.version = 0
+        self.rendered = []
+
+    def collect(self):
+        self.version += 1
+        return ['snapshot {}'.format(self.version)]
+
+    def render(self, protocol, reports):
+        self.rendered.append(protocol)
+        return '{} {}\n'.format(protocol, reports[0]).encode()
+
+
+@pytest.fixture
+def served():
+    reports = Reports()
+    report_server = ReportServer(reports.collect, reports.render)
+    httpd = ThreadingHTTPServer(('127.0.0.1', 0), report_server.handler())
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+
+    def get(path, **headers):
+        connection = http.client.HTTPConnection('127.0.0.1', httpd.server_address[1], timeout=10)
+        try:
+            connection.request('GET', path, headers=headers)
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    yield report_server, reports, get
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_nothing_is_served_before_the_first_snapshot(served):
+    report_server, reports, get = served
+    status, headers, body = get('/metrics')
+    assert status == 503 and headers['Retry-After'] == '5'
+    assert get('/nowhere')[0] == 404
+
+
+def test_current_etag_gets_not_modified(served):
+    report_server, reports, get = served
+    report_server.refresh()
+    status, headers, body = get('/metrics')
+    assert status == 200
+    assert body == b'metrics snapshot 1\n'
+    assert headers['Cache-Control'] == 'no-cache'
+    etag = headers['ETag']
+
+    status, headers, body = get('/metrics', **{'If-None-Match': '"other", ' + etag})
+    assert status == 304 and body == b''
+    assert headers['ETag'] == etag
+    # Rendered once for both requests
+    assert reports.rendered == ['metrics']
+
+
+def test_gzip_has_its_own_etag(served):
+    report_server, reports, get = served
+    report_server.refresh()
+    plain = get('/metrics')[1]['ETag']
+    status, headers, body = get('/metrics', **{'Accept-Encoding': 'gzip'})
+    assert status == 200 and headers['Content-Encoding'] == 'gzip'
+    assert gzip.decompress(body) == b'metrics snapshot 1\n'
+    assert headers['ETag'] != plain
+    assert get('/metrics', **{'Accept-Encoding': 'gzip', 'If-None-Match': plain})[0] == 200
+    assert get('/metrics', **{'Accept-Encoding': 'gzip', 'If-None-Match': headers['ETag']})[0] == 304
+
+
+def test_a_new_snapshot_revalidates(served):
+    report_server, reports, get = served
+    report_server.refresh()
+    etag = get('/report.jsonl')[1]['ETag']
+    report_server.refresh()
+    status, headers, body = get('/report.jsonl', **{'If-None-Match': etag})
+    assert status == 200 and body == b'jsonl snapshot 2\n'
+    assert headers['ETag'] != etag
+    assert get('/report.jsonl', **{'If-None-Match': headers['ETag']})[0] == 304
@@ -0,0 +1,38 @@
+import gzip
+import os
+import stat
+from formatter.sinks import FileSink, GzipSink, open_sink
+
+
+def test_file_sink_renames_into_place_with_the_umask(tmp_path):
+    mask = os.umask(0o027)
+    try:
+        path = str(tmp_path / 'report.html')
+        sink = open_sink(path)
+        assert isinstance(sink, FileSink)
+        sink.write('<html>')
+        assert not os.path.exists(path)
+        sink.close()
+    finally:
+        os.umask(mask)
+    with open(path) as f:
+        assert f.read() == '<html>'
+    assert stat.S_IMODE(os.stat(path).st_mode) == 0o640
+    assert os.listdir(str(tmp_path)) == ['report.html']
+
+
+def test_gzip_sink(tmp_path):
+    path = str(tmp_path / 'report.jsonl.gz')
+    sink = open_sink(path)
+    assert isinstance(sink, GzipSink)
+    sink.write('{"a":1}\n')
+    sink.close()
+    with gzip.open(path, 'rt') as f:
+        assert f.read() == '{"a":1}\n'
+
+
+def test_abort_leaves_nothing(tmp_path):
+    sink = open_sink(str(tmp_path / 'report.csv'))
+    sink.write('partial')
+    sink.abort()
+    assert os.listdir(str(tmp_path)) == []
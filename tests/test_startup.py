@@ -0,0 +1,50 @@
+import json
+import os
+import subprocess
+import sys
+import instance_count
+from bench.suite import SyntheticClient, instance_types
+from cache import ResponseCache
+
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs instance_count with boto3 and botocore unimportable
+BLOCKED = '''
+import runpy, sys
+for name in ('boto3', 'botocore'):
+    sys.modules[name] = None
+sys.argv = ['instance_count.py'] + sys.argv[1:]
+runpy.run_path('instance_count.py', run_name='__main__')
+'''
+
+
+def run_blocked(args, env=None):
+    return subprocess.run([sys.executable, '-c', BLOCKED] + args, cwd=ROOT, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def test_help_does_not_load_boto3():
+    result = run_blocked(['--help'])
+    assert result.returncode == 0, result.stderr
+    assert '--only-service' in result.stdout
+
+
+def test_cached_default_report_does_not_load_boto3(tmp_path):
+    config = tmp_path / 'config'
+    config.write_text('[default]\nregion = eu-west-1\n')
+    env = {name: value for name, value in os.environ.items()
+           if name not in ('AWS_PROFILE', 'AWS_DEFAULT_PROFILE', 'AWS_DEFAULT_REGION')}
+    env.update(AWS_CONFIG_FILE=str(config), HOME=str(tmp_path))
+
+    # What an earlier run of the caller's own account and region cached
+    cache = ResponseCache(str(tmp_path / 'cache'), 3600)
+    client = SyntheticClient('eu-west-1', 30, 4, instance_types(8))
+    expected = instance_count.Instances(client, cache=cache).collect()
+    instance_count.ReservedInstances(client, cache=cache).collect()
+
+    result = run_blocked(['--services', 'ec2', '--max-age', '3600', '--cache-dir', str(tmp_path / 'cache'), '-p', 'jsonl'], env)
+    assert result.returncode == 0, result.stderr
+    rows = [json.loads(line) for line in result.stdout.splitlines()]
+    assert {(row['account'], row['region']) for row in rows} == {('default', 'eu-west-1')}
+    assert sum(row['in_use'] for row in rows) == expected.total
@@ -0,0 +1,138 @@
+import io
+import json
+import threading
+from types import SimpleNamespace
+import pytest
+import instance_count
+import tracing
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    monkeypatch.setattr(tracing, '_tracer', None)
+    return tracing.enable()
+
+
+class Paginator():
+    def __init__(self, pages):
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        return iter(self.pages)
+
+
+class Client():
+    '''
+    A describe_instances paginator over pages with response metadata.
+    '''
+
+    def __init__(self, *pages):
+        self.meta = SimpleNamespace(region_name='us-east-1')
+        self.pages = [
+            {
+                'Reservations': [{'Instances': [{'InstanceType': it} for it in types]}],
+                'ResponseMetadata': {'RetryAttempts': retries, 'HTTPHeaders': {'content-length': str(size)}}
+            }
+            for types, retries, size in pages
+        ]
+
+    def can_paginate(self, operation):
+        return True
+
+    def get_paginator(self, operation):
+        return Paginator(self.pages)
+
+
+def spans(tracer, name):
+    return [span for span in tracer.spans if span[0] == name]
+
+
+def test_spans_do_nothing_until_enabled(monkeypatch):
+    monkeypatch.setattr(tracing, '_tracer', None)
+    with tracing.span('quiet', items=1) as span:
+        span.add('items')
+    assert span is tracing.NULL_SPAN
+
+
+def test_spans_nest(tracer):
+    with tracing.span('outer', 'test') as outer:
+        with tracing.span('inner', 'test', n=1) as inner:
+            inner.add('items', 2)
+            inner.add('items')
+        outer.set('pages', 1)
+    # Recorded as they finish, so the inner span first
+    assert [span[0] for span in tracer.spans] == ['inner', 'outer']
+    (_, _, inner_start, inner_duration, inner_tid, inner_args), (_, _, outer_start, outer_duration, outer_tid, outer_args) = tracer.spans
+    assert outer_start <= inner_start
+    assert inner_start + inner_duration <= outer_start + outer_duration
+    assert inner_tid == outer_tid
+    assert inner_args == {'n': 1, 'items': 3} and outer_args == {'pages': 1}
+
+
+def test_dropped_spans_are_not_recorded(tracer):
+    with tracing.span('kept'):
+        with tracing.span('dropped') as span:
+            span.drop()
+    assert [span[0] for span in tracer.spans] == ['kept']
+
+
+def test_paginate_records_a_span_per_page(tracer):
+    client = Client((['m5.large', 'm5.large'], 0, 120), (['t3.micro'], 2, 80), ([], 0, 10))
+    collection = instance_count.Instances(client).collect()
+    assert collection.pages == 3 and collection.items == 3
+
+    # None for running out of pages
+    pages = spans(tracer, 'page')
+    assert len(pages) == 3
+    assert [(span[1], span[5]) for span in pages] == [
+        ('aws', {'operation': 'describe_instances', 'retries': 0, 'bytes': 120}),
+        ('aws', {'operation': 'describe_instances', 'retries': 2, 'bytes': 80}),
+        ('aws', {'operation': 'describe_instances', 'retries': 0, 'bytes': 10})
+    ]
+    (collect,) = spans(tracer, 'describe_instances')
+    assert collect[1] == 'collect'
+    assert collect[5] == {'account': 'default', 'region': 'us-east-1', 'items': 3, 'pages': 3}
+    # Each page is read inside the collection's span
+    for page in pages:
+        assert collect[2] <= page[2] and page[2] + page[3] <= collect[2] + collect[3]
+
+
+def test_summary_adds_up_the_spans(tracer):
+    instance_count.Instances(Client((['m5.large'], 1, 100), (['m5.large'], 0, 50))).collect()
+    out = io.StringIO()
+    tracer.summary(out)
+    rows = {tuple(line.split()[:2]): line.split()[2:] for line in out.getvalue().splitlines()[1:]}
+    count, total, mean, longest, pages_bytes, retries = rows[('aws', 'page')]
+    assert (count, pages_bytes, retries) == ('2', '150', '1')
+    count, total, mean, longest, items, pages = rows[('collect', 'describe_instances')]
+    assert (count, items, pages) == ('1', '2', '2')
+
+
+def test_write_saves_chrome_trace_events(tracer, tmp_path):
+    with tracing.span('outer', 'test', table='EC2'):
+        pass
+    path = tmp_path / 'trace.json'
+    tracer.write(str(path))
+    trace = json.loads(path.read_text())
+    (event,) = trace['traceEvents']
+    assert event['name'] == 'outer' and event['cat'] == 'test' and event['ph'] == 'X'
+    assert event['ts'] >= 0 and event['dur'] >= 0
+    assert event['args'] == {'table': 'EC2'}
+
+
+def profiled_worker():
+    return sum(range(1000))
+
+
+def test_profiler_combines_the_worker_threads():
+    profiler = tracing.Profiler()
+    profiler.start()
+    try:
+        thread = threading.Thread(target=profiled_worker)
+        thread.start()
+        thread.join()
+    finally:
+        profiler.stop()
+    assert len(profiler.profiles) >= 2
+    functions = {function for filename, line, function in profiler.stats().stats}
+    assert 'profiled_worker' in functions
@@ -0,0 +1,132 @@
+import io
+import re
+import threading
+from types import SimpleNamespace
+import pytest
+import instance_count
+from aggregate import Counts
+from watch import CSI, LiveScreen
+
+
+ANSI = re.compile(r'\x1b\[[0-9;?]*[A-Za-z]')
+REGIONS = ('us-east-1', 'eu-west-1', 'ap-south-1')
+
+
+@pytest.fixture(autouse=True)
+def terminal(monkeypatch):
+    monkeypatch.setenv('COLUMNS', '120')
+    monkeypatch.setenv('LINES', '40')
+
+
+def test_only_changed_rows_are_redrawn():
+    out = io.StringIO()
+    screen = LiveScreen(out)
+    assert screen.update(['status', 'a', 'b', 'c']) == 4
+    assert out.getvalue().startswith(CSI + '2J')
+
+    out.seek(0)
+    out.truncate()
+    assert screen.update(['status', 'a', 'B', 'c']) == 1
+    # Row 3, addressed by the cursor, and cleared to the end of the line
+    assert out.getvalue() == CSI + '3;1HB' + CSI + 'K'
+
+    out.seek(0)
+    out.truncate()
+    assert screen.update(['status', 'a', 'B', 'c']) == 0
+    assert out.getvalue() == ''
+
+
+def test_fewer_lines_clear_the_rest_of_the_screen():
+    out = io.StringIO()
+    screen = LiveScreen(out)
+    screen.update(['a', 'b', 'c'])
+    out.seek(0)
+    out.truncate()
+    assert screen.update(['a']) == 0
+    assert out.getvalue() == CSI + '2;1H' + CSI + 'J'
+
+
+def test_lines_beyond_the_terminal_are_summarised(monkeypatch):
+    monkeypatch.setenv('LINES', '5')
+    screen = LiveScreen(io.StringIO())
+    screen.update([str(n) for n in range(10)])
+    assert screen.lines == ['0', '1', '2', '3', '... 6 more lines']
+
+
+def test_stop_leaves_the_last_lines_on_the_screen():
+    out = io.StringIO()
+    screen = LiveScreen(out)
+    screen.start()
+    screen.update(['one', 'two'])
+    screen.stop()
+    assert out.getvalue().endswith(CSI + '?1049lone\ntwo\n')
+
+
+class Scheduler():
+    '''
+    Finishes one target at a time, and waits for the screen to be drawn
+    after each, as a slow collection would.
+    '''
+
+    def __init__(self, on_target, drawn):
+        self.on_target = on_target
+        self.drawn = drawn
+
+    def finish(self, title, side, key, collection):
+        self.drawn.clear()
+        self.on_target(title, side, key, collection)
+        assert self.drawn.wait(10)
+
+    def results(self):
+        in_use, reserved = {}, {}
+        for region in REGIONS:
+            key = ('default', region)
+            types = Counts()
+            types.add('m5.large', 2)
+            in_use[key] = instance_count.cell_collection(key, types)
+            self.finish('EC2 Instances', 0, key, in_use[key])
+            reserved[key] = instance_count.cell_collection(key, Counts(), expiries=instance_count.ExpiryPeriods())
+            self.finish('EC2 Instances', 1, key, reserved[key])
+        yield ('EC2 Instances',
+               (instance_count.merge_collections(list(in_use.values())), in_use),
+               (instance_count.merge_collections(list(reserved.values())), reserved))
+
+
+def in_use_counts(frame):
+    rows = [ANSI.sub('', line).split() for line in frame]
+    return [int(row[2]) for row in rows if row[:1] == ['m5.large']]
+
+
+def test_watch_draws_each_table_as_its_targets_finish(monkeypatch):
+    frames = []
+    drawn = threading.Event()
+    update = LiveScreen.update
+
+    def record(screen, lines):
+        frames.append(list(lines))
+        drawn.set()
+        return update(screen, lines)
+
+    def sleep(seconds):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(LiveScreen, 'update', record)
+    monkeypatch.setattr(instance_count, 'schedule_tables', lambda args, cache=None, on_target=None: Scheduler(on_target, drawn))
+    monkeypatch.setattr(instance_count, 'time', SimpleNamespace(time=lambda: 0, sleep=sleep))
+    monkeypatch.setattr('sys.stdout', io.StringIO())
+    args = SimpleNamespace(services=('ec2',), interval=60, history=None, by_account=False, by_region=True,
+                           group_by=(), horizons=instance_count.DEFAULT_HORIZONS)
+    instance_count.run_watch(args)
+
+    statuses = [frame[0] for frame in frames]
+    assert statuses[0].startswith('Collecting 1 tables')
+    assert statuses[-1].startswith('Updated')
+    partial = [frame for frame in frames if frame[0].startswith('Collected 0 of 1 tables')]
+    assert len(partial) == 2 * len(REGIONS)
+    # The table grows by a region's instances as each one finishes
+    assert [in_use_counts(frame)[0] for frame in partial] == [2, 2, 4, 4, 6, 6]
+    assert not any('by Region' in line for frame in partial for line in frame)
+    # The finished table adds its breakdown
+    final = frames[-1]
+    assert any('by Region' in line for line in final)
+    assert in_use_counts(final)[:1] == [6]
@@ -0,0 +1,198 @@
+'''
+Spans for --trace, and a profiler for --profile.  Code marks the work it does
+with
+
+    with tracing.span('name', 'category', key=value) as span:
+        span.add('items', n)
+
+Until enable() is called, span() hands back one shared object that does
+nothing, so tracing costs a function call when it is off.
+'''
+import io
+import json
+import os
+import sys
+import threading
+import time
+
+
+# Span args added up in the summary table
+SUMMED = ('items', 'pages', 'bytes', 'retries')
+
+
+class NullSpan():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, key, value):
+        pass
+
+    def add(self, key, value=1):
+        pass
+
+    def drop(self):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+class Span():
+    __slots__ = ('tracer', 'name', 'cat', 'args', 'start')
+
+    def __init__(self, tracer, name, cat, args):
+        self.tracer = tracer
+        self.name = name
+        self.cat = cat
+        self.args = args
+        self.start = None
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.tracer is not None:
+            self.tracer.finish(self, time.perf_counter())
+        return False
+
+    def set(self, key, value):
+        self.args[key] = value
+
+    def add(self, key, value=1):
+        self.args[key] = self.args.get(key, 0) + value
+
+    def drop(self):
+        '''
+        Stops the span from being recorded.
+        '''
+        self.tracer = None
+
+
+class Tracer():
+    '''
+    Records finished spans, and writes them as Chrome trace events, which can
+    be loaded in chrome://tracing or https://ui.perfetto.dev.
+    '''
+
+    def __init__(self):
+        self.origin = time.perf_counter()
+        self.spans = []
+
+    def span(self, name, cat, args):
+        return Span(self, name, cat, args)
+
+    def finish(self, span, end):
+        self.spans.append((span.name, span.cat, span.start, end - span.start, threading.get_ident(), span.args))
+
+    def trace_events(self):
+        pid = os.getpid()
+        return [
+            {
+                'name': name,
+                'cat': cat,
+                'ph': 'X',
+                'ts': (start - self.origin) * 1e6,
+                'dur': duration * 1e6,
+                'pid': pid,
+                'tid': tid,
+                'args': args
+            }
+            for name, cat, start, duration, tid, args in self.spans
+        ]
+
+    def write(self, path):
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': self.trace_events(), 'displayTimeUnit': 'ms'}, f)
+
+    def summary(self, file=sys.stderr):
+        '''
+        Prints the count and time of each kind of span, with its summed args.
+        '''
+        rows = {}
+        for name, cat, start, duration, tid, args in self.spans:
+            row = rows.setdefault((cat, name), {'count': 0, 'total': 0.0, 'max': 0.0})
+            row['count'] += 1
+            row['total'] += duration
+            row['max'] = max(row['max'], duration)
+            for key in SUMMED:
+                if key in args:
+                    row[key] = row.get(key, 0) + args[key]
+
+        print('{:<12}{:<32}{:>8}{:>11}{:>11}{:>11}{:>10}{:>8}{:>12}{:>9}'.format(
+            'Category', 'Span', 'Count', 'Total s', 'Mean ms', 'Max ms', 'Items', 'Pages', 'Bytes', 'Retries'), file=file)
+        for (cat, name), row in sorted(rows.items(), key=lambda item: -item[1]['total']):
+            print('{:<12}{:<32}{:>8}{:>11.3f}{:>11.2f}{:>11.2f}{:>10}{:>8}{:>12}{:>9}'.format(
+                cat, name, row['count'], row['total'], row['total'] / row['count'] * 1e3, row['max'] * 1e3,
+                row.get('items', ''), row.get('pages', ''), row.get('bytes', ''), row.get('retries', '')), file=file)
+
+
+_tracer = None
+
+
+def enable():
+    '''
+    Starts recording spans, and returns the Tracer.
+    '''
+    global _tracer
+    _tracer = Tracer()
+    return _tracer
+
+
+def span(name, cat='run', **args):
+    if _tracer is None:
+        return NULL_SPAN
+    return _tracer.span(name, cat, args)
+
+
+class Profiler():
+    '''
+    cProfile for the main thread and every thread started after start(), such
+    as the collection workers, whose stats are combined at the end.
+    '''
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def _start_thread(self, frame, event, arg):
+        import cProfile
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        # Replaces this hook for the rest of the thread
+        profile.enable()
+
+    def start(self):
+        # cProfile and pstats are only imported when profiling
+        import cProfile
+        main = cProfile.Profile()
+        self.profiles.append(main)
+        threading.setprofile(self._start_thread)
+        main.enable()
+
+    def stop(self):
+        self.profiles[0].disable()
+        threading.setprofile(None)
+
+    def stats(self, stream=None):
+        import pstats
+        with self.lock:
+            stats = pstats.Stats(self.profiles[0], stream=stream)
+            for profile in self.profiles[1:]:
+                stats.add(profile)
+        return stats
+
+    def write(self, path, top=25, file=sys.stderr):
+        '''
+        Saves the combined stats to path, for pstats or snakeviz, and prints
+        the top functions by cumulative time.
+        '''
+        stream = io.StringIO()
+        stats = self.stats(stream)
+        stats.dump_stats(path)
+        stats.sort_stats('cumulative').print_stats(top)
+        print(stream.getvalue(), file=file)
@@ -0,0 +1,81 @@
+'''
+A live view of the terminal report for --watch.  The screen is drawn once,
+then each update rewrites only the rows whose text changed, each addressed by
+its row number, so a table whose counts did not change costs nothing to
+refresh, and a run left going for hours over SSH sends a few bytes per
+change rather than the whole report.
+'''
+import shutil
+import sys
+
+
+CSI = '\x1b['
+
+
+class LiveScreen():
+    '''
+    The terminal's alternate screen, drawn from a list of lines.  Lines must
+    not contain newlines, and are not wrapped, so each stays on its own row.
+    Lines beyond the height of the terminal are summarised in the last row.
+    '''
+
+    def __init__(self, file=None):
+        self.file = sys.stdout if file is None else file
+        self.lines = []
+        self.size = None
+        self.rows_written = 0
+
+    def start(self):
+        # Alternate screen, hidden cursor, no line wrapping
+        self._write(CSI + '?1049h' + CSI + '?25l' + CSI + '?7l')
+
+    def stop(self):
+        '''
+        Restores the terminal, and prints the last lines drawn to it, so they
+        are left on the normal screen.
+        '''
+        self._write(CSI + '?7h' + CSI + '?25h' + CSI + '?1049l')
+        self._write(''.join(line + '\n' for line in self.lines))
+
+    def _write(self, text):
+        self.file.write(text)
+        self.file.flush()
+
+    def _fit(self, lines, height):
+        if len(lines) <= height:
+            return lines
+        return lines[:height - 1] + ['... {} more lines'.format(len(lines) - height + 1)]
+
+    def update(self, lines):
+        '''
+        Draws lines, rewriting only the rows that differ from the last update,
+        and returns how many rows were written.  Everything is redrawn after
+        the terminal is resized.
+        '''
+        size = shutil.get_terminal_size()
+        lines = self._fit(lines, size.lines)
+        out = []
+        old = self.lines
+        if size != self.size:
+            out.append(CSI + '2J')
+            old = []
+            self.size = size
+        written = 0
+        for row, line in enumerate(lines):
+            if row >= len(old) or old[row] != line:
+                out.append('{}{};1H{}{}K'.format(CSI, row + 1, line, CSI))
+                written += 1
+        if len(lines) < len(old):
+            out.append('{}{};1H{}J'.format(CSI, len(lines) + 1, CSI))
+        self.lines = lines
+        if out:
+            self._write(''.join(out))
+        self.rows_written += written
+        return written
+
+
+def split_lines(lines):
+    '''
+    Splits lines that contain newlines into one line per row.
+    '''
+    return [part for line in lines for part in line.split('\n')]